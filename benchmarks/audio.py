@@ -0,0 +1,72 @@
+import array
+import math
+import sys
+
+# The few PCM and mu-law conversions the benchmarks need, in plain Python:
+# audioop is gone in Python 3.13. Samples are 16-bit little-endian unless a
+# width is given.
+
+
+def _ulaw_encode(sample):
+    # G.711 mu-law for one 16-bit sample
+    sign = 0x80 if sample < 0 else 0
+    magnitude = min(abs(sample), 32635) + 0x84
+    exponent = min(7, max(0, magnitude.bit_length() - 8))
+    mantissa = (magnitude >> (exponent + 3)) & 0x0F
+    return ~(sign | exponent << 4 | mantissa) & 0xFF
+
+
+# Indexed by the sample as an unsigned 16-bit value
+LINEAR_TO_ULAW = bytes(_ulaw_encode(v - 65536 if v >= 32768 else v) for v in range(65536))
+
+
+def samples(pcm):
+    values = array.array("h", pcm[:len(pcm) // 2 * 2])
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def pcm16(values):
+    out = array.array("h", (max(-32768, min(32767, int(v))) for v in values))
+    if sys.byteorder == "big":
+        out.byteswap()
+    return out.tobytes()
+
+
+def to_16bit(pcm, width):
+    # 8-bit WAV is unsigned, wider samples keep their top two bytes
+    if width == 2:
+        return pcm
+    if width == 1:
+        return pcm16((b - 128) << 8 for b in pcm)
+    return b"".join(pcm[i + width - 2:i + width] for i in range(0, len(pcm), width))
+
+
+def to_mono(pcm):
+    values = samples(pcm)
+    return pcm16((left + right) // 2 for left, right in zip(values[::2], values[1::2]))
+
+
+def resample(pcm, rate, new_rate):
+    # Linear interpolation, plenty for speech going to 8 kHz
+    values = samples(pcm)
+    if rate == new_rate or not values:
+        return pcm
+    count = int(len(values) * new_rate / rate)
+    out = []
+    for i in range(count):
+        position = i * rate / new_rate
+        j = int(position)
+        following = values[min(j + 1, len(values) - 1)]
+        out.append(values[j] + (following - values[j]) * (position - j))
+    return pcm16(out)
+
+
+def ulaw(pcm):
+    return bytes(LINEAR_TO_ULAW[v & 0xFFFF] for v in samples(pcm))
+
+
+def rms(pcm):
+    values = samples(pcm)
+    return int(math.sqrt(sum(v * v for v in values) / len(values))) if values else 0
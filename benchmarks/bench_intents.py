@@ -0,0 +1,77 @@
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from intent_router import IntentRouter, TEST_PATH, load_examples
+
+# Offline accuracy and latency of the local SMS intent router on the labeled
+# messages in intents/test.jsonl.
+#
+#   python benchmarks/bench_intents.py --threshold 0.85
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", default=TEST_PATH)
+    parser.add_argument("--threshold", type=float, default=None)
+    parser.add_argument("--repeat", type=int, default=200, help="timing passes over the data")
+    parser.add_argument("--verbose", action="store_true", help="list every misrouted message")
+    args = parser.parse_args()
+
+    router = IntentRouter()
+    if args.threshold is not None:
+        router.threshold = args.threshold
+    examples = load_examples(args.data)
+
+    routed = correct_routed = deferred = 0
+    correct_top = 0
+    by_source = {}
+    for text, intent in examples:
+        predicted, confidence, source = router.classify(text)
+        correct_top += predicted == intent
+        decision = router.route(text)
+        if decision is None:
+            deferred += 1
+            # Deferring a chat message is the right call
+            by_source.setdefault("llm", [0, 0])
+            by_source["llm"][0] += 1
+            by_source["llm"][1] += intent == "chat"
+            continue
+        routed += 1
+        ok = decision["name"] == intent
+        correct_routed += ok
+        by_source.setdefault(source, [0, 0])
+        by_source[source][0] += 1
+        by_source[source][1] += ok
+        if args.verbose and not ok:
+            print(f"  misrouted {text!r}: {intent} -> {decision['name']} ({source} {confidence:.2f})")
+        elif args.verbose and ok and intent == "search_bing":
+            print(f"  {text!r} -> query {decision['arguments']['query']!r}")
+
+    timings = []
+    for _ in range(args.repeat):
+        for text, _ in examples:
+            started = time.perf_counter()
+            router.route(text)
+            timings.append(time.perf_counter() - started)
+    timings.sort()
+
+    tool_messages = sum(intent != "chat" for _, intent in examples)
+    print(f"{len(examples)} messages, threshold {router.threshold}")
+    print(f"top-1 accuracy        {correct_top / len(examples):.1%}")
+    print(f"routed locally        {routed} ({routed / len(examples):.1%}), "
+          f"precision {correct_routed / max(routed, 1):.1%}")
+    print(f"tool requests caught  {correct_routed}/{tool_messages} ({correct_routed / max(tool_messages, 1):.1%})")
+    print(f"deferred to the LLM   {deferred}")
+    for source, (count, ok) in sorted(by_source.items()):
+        print(f"  {source:<6} {count:>4} decisions, {ok / count:.1%} right")
+    print(f"latency               median {statistics.median(timings) * 1e6:.0f}us, "
+          f"p99 {timings[int(len(timings) * 0.99)] * 1e6:.0f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stubs import StubConfig, start_stubs, stub_env
+
+# Checks quick_research against the SerpAPI stub in benchmarks/stubs.py,
+# which shares half of its results between queries: merged results carry
+# every URL once, a sub-query slower than the deadline is dropped without
+# holding up the rest, and repeating a topic is answered from the search
+# cache. Exits non-zero when a check fails.
+#
+#   python benchmarks/bench_research.py --deadline 1 --latency 0.3
+
+SLOW_ANGLE = "pros and cons"
+
+
+def check(label, ok, detail=""):
+    print(f"  {'ok  ' if ok else 'FAIL'} {label}{f' ({detail})' if detail else ''}")
+    return ok
+
+
+async def timed_research(quick_research, topic, deadline, config):
+    before = config.requests.get("serp", 0)
+    started = time.perf_counter()
+    text, sources = await quick_research(topic, deadline=deadline, with_sources=True)
+    return text, sources, time.perf_counter() - started, config.requests.get("serp", 0) - before
+
+
+def expected_urls(queries, per_query):
+    # The stub's results: even ranks are shared by every query, odd ranks are the query's own
+    shared = (per_query + 1) // 2
+    return shared + (per_query - shared) * queries
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--deadline", type=float, default=1.0)
+    parser.add_argument("--latency", type=float, default=0.3, help="SerpAPI stub latency, seconds")
+    parser.add_argument("--stub-port", type=int, default=8794)
+    args = parser.parse_args()
+
+    # Read when the modules are imported: route SerpAPI to the stub and
+    # leave room in the digest for every merged result
+    os.environ.update(stub_env(args.stub_port))
+    os.environ["RESEARCH_TOKEN_BUDGET"] = "10000"
+    import clients
+    from tools import quick_research as research
+
+    config = StubConfig(serp_latency=args.latency)
+    stubs = await start_stubs(config, args.stub_port)
+    ok = True
+    try:
+        print("Dedupe")
+        queries = research.expand_queries("solar panels")
+        _, sources, elapsed, requests = await timed_research(research.quick_research, "solar panels",
+                                                             args.deadline + 2, config)
+        urls = [source["url"] for source in sources]
+        expected = expected_urls(len(queries), research.RESULTS_PER_QUERY)
+        ok &= check(f"{len(queries)} sub-queries sent at once",
+                    requests == len(queries) and elapsed < args.latency * 2, f"{requests} requests in {elapsed:.2f}s")
+        ok &= check("every URL once", len(urls) == len(set(urls)) == expected,
+                    f"{len(urls)} sources, {expected} expected")
+
+        print(f"Deadline, '{SLOW_ANGLE}' takes {args.deadline + 2:.1f}s")
+        config.serp_query_latency = {SLOW_ANGLE: args.deadline + 2}
+        _, sources, elapsed, requests = await timed_research(research.quick_research, "heat pumps",
+                                                             args.deadline, config)
+        ok &= check("answered at the deadline", elapsed < args.deadline + 0.5, f"{elapsed:.2f}s")
+        kept = expected_urls(len(queries) - 1, research.RESULTS_PER_QUERY)
+        ok &= check("slow sub-query dropped, the rest kept", len(sources) == kept,
+                    f"{len(sources)} sources, {kept} expected")
+
+        print("Cache")
+        _, sources, elapsed, requests = await timed_research(research.quick_research, "solar panels",
+                                                             args.deadline, config)
+        ok &= check("repeat topic served from the cache", requests == 0,
+                    f"{requests} requests in {elapsed * 1000:.1f}ms")
+        _, _, _, requests = await timed_research(research.quick_research, "heat pumps", args.deadline, config)
+        ok &= check("dropped sub-query not cached", requests == 1, f"{requests} requests")
+        print(f"\nSearch cache: {research.search_cache.counters}")
+    finally:
+        await clients.shutdown()
+        await stubs.cleanup()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
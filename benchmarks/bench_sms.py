@@ -0,0 +1,135 @@
+import argparse
+import asyncio
+import os
+import re
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stubs import StubConfig, start_stubs
+
+# Checks the outbound SMS sender against the Twilio stub in
+# benchmarks/stubs.py: long replies are split within the segment limit and
+# arrive whole, every recipient gets its messages in order, and 503s are
+# retried with backoff without texting anything twice. Exits non-zero when a
+# check fails.
+#
+#   python benchmarks/bench_sms.py --recipients 5 --messages 6 --failure-rate 0.3
+
+LONG_GSM = " ".join(f"Sentence {i} of a long reply about the weather, the news and whatever else came up." for i in range(20))
+LONG_UCS2 = " ".join(f"Réponse {i} — il fait beau aujourd’hui ☀️ et demain aussi." for i in range(20))
+PART_NUMBER = re.compile(r" \(\d+/\d+\)$")
+
+
+def check(label, ok, detail=""):
+    print(f"  {'ok  ' if ok else 'FAIL'} {label}{f' ({detail})' if detail else ''}")
+    return ok
+
+
+async def bench_splitting(sender, config, sms_sender):
+    print("Splitting")
+    ok = True
+    for label, body in (("GSM-7", LONG_GSM), ("UCS-2", LONG_UCS2)):
+        config.sms.clear()
+        to = f"+1555000{len(body) % 1000:04d}"
+        await sender.send(to=to, from_="+15550000000", body=body)
+        parts = [text for recipient, _, text in config.sms if recipient == to]
+        counts = [sms_sender.segment_count(part) for part in parts]
+        ok &= check(f"{label} reply fits {sms_sender.SMS_MAX_SEGMENTS} segments per message",
+                    max(counts) <= sms_sender.SMS_MAX_SEGMENTS, f"{len(parts)} messages, segments {counts}")
+        rejoined = " ".join(PART_NUMBER.sub("", part) for part in parts)
+        ok &= check(f"{label} reply arrives whole", rejoined.split() == body.split())
+    return ok
+
+
+async def bench_ordering(sender, config, recipients, messages):
+    print(f"Ordering, {recipients} recipients x {messages} messages")
+    config.sms.clear()
+    bodies = {f"+1555100{r:04d}": [f"Message {i} for recipient {r}" for i in range(messages)]
+              for r in range(recipients)}
+    started = time.perf_counter()
+    # Everything is queued at once, like a streamed summary
+    futures = [future for to, items in bodies.items() for body in items
+               for future in sender.enqueue(to=to, from_="+15550000000", body=body)]
+    results = await asyncio.gather(*futures, return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    failed = [result for result in results if isinstance(result, Exception)]
+
+    ok = check("every message accepted", not failed, f"{len(failed)} failed" if failed else "")
+    received = {}
+    for to, _, body in config.sms:
+        received.setdefault(to, []).append(body)
+    ok &= check("per-recipient order kept", all(received.get(to) == items for to, items in bodies.items()))
+    duplicates = len(config.sms) - len({(to, body) for to, _, body in config.sms})
+    ok &= check("no message sent twice", duplicates == 0, f"{duplicates} duplicates" if duplicates else "")
+    print(f"  {len(futures)} messages in {elapsed:.2f}s")
+    return ok
+
+
+async def bench_retries(sender, config, failure_rate, count, sms_sender):
+    print(f"Retries, {failure_rate:.0%} of requests answered with 503")
+    config.sms.clear()
+    config.sms_failure_rate = failure_rate
+    requests_before = config.requests.get("sms", 0)
+    retries_before = sender.counters["retries"]
+    to = "+15552000000"
+    timings = []
+    ok = True
+    try:
+        for i in range(count):
+            started = time.perf_counter()
+            try:
+                await sender.send(to=to, from_="+15550000000", body=f"Retry check {i}")
+            except Exception as e:
+                ok &= check(f"message {i} delivered", False, repr(e))
+            timings.append(time.perf_counter() - started)
+    finally:
+        config.sms_failure_rate = 0.0
+
+    rejected = config.requests.get("sms", 0) - requests_before - len(config.sms)
+    retries = sender.counters["retries"] - retries_before
+    ok &= check("every 503 retried", retries == rejected, f"{rejected} 503s, {retries} retries")
+    ok &= check("no message sent twice", len(config.sms) == len({body for _, _, body in config.sms}))
+    ok &= check("delivered in order", [body for _, _, body in config.sms] == [f"Retry check {i}" for i in range(count)])
+    slow = [t for t in timings if t >= 1]
+    print(f"  median {statistics.median(timings):.2f}s, max {max(timings):.2f}s, "
+          f"{len(slow)} of {count} waited out a backoff")
+    return ok
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--recipients", type=int, default=5)
+    parser.add_argument("--messages", type=int, default=6, help="messages per recipient")
+    parser.add_argument("--failure-rate", type=float, default=0.3)
+    parser.add_argument("--retry-messages", type=int, default=10)
+    parser.add_argument("--interval", type=float, default=0.05, help="SMS_RECIPIENT_INTERVAL for the run")
+    parser.add_argument("--stub-port", type=int, default=8792)
+    args = parser.parse_args()
+
+    # Read when sms_sender is imported
+    os.environ["SMS_RECIPIENT_INTERVAL"] = str(args.interval)
+    os.environ.setdefault("SMS_MAX_ATTEMPTS", "8")
+    import clients
+    import sms_sender
+
+    config = StubConfig(sms_latency=0.02)
+    stubs = await start_stubs(config, args.stub_port)
+    sender = sms_sender.SmsSender(account_sid="ACstub", auth_token="stub",
+                                  base_url=f"http://127.0.0.1:{args.stub_port}")
+    try:
+        ok = await bench_splitting(sender, config, sms_sender)
+        ok &= await bench_ordering(sender, config, args.recipients, args.messages)
+        ok &= await bench_retries(sender, config, args.failure_rate, args.retry_messages, sms_sender)
+        print(f"\nSender: {sender.stats()}")
+    finally:
+        await clients.shutdown()
+        await stubs.cleanup()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,85 @@
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stubs import StubConfig, start_stubs
+
+# Runs the batch sound-effect generator against the sound-generation stub in
+# benchmarks/stubs.py, which answers some requests with 429s and 500s and
+# streams the rest in chunks. A first run, cut short after half the prompts,
+# retries through the errors; a second run over every prompt must only
+# request what the first didn't finish. Works in a throwaway folder and
+# exits non-zero when a check fails.
+#
+#   python benchmarks/bench_sound_effects.py --prompts 12 --rate-limit-rate 0.3 --failure-rate 0.2
+
+
+def check(label, ok, detail=""):
+    print(f"  {'ok  ' if ok else 'FAIL'} {label}{f' ({detail})' if detail else ''}")
+    return ok
+
+
+async def run(sound_effects, prompts, folder, url, concurrency, config, label):
+    before = config.requests.get("sfx", 0)
+    started = time.perf_counter()
+    entries = await sound_effects.generate_sound_effects_async(prompts, output_folder=folder,
+                                                               concurrency=concurrency, url=url)
+    elapsed = time.perf_counter() - started
+    requests = config.requests.get("sfx", 0) - before
+    done = sum(entry["status"] == "done" for entry in entries)
+    print(f"{label}: {done}/{len(prompts)} done, {requests} requests in {elapsed:.1f}s")
+    return entries, requests
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prompts", type=int, default=12)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.3, help="share of requests answered with 429")
+    parser.add_argument("--failure-rate", type=float, default=0.2, help="share of requests answered with 500")
+    parser.add_argument("--stub-port", type=int, default=8793)
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix="sound_effects_")
+    # Read when sound_library is imported; keeps the dedupe index away from the real library
+    os.environ["SOUND_EFFECTS_DIR"] = folder
+    os.environ.setdefault("ELEVENLABS_API_KEY", "stub")
+    import sound_effects
+
+    config = StubConfig(sfx_latency=0.05, sfx_rate_limit_rate=args.rate_limit_rate,
+                        sfx_failure_rate=args.failure_rate)
+    url = f"http://127.0.0.1:{args.stub_port}/v1/sound-generation"
+    stubs = await start_stubs(config, args.stub_port)
+    prompts = [{"name": f"Effect {i}", "description": f"Test sound number {i} for the resume check",
+                "duration": 1.0} for i in range(args.prompts)]
+    try:
+        first, _ = await run(sound_effects, prompts[:len(prompts) // 2], folder, url, args.concurrency, config,
+                             "First run, half the prompts, with errors")
+        unfinished = len(prompts) - sum(entry["status"] == "done" for entry in first)
+        config.sfx_rate_limit_rate = config.sfx_failure_rate = 0.0
+        second, requests = await run(sound_effects, prompts, folder, url, args.concurrency, config, "Second run, no errors")
+    finally:
+        await stubs.cleanup()
+
+    print("Checks")
+    ok = check("every prompt generated after the second run", all(entry["status"] == "done" for entry in second))
+    ok &= check("second run skipped finished clips", requests == unfinished,
+                f"{unfinished} unfinished, {requests} requested")
+    files = sorted(f for f in os.listdir(folder) if f.endswith(".wav"))
+    ok &= check("one file per prompt", len(files) == len(prompts), f"{len(files)} files")
+    leftovers = [f for f in os.listdir(folder) if f.endswith(".part")]
+    ok &= check("no partial downloads left", not leftovers, ", ".join(leftovers))
+    sizes = {os.path.getsize(os.path.join(folder, f)) for f in files}
+    ok &= check("every file downloaded whole", len(sizes) == 1, f"sizes {sorted(sizes)}")
+    print(f"\nStub requests: {config.requests}\nOutput: {folder}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
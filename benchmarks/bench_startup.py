@@ -0,0 +1,118 @@
+import argparse
+import asyncio
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stubs import StubConfig, start_stubs, stub_env
+
+# Tracks how fast a fresh server.py process becomes useful: the import time
+# profile of `import server`, then the time from spawning the process to the
+# first answered /sms and to /ready (voice stack loaded), against
+# benchmarks/stubs.py.
+#
+#   python benchmarks/bench_startup.py --runs 3
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SMS_FROM = "+16138626109"
+
+
+def import_profile(module, top):
+    # -X importtime lines: "import time: self | cumulative | name"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=ROOT, capture_output=True, text=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)", line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            rows.append((int(cumulative_us), int(self_us), len(indent) // 2, name))
+    if result.returncode != 0:
+        print(result.stderr.strip().splitlines()[-1])
+    total = next((cumulative for cumulative, _, _, name in rows if name == module), 0)
+    print(f"import {module}: {total / 1e6:.2f}s")
+    # What the module imports directly, slowest first
+    for cumulative, _, _, name in sorted((r for r in rows if r[2] == 1), reverse=True)[:top]:
+        print(f"  {cumulative / 1e6:6.3f}s  {name}")
+    return total / 1e6
+
+
+def is_reply(twiml):
+    messages = re.findall(r"<Message>(.*?)</Message>", twiml, re.S)
+    return bool(messages) and not any(m.startswith("An error occurred") for m in messages)
+
+
+async def time_to_ready(port, stub_port, timeout):
+    env = dict(os.environ, **stub_env(stub_port), PORT=str(port))
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "server.py"], cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f"http://127.0.0.1:{port}"
+    first_sms = ready = None
+    try:
+        async with aiohttp.ClientSession() as session:
+            while time.perf_counter() - started < timeout and ready is None:
+                if process.poll() is not None:
+                    raise RuntimeError(f"server exited with {process.returncode}")
+                try:
+                    if first_sms is None:
+                        async with session.post(f"{base}/sms", data={"From": SMS_FROM, "To": "+15550000000",
+                                                                     "Body": "tell me a joke"}) as response:
+                            # Errors are answered with a 200 as well, only a real reply counts
+                            if response.status == 200 and is_reply(await response.text()):
+                                first_sms = time.perf_counter() - started
+                    async with session.get(f"{base}/ready") as response:
+                        if response.status == 200:
+                            ready = time.perf_counter() - started
+                except aiohttp.ClientError:
+                    pass
+                await asyncio.sleep(0.05)
+    finally:
+        process.terminate()
+        process.wait()
+    return first_sms, ready
+
+
+def summary(values):
+    values = [v for v in values if v is not None]
+    if not values:
+        return "   n/a"
+    return f"{statistics.median(values):6.2f}s (min {min(values):.2f}s)"
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8767)
+    parser.add_argument("--stub-port", type=int, default=8791)
+    parser.add_argument("--timeout", type=float, default=120, help="seconds to wait for /ready per run")
+    parser.add_argument("--top", type=int, default=15, help="slowest imports to list")
+    args = parser.parse_args()
+
+    import_profile("server", args.top)
+    import_profile("bot", args.top)
+
+    stubs = await start_stubs(StubConfig(llm_latency=0.05), args.stub_port)
+    sms_times, ready_times = [], []
+    try:
+        for run in range(args.runs):
+            first_sms, ready = await time_to_ready(args.port, args.stub_port, args.timeout)
+            sms_times.append(first_sms)
+            ready_times.append(ready)
+            print(f"run {run + 1}: first /sms {summary([first_sms])}, /ready {summary([ready])}")
+    finally:
+        await stubs.cleanup()
+
+    print(f"\nfirst /sms response  {summary(sms_times)}")
+    print(f"voice ready          {summary(ready_times)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
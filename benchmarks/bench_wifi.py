@@ -0,0 +1,105 @@
+import argparse
+import functools
+import http.server
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from selenium.common.exceptions import TimeoutException
+
+from tools.wifi_controller import RouterSession
+
+# Compares the old launch-Chrome-per-toggle flow with the warm RouterSession
+# against benchmarks/router_stub.html, which has the router's element IDs.
+#
+#   python benchmarks/bench_wifi.py --toggles 5
+
+
+class FlakySession(RouterSession):
+    # Fails once after the save went through, like the router answering
+    # too late; the retry must not flip the switch back
+
+    failures = 1
+
+    def _toggle(self, driver, initial):
+        super()._toggle(driver, initial)
+        if self.failures:
+            self.failures -= 1
+            raise TimeoutException("router acknowledged the save too late")
+
+
+def serve_stub(port):
+    handler = functools.partial(http.server.SimpleHTTPRequestHandler,
+                                directory=os.path.dirname(os.path.abspath(__file__)))
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def timed(fn, n):
+    timings = []
+    for _ in range(n):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def report(label, timings):
+    print(f"{label:<28} first {timings[0]:6.2f}s  median {statistics.median(timings):6.2f}s  "
+          f"max {max(timings):6.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--toggles", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8799)
+    parser.add_argument("--concurrent", type=int, default=4, help="simultaneous toggles for the lock test")
+    args = parser.parse_args()
+
+    server = serve_stub(args.port)
+    url = f"http://127.0.0.1:{args.port}/router_stub.html"
+
+    def cold_toggle():
+        # What toggle_wifi used to do: fresh browser and login every time
+        session = RouterSession(url=url, password="stub")
+        try:
+            session.toggle()
+        finally:
+            session.close()
+
+    report("cold (browser per toggle)", timed(cold_toggle, args.toggles))
+
+    warm = RouterSession(url=url, password="stub")
+    try:
+        report("warm session", timed(warm.toggle, args.toggles))
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=warm.toggle) for _ in range(args.concurrent)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        print(f"{args.concurrent} concurrent toggles serialized in {time.perf_counter() - started:.2f}s")
+        print(f"warm session counters: {warm.counters}")
+
+        flaky = FlakySession(url=url, password="stub")
+        try:
+            before = flaky.wifi_enabled()
+            flaky.toggle()
+            after = flaky.wifi_enabled()
+        finally:
+            flaky.close()
+        print(f"retry after a saved toggle: wifi {'on' if before else 'off'} -> {'on' if after else 'off'} "
+              f"({'ok' if after != before else 'FAIL, flipped back'}), counters {flaky.counters}")
+    finally:
+        warm.close()
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
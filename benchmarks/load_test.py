@@ -0,0 +1,238 @@
+import argparse
+import asyncio
+import base64
+import json
+import os
+import subprocess
+import sys
+import time
+import wave
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import audio as pcm_tools
+from stubs import StubConfig, start_stubs, stub_env
+
+# Opens N simultaneous Twilio media streams against /ws and streams a speech
+# recording at real-time pace, with Deepgram, Groq and ElevenLabs replaced by
+# benchmarks/stubs.py. Reports outbound frame jitter, turn latency and the
+# server's CPU and RSS for each call count.
+#
+#   python benchmarks/load_test.py --audio question.wav --calls 1,5,10,20
+#
+# The audio must be real speech, the Silero VAD ignores tones. Use --server-url
+# and --server-pid to measure a server you started yourself (pointed at the
+# stubs with the variables `python benchmarks/stubs.py` prints).
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FRAME_BYTES = 160  # 20 ms of 8 kHz mu-law, what Twilio sends
+FRAME_SECONDS = 0.02
+# Outbound frames further apart than this start a new burst of bot speech
+BURST_GAP = 0.25
+
+
+def load_audio(path):
+    # mu-law 8 kHz mono, from a .wav or a raw .ulaw file
+    if not path.endswith(".wav"):
+        with open(path, "rb") as f:
+            return f.read()
+    with wave.open(path, "rb") as f:
+        pcm = f.readframes(f.getnframes())
+        pcm = pcm_tools.to_16bit(pcm, f.getsampwidth())
+        if f.getnchannels() == 2:
+            pcm = pcm_tools.to_mono(pcm)
+        pcm = pcm_tools.resample(pcm, f.getframerate(), 8000)
+    return pcm_tools.ulaw(pcm)
+
+
+class CallResult:
+    def __init__(self):
+        self.turn_latencies = []  # end of our utterance -> first frame of the reply
+        self.gaps = []  # inter-arrival times of outbound frames within a burst
+        self.frames = 0
+        self.error = None
+
+
+async def run_call(server_url, audio, turns, pause, index):
+    result = CallResult()
+    stream_sid = f"MZload{index:06d}"
+    silence = b"\xff" * FRAME_BYTES
+    utterance_end = None
+    last_frame = None
+
+    async def receive(ws):
+        nonlocal utterance_end, last_frame
+        async for message in ws:
+            if message.type != aiohttp.WSMsgType.TEXT:
+                continue
+            if json.loads(message.data).get("event") != "media":
+                continue
+            now = time.perf_counter()
+            result.frames += 1
+            if last_frame is not None and now - last_frame < BURST_GAP:
+                result.gaps.append(now - last_frame)
+            last_frame = now
+            if utterance_end is not None:
+                result.turn_latencies.append(now - utterance_end)
+                utterance_end = None
+
+    async def send_frames(ws, data):
+        # Paced against the clock so a slow send doesn't drift the stream
+        started = time.perf_counter()
+        for i in range(0, len(data), FRAME_BYTES):
+            payload = base64.b64encode(data[i:i + FRAME_BYTES].ljust(FRAME_BYTES, b"\xff")).decode()
+            await ws.send_json({"event": "media", "streamSid": stream_sid, "media": {"payload": payload}})
+            delay = started + (i // FRAME_BYTES + 1) * FRAME_SECONDS - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.ws_connect(server_url) as ws:
+                await ws.send_json({"event": "connected", "protocol": "Call", "version": "1.0.0"})
+                await ws.send_json({"event": "start", "streamSid": stream_sid,
+                                    "start": {"streamSid": stream_sid, "callSid": f"CAload{index:06d}"}})
+                receiver = asyncio.create_task(receive(ws))
+                # Let the greeting play before the first question
+                await send_frames(ws, silence * int(pause / FRAME_SECONDS))
+                for _ in range(turns):
+                    await send_frames(ws, audio)
+                    utterance_end = time.perf_counter()
+                    await send_frames(ws, silence * int(pause / FRAME_SECONDS))
+                await ws.send_json({"event": "stop", "streamSid": stream_sid})
+                receiver.cancel()
+    except Exception as e:
+        result.error = e
+    return result
+
+
+def process_usage(pid):
+    # (cpu seconds, rss bytes) from /proc
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    with open(f"/proc/{pid}/status") as f:
+        rss = next(int(line.split()[1]) * 1024 for line in f if line.startswith("VmRSS:"))
+    return cpu, rss
+
+
+async def sample_usage(pid, samples, interval=0.5):
+    while True:
+        samples.append(process_usage(pid))
+        await asyncio.sleep(interval)
+
+
+def percentile(values, p):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+async def run_level(server_url, pid, audio, calls, turns, pause):
+    samples = []
+    sampler = asyncio.create_task(sample_usage(pid, samples)) if pid else None
+    started = time.perf_counter()
+    results = await asyncio.gather(*[run_call(server_url, audio, turns, pause, i) for i in range(calls)])
+    elapsed = time.perf_counter() - started
+    if sampler:
+        sampler.cancel()
+        samples.append(process_usage(pid))
+
+    gaps = [gap for r in results for gap in r.gaps]
+    # Jitter is how far outbound frames stray from the 20 ms cadence
+    jitter = [abs(gap - FRAME_SECONDS) * 1000 for gap in gaps]
+    latencies = [latency for r in results for latency in r.turn_latencies]
+    errors = [r.error for r in results if r.error]
+    row = {
+        "calls": calls,
+        "turns": f"{len(latencies)}/{calls * turns}",
+        "errors": len(errors),
+        "jitter_p50": percentile(jitter, 50),
+        "jitter_p99": percentile(jitter, 99),
+        "turn_p50": percentile(latencies, 50),
+        "turn_p95": percentile(latencies, 95),
+        "cpu": float("nan"),
+        "rss": float("nan"),
+    }
+    if len(samples) > 1:
+        row["cpu"] = (samples[-1][0] - samples[0][0]) / elapsed * 100
+        row["rss"] = max(rss for _, rss in samples) / 2 ** 20
+    for error in errors[:3]:
+        print(f"  call failed: {error!r}")
+    return row
+
+
+def print_table(rows):
+    print(f"{'calls':>5} {'turns':>7} {'errors':>6} {'jitter p50':>11} {'jitter p99':>11} "
+          f"{'turn p50':>9} {'turn p95':>9} {'cpu %':>7} {'rss MB':>7}")
+    for row in rows:
+        print(f"{row['calls']:>5} {row['turns']:>7} {row['errors']:>6} {row['jitter_p50']:>9.1f}ms "
+              f"{row['jitter_p99']:>9.1f}ms {row['turn_p50']:>8.2f}s {row['turn_p95']:>8.2f}s "
+              f"{row['cpu']:>7.0f} {row['rss']:>7.0f}")
+
+
+async def wait_for_server(url, process, timeout=120):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            if process is not None and process.poll() is not None:
+                raise RuntimeError(f"server exited with {process.returncode}")
+            try:
+                async with session.get(url) as response:
+                    # /ready answers 503 until the voice stack has loaded
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.5)
+    raise RuntimeError("server did not come up")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--audio", required=True, help="speech recording, .wav or raw 8 kHz mu-law")
+    parser.add_argument("--calls", default="1,5,10", help="comma-separated concurrent call counts")
+    parser.add_argument("--turns", type=int, default=3, help="questions per call")
+    parser.add_argument("--pause", type=float, default=4.0, help="silence after each question, seconds")
+    parser.add_argument("--port", type=int, default=8766, help="port for the server under test")
+    parser.add_argument("--stub-port", type=int, default=8790)
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--stt-latency", type=float, default=0.15)
+    parser.add_argument("--tts-latency", type=float, default=0.2)
+    parser.add_argument("--server-url", help="ws:// URL of an already running server")
+    parser.add_argument("--server-pid", type=int, help="pid of that server, for CPU and RSS")
+    args = parser.parse_args()
+
+    audio = load_audio(args.audio)
+    config = StubConfig(llm_latency=args.llm_latency, stt_latency=args.stt_latency, tts_latency=args.tts_latency)
+    stubs = await start_stubs(config, args.stub_port)
+
+    process = None
+    server_url, pid = args.server_url, args.server_pid
+    if server_url is None:
+        env = dict(os.environ, **stub_env(args.stub_port), PORT=str(args.port))
+        process = subprocess.Popen([sys.executable, "server.py"], cwd=ROOT, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        server_url, pid = f"ws://127.0.0.1:{args.port}/ws", process.pid
+    try:
+        await wait_for_server(server_url.replace("ws", "http", 1).rsplit("/", 1)[0] + "/ready", process)
+        rows = []
+        for calls in [int(n) for n in args.calls.split(",")]:
+            print(f"Running {calls} concurrent call(s)...", flush=True)
+            rows.append(await run_level(server_url, pid, audio, calls, args.turns, args.pause))
+        print()
+        print_table(rows)
+        print(f"\nStub requests: {config.requests}")
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        await stubs.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,372 @@
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import math
+import random
+import time
+import uuid
+import wave
+
+from aiohttp import web, WSMsgType
+
+import audio as pcm_tools
+
+# Local stand-ins for the upstream APIs the bot talks to, with configurable
+# latency, so load tests and benchmarks never touch (or pay for) the real ones.
+#
+# Point the server at them with:
+#   GROQ_BASE_URL=http://127.0.0.1:<port>
+#   DEEPGRAM_URL=ws://127.0.0.1:<port>
+#   UPSTREAM_OVERRIDES='{"https://api.elevenlabs.io": "http://127.0.0.1:<port>",
+#                        "https://api.bing.microsoft.com": "http://127.0.0.1:<port>",
+#                        "https://serpapi.com": "http://127.0.0.1:<port>"}'
+#   TWILIO_API_URL=http://127.0.0.1:<port>
+
+
+class StubConfig:
+    def __init__(self, llm_latency=0.3, llm_tokens_per_second=200, stt_latency=0.15, tts_latency=0.2,
+                 reply="Sure thing! It is sunny and warm today, perfect for a walk.",
+                 transcript="What's the weather like today?", sms_latency=0.1, sms_failure_rate=0.0,
+                 bing_latency=None, serp_latency=0.3, serp_query_latency=None, sfx_latency=0.2, sfx_rate_limit_rate=0.0,
+                 sfx_failure_rate=0.0):
+        self.llm_latency = llm_latency
+        self.llm_tokens_per_second = llm_tokens_per_second
+        self.stt_latency = stt_latency
+        self.tts_latency = tts_latency
+        self.reply = reply
+        self.transcript = transcript
+        self.sms_latency = sms_latency
+        # Share of SMS requests answered with a 503, to exercise retries
+        self.sms_failure_rate = sms_failure_rate
+        self.requests = {}
+        self.sms = []  # (to, from, body) accepted by the Twilio stub
+        # Seconds per Bing vertical: {"web": 0.2, "news": 0.3, "images": 0.5, "videos": 0.5}
+        self.bing_latency = {"web": 0.2, "news": 0.3, "images": 0.5, "videos": 0.5, **(bing_latency or {})}
+        self.serp_latency = serp_latency
+        # Seconds for SerpAPI queries containing a phrase: {"pros and cons": 5}
+        self.serp_query_latency = serp_query_latency or {}
+        self.sfx_latency = sfx_latency
+        # Shares of sound-generation requests answered with a 429 (with
+        # Retry-After) and a 500, to exercise the generator's retries
+        self.sfx_rate_limit_rate = sfx_rate_limit_rate
+        self.sfx_failure_rate = sfx_failure_rate
+
+    def count(self, name):
+        self.requests[name] = self.requests.get(name, 0) + 1
+
+
+def tone(seconds, sample_rate=16000, frequency=220):
+    # 16-bit PCM sine, stands in for synthesized speech
+    samples = int(seconds * sample_rate)
+    values = (int(6000 * math.sin(2 * math.pi * frequency * i / sample_rate)) for i in range(samples))
+    return b"".join(v.to_bytes(2, "little", signed=True) for v in values)
+
+
+#
+# Groq (OpenAI-compatible chat completions)
+#
+
+def _chunk(model, delta, finish_reason=None):
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+async def chat_completions(request):
+    config = request.app["config"]
+    config.count("llm")
+    body = await request.json()
+    model = body.get("model", "stub")
+    await asyncio.sleep(config.llm_latency)
+
+    if not body.get("stream"):
+        return web.json_response({
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": config.reply}}],
+            "usage": {"prompt_tokens": 100, "completion_tokens": 20, "total_tokens": 120},
+        })
+
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+    await response.prepare(request)
+    words = config.reply.split(" ")
+    try:
+        for i, word in enumerate(words):
+            delta = {"content": word if i == 0 else " " + word}
+            if i == 0:
+                delta["role"] = "assistant"
+            await response.write(f"data: {json.dumps(_chunk(model, delta))}\n\n".encode())
+            await asyncio.sleep(1 / config.llm_tokens_per_second)
+        await response.write(f"data: {json.dumps(_chunk(model, {}, 'stop'))}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+    except ConnectionResetError:
+        # The client closed the stream early (barge-in, SMS segment limit)
+        config.count("llm_closed_early")
+    return response
+
+
+#
+# ElevenLabs text to speech and sound generation
+#
+
+async def text_to_speech(request):
+    config = request.app["config"]
+    config.count("tts")
+    body = await request.json()
+    await asyncio.sleep(config.tts_latency)
+
+    # Roughly 15 characters per second of speech
+    audio = tone(max(0.5, len(body.get("text", "")) / 15))
+    if request.query.get("output_format") == "ulaw_8000":
+        audio = pcm_tools.ulaw(pcm_tools.resample(audio, 16000, 8000))
+
+    response = web.StreamResponse(headers={"Content-Type": "audio/basic"})
+    await response.prepare(request)
+    for i in range(0, len(audio), 8192):
+        await response.write(audio[i:i + 8192])
+    return response
+
+
+async def sound_generation(request):
+    # A WAV per prompt, streamed in chunks; the pitch comes from the text so
+    # different prompts never produce identical files
+    config = request.app["config"]
+    config.count("sfx")
+    body = await request.json()
+    await asyncio.sleep(config.sfx_latency)
+    roll = random.random()
+    if roll < config.sfx_rate_limit_rate:
+        return web.json_response({"detail": {"status": "too_many_concurrent_requests"}}, status=429,
+                                 headers={"Retry-After": "1"})
+    if roll < config.sfx_rate_limit_rate + config.sfx_failure_rate:
+        return web.json_response({"detail": {"status": "internal_error"}}, status=500)
+    if not body.get("text"):
+        return web.json_response({"detail": {"status": "invalid_text"}}, status=422)
+
+    frequency = 200 + int(hashlib.sha1(body["text"].encode()).hexdigest(), 16) % 600
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(16000)
+        f.writeframes(tone(body.get("duration_seconds") or 2.0, frequency=frequency))
+    audio = buffer.getvalue()
+    config.count("sfx_done")
+
+    response = web.StreamResponse(headers={"Content-Type": "audio/mpeg"})
+    await response.prepare(request)
+    for i in range(0, len(audio), 16384):
+        await response.write(audio[i:i + 16384])
+    return response
+
+
+#
+# Deepgram live transcription
+#
+
+def _transcript_message(transcript, start, duration):
+    return {
+        "type": "Results",
+        "channel_index": [0, 1],
+        "duration": duration,
+        "start": start,
+        "is_final": True,
+        "speech_final": True,
+        "from_finalize": False,
+        "channel": {"alternatives": [{"transcript": transcript, "confidence": 0.99, "words": []}]},
+        "metadata": {
+            "request_id": str(uuid.uuid4()),
+            "model_uuid": str(uuid.uuid4()),
+            "model_info": {"name": "stub", "version": "0", "arch": "stub"},
+        },
+    }
+
+
+async def listen(request):
+    # Sends one final transcript per burst of speech: audio above a volume
+    # threshold followed by 300 ms of quiet
+    config = request.app["config"]
+    config.count("stt")
+    ws = web.WebSocketResponse()
+    await ws.prepare(request)
+
+    received = 0.0  # seconds of audio so far
+    speech_started = None
+    quiet = 0.0
+    async for message in ws:
+        if message.type == WSMsgType.BINARY:
+            seconds = len(message.data) / 32000
+            received += seconds
+            loud = pcm_tools.rms(message.data) > 500
+            if loud:
+                speech_started = speech_started if speech_started is not None else received
+                quiet = 0.0
+            elif speech_started is not None:
+                quiet += seconds
+                if quiet >= 0.3:
+                    await asyncio.sleep(config.stt_latency)
+                    await ws.send_json(_transcript_message(config.transcript, speech_started, received - speech_started))
+                    speech_started = None
+        elif message.type == WSMsgType.TEXT:
+            if json.loads(message.data).get("type") == "CloseStream":
+                break
+    await ws.close()
+    return ws
+
+
+#
+# Twilio Messages
+#
+
+async def create_message(request):
+    config = request.app["config"]
+    config.count("sms")
+    form = await request.post()
+    await asyncio.sleep(config.sms_latency)
+    if random.random() < config.sms_failure_rate:
+        return web.json_response({"code": 20500, "message": "Service unavailable"}, status=503)
+    if not form.get("To") or not form.get("Body"):
+        return web.json_response({"code": 21604, "message": "A 'To' and 'Body' are required"}, status=400)
+    config.sms.append((form["To"], form.get("From"), form["Body"]))
+    return web.json_response({"sid": f"SM{uuid.uuid4().hex}", "status": "queued", "to": form["To"],
+                              "body": form["Body"]}, status=201)
+
+
+#
+# Bing Search v7
+#
+
+def _bing_hits(query, vertical, count=5):
+    now = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime())
+    return [{
+        "name": f"{query} ({vertical} result {i + 1})",
+        "url": f"https://example.com/{vertical}/{i + 1}",
+        "displayUrl": f"example.com/{vertical}/{i + 1}",
+        "snippet": f"Result {i + 1} about {query} from the {vertical} index.",
+        "description": f"Story {i + 1} about {query}.",
+        "provider": [{"name": "Example News"}],
+        "publisher": [{"name": "Example Video"}],
+        "datePublished": now,
+        "hostPageUrl": f"https://example.com/{vertical}/{i + 1}",
+        "hostPageDisplayUrl": f"example.com/{vertical}/{i + 1}",
+        "thumbnailUrl": f"https://example.com/{vertical}/{i + 1}.jpg",
+        "contentUrl": f"https://example.com/{vertical}/{i + 1}.jpg",
+        "embedHtml": f'<iframe src="https://example.com/embed/{i + 1}?autoplay=1"></iframe>',
+    } for i in range(count)]
+
+
+def bing_search(vertical):
+    async def handler(request):
+        config = request.app["config"]
+        config.count(f"bing_{vertical}")
+        await asyncio.sleep(config.bing_latency[vertical])
+        hits = _bing_hits(request.query.get("q", ""), vertical)
+        if vertical == "web":
+            return web.json_response({"_type": "SearchResponse", "webPages": {"value": hits}})
+        return web.json_response({"_type": vertical.capitalize(), "value": hits})
+    return handler
+
+
+#
+# SerpAPI
+#
+
+SNIPPET_WORDS = """battery grid roof inverter cost install winter output warranty efficiency tariff storage
+subsidy export meter shade angle cable panel cell module rating season repair noise heat pump coil duct filter
+airflow thermostat insulation radiator""".split()
+
+
+async def serp_search(request):
+    # Half the results are shared between queries so callers have URLs to
+    # dedupe; each page has its own wording so snippets don't look alike
+    config = request.app["config"]
+    config.count("serp")
+    query = request.query.get("q", "")
+    latency = [seconds for phrase, seconds in config.serp_query_latency.items() if phrase in query.lower()]
+    await asyncio.sleep(max(latency, default=config.serp_latency))
+    slug = "-".join(query.lower().split())
+    results = []
+    for i in range(int(request.query.get("num", "10"))):
+        page = f"common/{i + 1}" if i % 2 == 0 else f"{slug}/{i + 1}"
+        results.append({
+            "position": i + 1,
+            "title": f"{query} (result {i + 1})",
+            "link": f"https://example.com/{page}",
+            "displayed_link": f"example.com/{page}",
+            "source": "Example",
+            "snippet": f"Page {page} covers {query}. "
+                       f"{' '.join(random.Random(page).sample(SNIPPET_WORDS, 10)).capitalize()}.",
+        })
+    return web.json_response({"search_metadata": {"status": "Success"}, "organic_results": results})
+
+
+def build_app(config):
+    app = web.Application()
+    app["config"] = config
+    app.router.add_post("/openai/v1/chat/completions", chat_completions)
+    app.router.add_post("/v1/text-to-speech/{voice_id}/stream", text_to_speech)
+    app.router.add_post("/v1/text-to-speech/{voice_id}", text_to_speech)
+    app.router.add_post("/v1/sound-generation", sound_generation)
+    app.router.add_get("/v1/listen", listen)
+    app.router.add_post("/2010-04-01/Accounts/{account_sid}/Messages.json", create_message)
+    app.router.add_get("/v7.0/search", bing_search("web"))
+    for vertical in ("news", "images", "videos"):
+        app.router.add_get(f"/v7.0/{vertical}/search", bing_search(vertical))
+    app.router.add_get("/search.json", serp_search)
+    return app
+
+
+async def start_stubs(config, port):
+    # One server for every stub; routes don't overlap
+    runner = web.AppRunner(build_app(config))
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+def stub_env(port):
+    base = f"http://127.0.0.1:{port}"
+    return {
+        "GROQ_BASE_URL": base,
+        "DEEPGRAM_URL": f"ws://127.0.0.1:{port}",
+        "UPSTREAM_OVERRIDES": json.dumps({"https://api.elevenlabs.io": base,
+                                          "https://api.bing.microsoft.com": base,
+                                          "https://serpapi.com": base}),
+        "GROQ_API_KEY": "stub",
+        "DEEPGRAM_API_KEY": "stub",
+        "ELEVENLABS_API_KEY": "stub",
+        "ELEVENLABS_VOICE_ID": "stub",
+        "TWILIO_API_URL": base,
+        "TWILIO_ACCOUNT_SID": "ACstub",
+        "TWILIO_AUTH_TOKEN": "stub",
+        "AZURE_BING_API_KEY": "stub",
+        "SERP_API_KEY": "stub",
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--stt-latency", type=float, default=0.15)
+    parser.add_argument("--tts-latency", type=float, default=0.2)
+    args = parser.parse_args()
+
+    config = StubConfig(llm_latency=args.llm_latency, stt_latency=args.stt_latency, tts_latency=args.tts_latency)
+    await start_stubs(config, args.port)
+    for name, value in stub_env(args.port).items():
+        print(f"{name}='{value}'")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
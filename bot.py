@@ -3,14 +3,14 @@
 #
 # SPDX-License-Identifier: BSD 2-Clause License
 #
-import json
+import asyncio
 import os
 import sys
+import time
 
-import aiohttp
 from dotenv import load_dotenv
 from loguru import logger
-from openai.types.chat import ChatCompletionToolParam
+from openai import AsyncOpenAI
 from pipecat.frames.frames import TextFrame, LLMMessagesFrame, EndFrame
 from pipecat.pipeline.pipeline import Pipeline
 from pipecat.pipeline.runner import PipelineRunner
@@ -19,230 +19,247 @@ from pipecat.processors.aggregators.llm_response import (
     LLMAssistantContextAggregator,
     LLMUserContextAggregator,
 )
-from pipecat.serializers.twilio import TwilioFrameSerializer
-from pipecat.services.elevenlabs import ElevenLabsTTSService
 #from pipecat.services.azure import AzureTTSService
 from pipecat.services.deepgram import DeepgramSTTService
 from pipecat.services.openai import OpenAILLMContext, OpenAILLMService
 from pipecat.transports.network.fastapi_websocket import FastAPIWebsocketTransport, FastAPIWebsocketParams
 from pipecat.vad.silero import SileroVADAnalyzer
-from twilio.rest import Client
 
+import clients
+import journal
+import metrics
+import phrase_cache
+import rate_limits
+from context_window import RollingContext
+from interruptions import CallScope, InterruptionProbe, InterruptibleElevenLabsTTSService
+from pipeline_pool import ComponentPool
+from sound_library import sound_library
+from turn_metrics import TurnTracker, TimedTwilioFrameSerializer, vad_probe, stt_probe, llm_probe, tts_probe
+from tools.quick_research import quick_research
+from tools.specs import get_tools
 from tools.web_search import search_bing
-from tools.wifi_controller import toggle_wifi
-
-from groq import Groq
 
 load_dotenv(override=True)
 
 logger.remove(0)
 logger.add(sys.stderr, level="DEBUG")
 
-client = Groq(
-    # This is the default and can be omitted
-    api_key=os.environ.get("GROQ_API_KEY"),
-)
-
-account_sid = os.getenv("TWILIO_ACCOUNT_SID")
-auth_token = os.getenv("TWILIO_AUTH_TOKEN")
-twilio_client = Client(account_sid, auth_token)
-
-def get_tools():
-    return [
-        ChatCompletionToolParam(
-            type="function",
-            function={
-                "name": "search_bing",
-                "description": "Search the web. Use this to search up real-time information, current events or weather updates (basically anything that requires latest information).",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "query": {
-                            "type": "string",
-                            "description": "The search query",
-                        },
-                    },
-                    "required": [
-                        "query"],
-                },
-            }
-        ),
-        ChatCompletionToolParam(
-            type="function",
-            function={
-                "name": "toggle_wifi",
-                "description": "Toggle the WiFi",
-            }
-        )
-    ]
-
-async def handle_tools(messages, tool_calls, from_, to_):
-    try:
-
-        available_functions = {
-            "search_bing": search_bing,
-            "toggle_wifi": toggle_wifi
-        }
-
-        for tool_call in tool_calls:
-            function_name = tool_call.function.name
-            function_to_call = available_functions.get(function_name, None)
-            if function_to_call:
-                function_args = json.loads(tool_call.function.arguments)
-                function_response = function_to_call(**function_args)
-                messages.append({"role": "tool", "content": function_response, "tool_call_id": tool_call.id, "name": function_name})
-
-        messages.append({"role": "system", "content": "Summarize the tool results in a concise and informative way. Don't use markdown formatting because it will be sent as a text message."})
-
-        second_response = client.chat.completions.create(
-            messages=messages,
-            model="mixtral-8x7b-32768",
-            max_tokens=4096
-        )
-        twilio_client.messages.create(
-            body=second_response.choices[0].message.content,
-            from_=to_,
-            to=from_
-        )
-    except Exception as e:
-        logger.error(f"Error: {e}")
-        twilio_client.messages.create(
-            body=f"An error occurred {e}",
-            from_=to_,
-            to=from_
-        )
-
-
-
-def choose_tools(message):
-    messages = [
-        {
-            "role": "system",
-            "content": "you are an assistant responding to a SMS message. Use the tools if the user asks for them. ",
-        },
-        {
-            "role": "user",
-            "content": message
-        }
-    ]
-    
-    
-    tool_choice = "auto"
-    
-    if message.lower() == 'wifi':
-        tool_choice = {"type": "function", "function": {"name": "toggle_wifi"}}
-
-    tools = get_tools()
-    response = client.chat.completions.create(
-        messages=messages,
-        model="llama3-groq-70b-8192-tool-use-preview",
-        tools=tools,
-        tool_choice=tool_choice,
-        max_tokens=4096
-    )
 
-    response_message = response.choices[0].message
-    tool_calls = response_message.tool_calls
+class GroqLLMService(OpenAILLMService):
+    # Talks to Groq over the process-wide pooled httpx client instead of
+    # opening a fresh connection pool for every call
+    def create_client(self, api_key=None, base_url=None, **kwargs):
+        return AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=clients.llm_http())
 
-    if tool_calls:
-        messages.append(response_message)
-        return messages, tool_calls
+    async def get_chat_completions(self, context, messages):
+        # Voice turns jump the queue ahead of SMS work on the shared key
+        tools = context.tools if isinstance(context.tools, list) else []
+        tokens = rate_limits.estimate_tokens(list(messages) + tools)
+        await rate_limits.groq_scheduler.acquire(self._model, tokens, rate_limits.VOICE)
+        return _closing(await super().get_chat_completions(context, messages))
 
-    return response_message.content, None
 
+async def _closing(stream):
+    # pipecat stops iterating when a turn is interrupted but never closes the
+    # stream, which leaves Groq generating into a checked-out connection
+    try:
+        async for chunk in stream:
+            yield chunk
+    except asyncio.CancelledError:
+        metrics.cancelled_work.inc(kind="llm")
+        raise
+    finally:
+        await stream.close()
 
 
 async def start_search(llm):
-    await llm.push_frame(TextFrame("Let me search for that. Give me one second."))
+    filler = phrase_cache.search_filler()
+    # Cached fillers skip TTS entirely and go straight out as audio
+    frame = phrase_cache.frame(filler)
+    await llm.push_frame(frame or TextFrame(filler))
 
 
 async def search(llm, args):
     try:
-        return search_bing(args["query"])
+        return await search_bing(args["query"])
     except Exception as e:
         logger.error(f"Error: {e}")
         return "Failed to retrieve search results"
 
 
+async def research(llm, args):
+    try:
+        return await quick_research(args["topic"])
+    except Exception as e:
+        logger.error(f"Error: {e}")
+        return "Failed to research the topic"
+
+
+async def play_sound_effect(llm, args):
+    # Picks up clips added to sound_effects/ since the last call
+    await asyncio.to_thread(sound_library.refresh)
+    clip = sound_library.find(args.get("name", ""))
+    if not clip:
+        return f"There is no sound effect called {args.get('name')}."
+
+    for chunk in sound_library.audio(clip):
+        await llm.push_frame(phrase_cache.ulaw_to_frame(chunk))
+    return f"Played the {clip['name']} sound effect."
+
+
+def timed_tool(function_name, callback, tracker, scope):
+    # Records tool start/finish on the current turn, in the tool histogram
+    # and in the journal. A barge-in cancels the call and its result is
+    # dropped, see interruptions.
+    async def timed(llm, args):
+        tracker.mark("tool_start")
+        started = time.perf_counter()
+        outcome = "cancelled"
+        try:
+            result = await scope.run(function_name, callback(llm, args))
+            outcome = "ok" if result is not None else "dropped"
+            return result
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            tracker.mark("tool_end")
+            metrics.tool_seconds.observe(elapsed, tool=function_name, path="voice")
+            journal.record("tool", tool=function_name, path="voice", outcome=outcome, call=tracker.call_id,
+                           seconds=round(elapsed, 3))
+    return timed
+
+
+def create_vad():
+    return SileroVADAnalyzer()
+
+
+def create_services():
+    '''tts = AzureTTSService(
+        api_key=os.getenv("AZURE_SPEECH_API_KEY"),
+        region=os.getenv("AZURE_REGION"),
+    )'''
+    # DEEPGRAM_URL / GROQ_BASE_URL let benchmarks/stubs.py stand in for the real APIs
+    stt = DeepgramSTTService(api_key=os.getenv('DEEPGRAM_API_KEY'), url=os.getenv("DEEPGRAM_URL", ""))
+
+    llm = GroqLLMService(
+        api_key=os.getenv("GROQ_API_KEY"),
+        model="llama3-groq-70b-8192-tool-use-preview",
+        base_url=os.getenv("GROQ_BASE_URL", "https://api.groq.com") + "/openai/v1"
+    )
+    return stt, llm
+
+
+# Filled at server startup, see server.lifespan
+call_pool = ComponentPool(create_vad, create_services)
+
+
 async def run_bot(websocket_client, stream_sid):
-    async with aiohttp.ClientSession() as session:
-        transport = FastAPIWebsocketTransport(
-            websocket=websocket_client,
-            params=FastAPIWebsocketParams(
-                audio_out_enabled=True,
-                add_wav_header=False,
-                vad_enabled=True,
-                vad_analyzer=SileroVADAnalyzer(),
-                vad_audio_passthrough=True,
-                serializer=TwilioFrameSerializer(stream_sid)
-            )
+    components = await call_pool.checkout()
+    metrics.active_calls.inc()
+    try:
+        await _run_pipeline(websocket_client, stream_sid, components)
+    finally:
+        metrics.active_calls.dec()
+        call_pool.release(components)
+
+
+async def _run_pipeline(websocket_client, stream_sid, components):
+    tracker = TurnTracker(stream_sid)
+    scope = CallScope()
+    transport = FastAPIWebsocketTransport(
+        websocket=websocket_client,
+        params=FastAPIWebsocketParams(
+            audio_out_enabled=True,
+            add_wav_header=False,
+            vad_enabled=True,
+            vad_analyzer=components.vad,
+            vad_audio_passthrough=True,
+            serializer=TimedTwilioFrameSerializer(stream_sid, tracker)
         )
+    )
 
-        '''tts = AzureTTSService(
-            api_key=os.getenv("AZURE_SPEECH_API_KEY"),
-            region=os.getenv("AZURE_REGION"),
-        )'''
-        stt = DeepgramSTTService(api_key=os.getenv('DEEPGRAM_API_KEY'))
-
-        tts = ElevenLabsTTSService(
-                    aiohttp_session=session,
-                    api_key=os.getenv("ELEVENLABS_API_KEY"),
-                    voice_id=os.getenv("ELEVENLABS_VOICE_ID"),
-                )
-        
-        llm = OpenAILLMService(
-            api_key=os.getenv("GROQ_API_KEY"),
-            model="llama3-groq-70b-8192-tool-use-preview",
-            base_url="https://api.groq.com/openai/v1"
-        )
-        llm.register_function(
-            "search_bing",
-            search,
-            start_callback=start_search)
+    stt, llm = components.services
+
+    tts = InterruptibleElevenLabsTTSService(
+        scope=scope,
+        aiohttp_session=clients.http_session(),
+        api_key=os.getenv("ELEVENLABS_API_KEY"),
+        voice_id=os.getenv("ELEVENLABS_VOICE_ID"),
+    )
 
-        tools = get_tools()
+    llm.register_function(
+        "search_bing",
+        timed_tool("search_bing", search, tracker, scope),
+        start_callback=start_search)
+    llm.register_function(
+        "quick_research",
+        timed_tool("quick_research", research, tracker, scope),
+        start_callback=start_search)
+    llm.register_function("play_sound_effect", timed_tool("play_sound_effect", play_sound_effect, tracker, scope))
 
-        # remove wifi toggle tool
-        tools = [tool for tool in tools if tool["function"]["name"] != "toggle_wifi"]
+    tools = get_tools()
+
+    # remove wifi toggle tool
+    tools = [tool for tool in tools if tool["function"]["name"] != "toggle_wifi"]
 
-        messages = [
-            {
-                "role": "system",
-                "content": """You are a helpful LLM named Lucy, in a WebRTC call. Your output will be converted to audio so don't include special characters in your answers. 
+    messages = [
+        {
+            "role": "system",
+            "content": """You are a helpful LLM named Lucy, in a WebRTC call. Your output will be converted to audio so don't include special characters in your answers. 
 Respond to what the user said in a creative and helpful way but you love to make witty/bad jokes. Use the tools to help you answer the user such as searching the web.
 
 You will always do what the user asks without hesitation but bring in your personality.
 """,
-            },
-        ]
-
-        context = OpenAILLMContext(messages, tools)
-        tma_in = LLMUserContextAggregator(context)
-        tma_out = LLMAssistantContextAggregator(context)
-        pipeline = Pipeline([
-            transport.input(),
-            stt,
-            tma_in,
-            llm,
-            tts,
-            transport.output(),
-            tma_out
-        ])
-
-        task = PipelineTask(pipeline, params=PipelineParams(allow_interruptions=True))
-
-        @transport.event_handler("on_client_connected")
-        async def on_client_connected(transport, client):
-            logger.info("Client connected.")
-            # Kick off the conversation.
+        },
+    ]
+
+    context = OpenAILLMContext(messages, tools)
+    tma_in = LLMUserContextAggregator(context)
+    tma_out = LLMAssistantContextAggregator(context)
+    # The probes only timestamp frames on their way through, see turn_metrics
+    pipeline = Pipeline([
+        transport.input(),
+        InterruptionProbe(scope),
+        vad_probe(tracker),
+        stt,
+        stt_probe(tracker),
+        tma_in,
+        RollingContext(context),
+        llm,
+        llm_probe(tracker),
+        tts,
+        tts_probe(tracker),
+        transport.output(),
+        tma_out
+    ])
+
+    task = PipelineTask(pipeline, params=PipelineParams(allow_interruptions=True))
+
+    @transport.event_handler("on_client_connected")
+    async def on_client_connected(transport, client):
+        logger.info("Client connected.")
+        # Kick off the conversation.
+        greeting = phrase_cache.greeting()
+        frame = phrase_cache.frame(greeting)
+        if frame:
+            # Pushed from the LLM so it skips STT and TTS on its way out
+            messages.append({"role": "assistant", "content": greeting})
+            await llm.push_frame(frame)
+        else:
             messages.append(
                 {"role": "system", "content": "Please introduce yourself to the user."})
             await task.queue_frames([LLMMessagesFrame(messages)])
 
-        @transport.event_handler("on_client_disconnected")
-        async def on_client_disconnected(transport, client):
-            await task.queue_frames([EndFrame()])
+    @transport.event_handler("on_client_disconnected")
+    async def on_client_disconnected(transport, client):
+        await task.queue_frames([EndFrame()])
 
-        runner = PipelineRunner(handle_sigint=False)
+    runner = PipelineRunner(handle_sigint=False)
 
+    started = time.perf_counter()
+    try:
         await runner.run(task)
+    finally:
+        journal.record("call", call=stream_sid, turns=tracker.turns, seconds=round(time.perf_counter() - started, 3))
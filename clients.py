@@ -0,0 +1,141 @@
+import json
+import os
+
+import aiohttp
+from dotenv import load_dotenv
+from loguru import logger
+from yarl import URL
+
+import rate_limits
+
+load_dotenv(override=True)
+
+# One set of pooled clients shared by every call and SMS job on the process.
+# They are created lazily on first use and torn down in the app lifespan.
+# httpx and groq are imported on first use too, they are slow to load.
+
+HTTP_LIMIT = int(os.getenv("HTTP_LIMIT", "100"))
+HTTP_LIMIT_PER_HOST = int(os.getenv("HTTP_LIMIT_PER_HOST", "20"))
+HTTP_KEEPALIVE = float(os.getenv("HTTP_KEEPALIVE", "60"))
+
+# {"https://api.elevenlabs.io": "http://127.0.0.1:8790"} sends a host's traffic
+# somewhere else, used to point the bot at benchmarks/stubs.py
+UPSTREAM_OVERRIDES = json.loads(os.getenv("UPSTREAM_OVERRIDES") or "{}")
+
+connection_counters = {
+    "aiohttp": {"opened": 0, "reused": 0},
+    "httpx": {"opened": 0, "reused": 0},
+}
+
+_http_session = None
+_llm_http = None
+_groq = None
+
+
+async def _on_connection_create_end(session, context, params):
+    connection_counters["aiohttp"]["opened"] += 1
+
+
+async def _on_connection_reuseconn(session, context, params):
+    connection_counters["aiohttp"]["reused"] += 1
+
+
+class _OverriddenRequest(aiohttp.ClientRequest):
+    def __init__(self, method, url, *args, **kwargs):
+        target = UPSTREAM_OVERRIDES.get(str(url.origin()))
+        if target is not None:
+            url = URL(target.rstrip("/") + url.raw_path_qs, encoded=True)
+        super().__init__(method, url, *args, **kwargs)
+
+
+def http_session():
+    # aiohttp session for ElevenLabs, Bing and anything else speaking plain HTTP
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(_on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(_on_connection_reuseconn)
+        connector = aiohttp.TCPConnector(limit=HTTP_LIMIT, limit_per_host=HTTP_LIMIT_PER_HOST,
+                                         keepalive_timeout=HTTP_KEEPALIVE)
+        extra = {"request_class": _OverriddenRequest} if UPSTREAM_OVERRIDES else {}
+        _http_session = aiohttp.ClientSession(connector=connector, trace_configs=[trace_config], **extra)
+    return _http_session
+
+
+async def _on_request(request):
+    # httpcore reports TCP connects through the "trace" extension; no connect
+    # before the response means the request went over a pooled connection
+    state = {"opened": False}
+
+    async def trace(event_name, info):
+        if event_name == "connection.connect_tcp.complete":
+            state["opened"] = True
+
+    request.extensions["trace"] = trace
+    request.extensions["connection_state"] = state
+
+
+async def _on_response(response):
+    state = response.request.extensions.get("connection_state")
+    if state is not None:
+        connection_counters["httpx"]["opened" if state["opened"] else "reused"] += 1
+    if response.request.url.path.endswith("/chat/completions"):
+        try:
+            model = json.loads(response.request.content)["model"]
+        except (ValueError, KeyError, RuntimeError):
+            return
+        rate_limits.groq_scheduler.observe(model, response.status_code, response.headers)
+
+
+def llm_http():
+    # httpx client shared by the Groq SDK and the pipecat OpenAI-compatible service
+    global _llm_http
+    if _llm_http is None or _llm_http.is_closed:
+        import httpx
+        _llm_http = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=HTTP_LIMIT,
+                                max_keepalive_connections=HTTP_LIMIT_PER_HOST,
+                                keepalive_expiry=HTTP_KEEPALIVE),
+            timeout=httpx.Timeout(float(os.getenv("GROQ_TIMEOUT", "30")), connect=5.0),
+            event_hooks={"request": [_on_request], "response": [_on_response]},
+        )
+    return _llm_http
+
+
+def groq():
+    global _groq
+    if _groq is None:
+        from groq import AsyncGroq
+        _groq = AsyncGroq(
+            api_key=os.environ.get("GROQ_API_KEY"),
+            http_client=llm_http(),
+        )
+    return _groq
+
+
+async def groq_chat(priority=rate_limits.SMS, **kwargs):
+    # Chat completion that waits its turn on the shared Groq rate limits
+    tokens = rate_limits.estimate_tokens(kwargs["messages"], kwargs.get("max_tokens"))
+    await rate_limits.groq_scheduler.acquire(kwargs["model"], tokens, priority)
+    return await groq().chat.completions.create(**kwargs)
+
+
+def connection_stats():
+    return {name: dict(counts) for name, counts in connection_counters.items()}
+
+
+async def startup():
+    http_session()
+    groq()
+
+
+async def shutdown():
+    global _http_session, _llm_http, _groq
+    logger.info(f"Connection reuse: {connection_stats()}")
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    if _llm_http is not None and not _llm_http.is_closed:
+        await _llm_http.aclose()
+    _http_session = None
+    _llm_http = None
+    _groq = None
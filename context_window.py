@@ -0,0 +1,183 @@
+import asyncio
+import json
+import os
+
+from loguru import logger
+from openai import NOT_GIVEN
+
+from pipecat.processors.aggregators.openai_llm_context import OpenAILLMContextFrame
+from pipecat.processors.frame_processor import FrameProcessor
+
+import clients
+import metrics
+import rate_limits
+
+# Keeps a call's OpenAILLMContext under a token budget so prompt size (and
+# with it Groq time to first token) stays flat on long calls. The first
+# system prompt is pinned, old tool output is trimmed, and older turns are
+# folded into a running summary by a small model in the background.
+
+# The voice model has an 8192 token window; leave room for the reply
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+# Start summarizing in the background past this share of the budget
+SUMMARIZE_AT = 0.6
+# Tool results from earlier turns are cut down to this many tokens
+TOOL_OUTPUT_TOKENS = int(os.getenv("CONTEXT_TOOL_OUTPUT_TOKENS", "200"))
+# Most recent user turns that are never summarized or dropped
+KEEP_RECENT_TURNS = 3
+SUMMARY_MODEL = os.getenv("CONTEXT_SUMMARY_MODEL", "llama3-8b-8192")
+SUMMARY_PREFIX = "Summary of the call so far: "
+
+
+def approx_tokens(message):
+    # Llama 3 averages a bit under 4 characters per English token; close
+    # enough for budgeting without shipping a tokenizer
+    if isinstance(message, str):
+        return len(message) // 4 + 1
+    tokens = 4
+    content = message.get("content")
+    if isinstance(content, str):
+        tokens += len(content) // 4
+    for tool_call in message.get("tool_calls") or ():
+        tokens += 8 + len(tool_call["function"]["arguments"]) // 4
+    return tokens
+
+
+def _transcript(messages):
+    lines = []
+    for message in messages:
+        if message.get("tool_calls"):
+            calls = ", ".join(f"{c['function']['name']}({c['function']['arguments']})" for c in message["tool_calls"])
+            lines.append(f"assistant called {calls}")
+        elif isinstance(message.get("content"), str):
+            lines.append(f"{message['role']}: {message['content']}")
+    return "\n".join(lines)
+
+
+class RollingContext(FrameProcessor):
+    # Sits between the user aggregator and the LLM and compacts the shared
+    # context in place before each completion
+
+    def __init__(self, context, budget=CONTEXT_TOKEN_BUDGET):
+        super().__init__()
+        self._context = context
+        self._budget = budget
+        self._pinned = context.messages[0] if context.messages else None
+        self._summary = None  # the summary message, right after the pinned prompt
+        self._counts = []  # approx tokens per message, kept in step with context.messages
+        self._summarizing = None
+        tools = context.tools
+        self._tool_tokens = approx_tokens(json.dumps(tools)) if tools and tools is not NOT_GIVEN else 0
+
+    @property
+    def tokens(self):
+        self._sync_counts()
+        return self._tool_tokens + sum(self._counts)
+
+    def _sync_counts(self):
+        # The aggregators and the LLM service only ever append, so only count
+        # the new messages
+        messages = self._context.messages
+        if len(self._counts) > len(messages):
+            self._counts = [approx_tokens(m) for m in messages]
+        for message in messages[len(self._counts):]:
+            self._counts.append(approx_tokens(message))
+
+    def _set_messages(self, messages):
+        self._context.messages[:] = messages
+        self._counts = [approx_tokens(m) for m in messages]
+
+    def _turn_starts(self):
+        # Indexes of user messages; cutting only there keeps an assistant
+        # tool_calls message together with its tool results
+        return [i for i, m in enumerate(self._context.messages) if m.get("role") == "user"]
+
+    def _head(self):
+        # Pinned prompt and summary, never compacted
+        return sum(1 for m in self._context.messages[:2] if m is self._pinned or m is self._summary)
+
+    def _trim_tool_outputs(self):
+        turns = self._turn_starts()
+        if not turns:
+            return
+        trimmed = False
+        for message in self._context.messages[:turns[-1]]:
+            content = message.get("content")
+            if (message.get("role") == "tool" and isinstance(content, str)
+                    and not content.endswith(" [trimmed]") and approx_tokens(content) > TOOL_OUTPUT_TOKENS):
+                message["content"] = content[:TOOL_OUTPUT_TOKENS * 4] + " [trimmed]"
+                trimmed = True
+        if trimmed:
+            metrics.context_compactions.inc(kind="tool_output")
+            self._counts = [approx_tokens(m) for m in self._context.messages]
+
+    def _compactable(self):
+        # Messages before the recent turns, oldest first
+        turns = self._turn_starts()
+        if len(turns) <= KEEP_RECENT_TURNS:
+            return []
+        return self._context.messages[self._head():turns[-KEEP_RECENT_TURNS]]
+
+    def _drop_oldest(self):
+        # Over the hard budget with no summary ready: drop whole turns
+        while self.tokens > self._budget:
+            messages = self._context.messages
+            head = self._head()
+            turns = [i for i in self._turn_starts() if i > head]
+            if len(turns) < KEEP_RECENT_TURNS:
+                break
+            self._set_messages(messages[:head] + messages[turns[0]:])
+            metrics.context_compactions.inc(kind="drop")
+
+    async def _summarize(self, old):
+        previous = self._summary["content"][len(SUMMARY_PREFIX):] if self._summary else ""
+        prompt = (
+            "Update the running summary of a phone call between a caller and an assistant. "
+            "Keep names, facts the caller shared, requests and the results of any lookups. "
+            "Reply with the summary only, in under 120 words.\n\n"
+            f"Current summary: {previous or '(none)'}\n\nNew conversation:\n{_transcript(old)}")
+        try:
+            response = await clients.groq_chat(
+                rate_limits.BACKGROUND,
+                messages=[{"role": "user", "content": prompt}],
+                model=SUMMARY_MODEL,
+                max_tokens=256,
+            )
+            summary = response.choices[0].message.content.strip()
+        except Exception as e:
+            logger.warning(f"Context summary failed: {e}")
+            return
+
+        # Messages may have been appended (or dropped) while we waited; only
+        # remove the ones that were summarized
+        old_ids = {id(m) for m in old}
+        rest = [m for m in self._context.messages if id(m) not in old_ids and m is not self._pinned and m is not self._summary]
+        self._summary = {"role": "system", "content": SUMMARY_PREFIX + summary}
+        self._set_messages(([self._pinned] if self._pinned else []) + [self._summary] + rest)
+        metrics.context_compactions.inc(kind="summary")
+
+    def compact(self):
+        self._sync_counts()
+        self._trim_tool_outputs()
+        if self.tokens > self._budget * SUMMARIZE_AT and self._summarizing is None:
+            old = list(self._compactable())
+            if old:
+                self._summarizing = asyncio.create_task(self._summarize(old))
+                self._summarizing.add_done_callback(self._summary_done)
+        if self.tokens > self._budget:
+            self._drop_oldest()
+        metrics.context_tokens.observe(self.tokens)
+
+    def _summary_done(self, task):
+        self._summarizing = None
+
+    async def process_frame(self, frame, direction):
+        await super().process_frame(frame, direction)
+        if isinstance(frame, OpenAILLMContextFrame) and frame.context is self._context:
+            self.compact()
+        await self.push_frame(frame, direction)
+
+    async def cleanup(self):
+        if self._summarizing is not None:
+            self._summarizing.cancel()
+        await super().cleanup()
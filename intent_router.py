@@ -0,0 +1,242 @@
+import argparse
+import json
+import math
+import os
+import random
+import re
+import zlib
+
+import metrics
+
+# Routes obvious SMS requests straight to a tool so choose_tools can skip the
+# 70B tool-use round trip. High-precision keyword rules go first, then a
+# linear model over hashed character n-grams; anything below the confidence
+# threshold goes to the LLM as before.
+#
+#   python intent_router.py train    # refit intents/model.json from intents/train.jsonl
+#   python benchmarks/bench_intents.py
+
+INTENTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "intents")
+MODEL_PATH = os.path.join(INTENTS_DIR, "model.json")
+TRAIN_PATH = os.path.join(INTENTS_DIR, "train.jsonl")
+TEST_PATH = os.path.join(INTENTS_DIR, "test.jsonl")
+
+# Below this probability the model defers to the LLM
+ROUTER_THRESHOLD = float(os.getenv("ROUTER_THRESHOLD", "0.85"))
+
+# "chat" means no tool, let the LLM answer
+INTENTS = ("search_bing", "quick_research", "toggle_wifi", "chat")
+# Only ever routed locally by their whole-clause rule, never on the model's
+# word: "dont turn off the wifi" scores high for toggle_wifi too
+SIDE_EFFECT_INTENTS = {"toggle_wifi"}
+
+DIMENSIONS = 2 ** 14
+NGRAMS = (2, 3, 4)
+
+# "hey, can you please ..." in front of a command
+COMMAND_PREFIX = (r"^\s*(?:(?:hey|hi|ok|okay)[\s,]+)?(?:please\s+)?"
+                  r"(?:(?:can|could|would|will)\s+you\s+(?:please\s+)?)?")
+QUESTION = re.compile(
+    r"^\s*(?:(?:hey|hi|ok|okay)[\s,]+)?(?:how|why|what|when|where|who|which|is|are|does|do|should)\b"
+    r"|\?\s*$",
+    re.IGNORECASE)
+# Messages are checked clause by clause: "it's slow, restart the router"
+CLAUSES = re.compile(r"\s*(?:[,;]|\.\s)\s*")
+
+# Whole-clause commands only, so "how do I reset my router" never matches
+WIFI_RULE = re.compile(
+    COMMAND_PREFIX +
+    r"(?:(?:turn|switch|toggle|shut|flip|restart|reset|reboot|kill|cut)(?:\s+(?:off|on|down|back on))?"
+    r"\s+(?:the\s+|my\s+|our\s+)?(?:wifi|wi-fi|internet|router)(?:\s+(?:off|on|down|back on))?"
+    r"|wifi|wi-fi"
+    r"|(?:wifi|wi-fi|internet|router)\s+(?:on|off|back on))"
+    r"(?:\s+(?:now|please))?[\s.!]*$",
+    re.IGNORECASE)
+# "google" and "bing" are also nouns ("google maps is broken"), so on their
+# own they only count with "for" or a colon, or after "please" / "can you"
+SEARCH_RULE = re.compile(
+    r"^\s*(?:(?:hey|hi|ok|okay)[\s,]+)?"
+    r"(?:(?:please\s+|(?:can|could|would|will)\s+you\s+(?:please\s+)?)(?:google|bing)\s+"
+    r"|(?:please\s+|(?:can|could|would|will)\s+you\s+(?:please\s+)?)?"
+    r"(?:search(?:\s+the\s+web)?(?:\s+for)?|look\s*up|(?:google|bing)(?:\s+for|\s*:))\s+)"
+    r"(?P<query>.+)$",
+    re.IGNORECASE)
+# Asking for something that needs fresh information, so always a search.
+# Only request phrasing: "what's the weather in ottawa", "news about the
+# election", not "tell me a joke about the weather".
+FRESH_RULE = re.compile(
+    COMMAND_PREFIX +
+    r"(?:(?:tell|give|show)\s+me\s+|check\s+|get\s+(?:me\s+)?)?"
+    r"(?:(?:what'?s|what\s+is|what\s+are|how'?s|how\s+is)\s+)?"
+    r"(?:the\s+|today'?s\s+|tomorrow'?s\s+|tonight'?s\s+|any\s+)?"
+    r"(?:latest\s+|breaking\s+)?(?:weather|forecast|headlines|news|stock\s+price|score)"
+    r"(?:\s+(?:in|for|at|on|about|of|from|like|near|outside|today|tomorrow|tonight|this|right\s+now)\b.*)?"
+    r"[\s?.!]*$",
+    re.IGNORECASE)
+RESEARCH_RULE = re.compile(
+    COMMAND_PREFIX +
+    r"(?:do\s+(?:some\s+|a\s+(?:bit\s+of\s+|quick\s+)?)?research\s+(?:on|about|into)"
+    r"|research|look\s+into|dig\s+into|give\s+me\s+an?\s+overview\s+of)\s+(?P<topic>.+)$",
+    re.IGNORECASE)
+
+# Leading filler dropped from messages used as search queries
+QUERY_PREFIX = re.compile(
+    r"^\s*(hey|hi|ok|okay|so|please|can you|could you|would you|will you|tell me|let me know|"
+    r"i want to know|i'd like to know|do you know|search( the web)?( for)?|google|bing|look up|lookup|find( out)?|"
+    r"research|look into|dig into|do some research on|give me an overview of|"
+    r"check|what's|whats)[\s,]+",
+    re.IGNORECASE)
+
+
+def features(text):
+    # Hashed character n-grams of the padded, lowercased words
+    counts = {}
+    for word in re.findall(r"[a-z0-9']+", text.lower()):
+        padded = f" {word} "
+        for n in NGRAMS:
+            for i in range(len(padded) - n + 1):
+                index = zlib.crc32(padded[i:i + n].encode()) % DIMENSIONS
+                counts[index] = counts.get(index, 0) + 1
+    norm = math.sqrt(sum(v * v for v in counts.values())) or 1.0
+    return {index: value / norm for index, value in counts.items()}
+
+
+def search_query(message):
+    query = message.strip()
+    # Peel "hey can you look up ..." one filler word at a time
+    while True:
+        stripped = QUERY_PREFIX.sub("", query, count=1)
+        if stripped == query:
+            break
+        query = stripped
+    return query.strip(" ?!.") or message.strip()
+
+
+def _softmax(scores):
+    top = max(scores.values())
+    exp = {label: math.exp(score - top) for label, score in scores.items()}
+    total = sum(exp.values())
+    return {label: value / total for label, value in exp.items()}
+
+
+class IntentModel:
+    def __init__(self, weights=None, bias=None):
+        # Sparse weights: intent -> {feature index: weight}
+        self.weights = weights or {intent: {} for intent in INTENTS}
+        self.bias = bias or dict.fromkeys(INTENTS, 0.0)
+
+    def probabilities(self, text):
+        x = features(text)
+        scores = {}
+        for intent in INTENTS:
+            w = self.weights[intent]
+            scores[intent] = self.bias[intent] + sum(w.get(i, 0.0) * v for i, v in x.items())
+        return _softmax(scores)
+
+    def fit(self, examples, epochs=40, rate=0.5, l2=1e-5, seed=0):
+        # Multinomial logistic regression, plain SGD
+        data = [(features(text), intent) for text, intent in examples]
+        rng = random.Random(seed)
+        for _ in range(epochs):
+            rng.shuffle(data)
+            for x, intent in data:
+                scores = {label: self.bias[label] + sum(self.weights[label].get(i, 0.0) * v for i, v in x.items())
+                          for label in INTENTS}
+                probs = _softmax(scores)
+                for label in INTENTS:
+                    gradient = probs[label] - (1.0 if label == intent else 0.0)
+                    w = self.weights[label]
+                    for i, v in x.items():
+                        w[i] = w.get(i, 0.0) * (1 - rate * l2) - rate * gradient * v
+                    self.bias[label] -= rate * gradient
+        # Tiny weights only bloat the file
+        for label in INTENTS:
+            self.weights[label] = {i: round(w, 4) for i, w in self.weights[label].items() if abs(w) >= 1e-3}
+        return self
+
+    def save(self, path=MODEL_PATH):
+        with open(path, "w") as f:
+            json.dump({"dimensions": DIMENSIONS, "ngrams": NGRAMS, "bias": self.bias,
+                       "weights": {label: {str(i): w for i, w in sorted(ws.items())}
+                                   for label, ws in self.weights.items()}}, f, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, path=MODEL_PATH):
+        with open(path) as f:
+            data = json.load(f)
+        weights = {label: {int(i): w for i, w in ws.items()} for label, ws in data["weights"].items()}
+        return cls(weights, data["bias"])
+
+
+def load_examples(path):
+    with open(path) as f:
+        return [(row["text"], row["intent"]) for row in (json.loads(line) for line in f if line.strip())]
+
+
+class IntentRouter:
+    def __init__(self, model_path=MODEL_PATH, threshold=ROUTER_THRESHOLD):
+        self.model_path = model_path
+        self.threshold = threshold
+        self._model = None
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = IntentModel.load(self.model_path) if os.path.exists(self.model_path) else None
+        return self._model
+
+    def classify(self, message):
+        # (intent, confidence, source)
+        question = QUESTION.search(message)
+        if not question and any(WIFI_RULE.match(clause) for clause in CLAUSES.split(message)):
+            return "toggle_wifi", 1.0, "rule"
+        if RESEARCH_RULE.match(message):
+            return "quick_research", 1.0, "rule"
+        if SEARCH_RULE.match(message) or FRESH_RULE.match(message):
+            return "search_bing", 1.0, "rule"
+        if self.model is None:
+            return "chat", 0.0, "llm"
+        probs = self.model.probabilities(message)
+        intent = max(probs, key=probs.get)
+        if intent in SIDE_EFFECT_INTENTS:
+            # Not a plain command (the rule above would have caught it):
+            # "remind me to turn off the wifi" is for the LLM to handle
+            return "chat", 0.0, "llm"
+        return intent, probs[intent], "model"
+
+    def route(self, message):
+        # {"name": tool, "arguments": {...}} when sure, otherwise None
+        intent, confidence, source = self.classify(message)
+        if intent == "chat" or confidence < self.threshold:
+            metrics.sms_router_decisions.inc(route="llm")
+            return None
+        metrics.sms_router_decisions.inc(route=source)
+        if intent == "toggle_wifi":
+            return {"name": "toggle_wifi", "arguments": {}}
+        if intent == "quick_research":
+            match = RESEARCH_RULE.match(message)
+            topic = match.group("topic").strip(" ?!.") if match else search_query(message)
+            return {"name": "quick_research", "arguments": {"topic": topic}}
+        match = SEARCH_RULE.match(message)
+        query = match.group("query").strip(" ?!.") if match else search_query(message)
+        return {"name": "search_bing", "arguments": {"query": query}}
+
+
+intent_router = IntentRouter()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["train"])
+    parser.add_argument("--epochs", type=int, default=40)
+    args = parser.parse_args()
+
+    examples = load_examples(TRAIN_PATH)
+    model = IntentModel().fit(examples, epochs=args.epochs)
+    model.save()
+    correct = sum(max(p := model.probabilities(text), key=p.get) == intent for text, intent in examples)
+    print(f"Trained on {len(examples)} examples, training accuracy {correct / len(examples):.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import asyncio
+
+from pipecat.frames.frames import StartInterruptionFrame
+from pipecat.processors.frame_processor import FrameProcessor
+from pipecat.services.elevenlabs import ElevenLabsTTSService
+
+import metrics
+
+# Stops paying for a turn once the caller talks over it. Every barge-in
+# starts a new generation of the call: tool calls from the old generation
+# are cancelled (which aborts their HTTP requests), whatever they still
+# return is dropped instead of landing in the context, and TTS for the old
+# generation stops reading audio.
+
+
+class CallScope:
+    def __init__(self):
+        self.generation = 0
+        self._tasks = set()
+        self._interrupted = set()
+
+    def interrupt(self):
+        self.generation += 1
+        for task in self._tasks:
+            if not task.done():
+                task.cancel()
+                self._interrupted.add(task)
+
+    def is_stale(self, generation):
+        return generation != self.generation
+
+    async def run(self, kind, coro):
+        # Awaits coro as a task of the current generation. Returns None,
+        # which pipecat takes as "nothing to add to the context", when the
+        # caller interrupted before it finished.
+        generation = self.generation
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        try:
+            result = await task
+        except asyncio.CancelledError:
+            metrics.cancelled_work.inc(kind=kind)
+            if task in self._interrupted:
+                return None
+            # The whole turn is being torn down, let that carry on
+            raise
+        finally:
+            self._tasks.discard(task)
+            self._interrupted.discard(task)
+        if self.is_stale(generation):
+            metrics.stale_results.inc(kind=kind)
+            return None
+        return result
+
+
+class InterruptionProbe(FrameProcessor):
+    # Pass-through right after the input transport, which sends
+    # StartInterruptionFrame out of band as soon as the caller starts talking
+
+    def __init__(self, scope):
+        super().__init__()
+        self._scope = scope
+
+    async def process_frame(self, frame, direction):
+        await super().process_frame(frame, direction)
+        if isinstance(frame, StartInterruptionFrame):
+            self._scope.interrupt()
+        await self.push_frame(frame, direction)
+
+
+class InterruptibleElevenLabsTTSService(ElevenLabsTTSService):
+    # Stops streaming a sentence once its turn was interrupted; closing the
+    # response early releases the connection instead of reading the rest
+
+    def __init__(self, *, scope, **kwargs):
+        super().__init__(**kwargs)
+        self._scope = scope
+
+    async def run_tts(self, text):
+        generation = self._scope.generation
+        frames = super().run_tts(text)
+        try:
+            async for frame in frames:
+                if self._scope.is_stale(generation):
+                    metrics.cancelled_work.inc(kind="tts")
+                    return
+                yield frame
+        except asyncio.CancelledError:
+            metrics.cancelled_work.inc(kind="tts")
+            raise
+        finally:
+            await frames.aclose()
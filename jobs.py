@@ -0,0 +1,408 @@
+import argparse
+import asyncio
+import contextvars
+import importlib
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from loguru import logger
+
+import journal
+
+# Durable queue for background work (SMS tool jobs), backed by SQLite so
+# jobs survive restarts and can be shared by several web and worker
+# processes on the same machine.
+#
+#   python jobs.py worker --processes 4    # extra worker processes
+#   python jobs.py status [job id]
+
+JOB_DB = os.getenv("JOB_DB", "jobs.sqlite3")
+# Enqueueing fails once this many jobs are queued or running
+JOB_MAX_PENDING = int(os.getenv("JOB_MAX_PENDING", "100"))
+# Jobs a single worker runs at the same time
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "4"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Retry n waits JOB_RETRY_DELAY * 2**(n-1) seconds
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", "5"))
+# A running job whose worker died is picked up again after this long; live
+# workers renew the lease every JOB_LEASE / 3 seconds
+JOB_LEASE = float(os.getenv("JOB_LEASE", "300"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))
+
+STATUSES = ("queued", "running", "done", "failed")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    run_after REAL NOT NULL,
+    locked_until REAL,
+    worker TEXT,
+    result TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (status, run_after);
+"""
+
+
+class QueueFull(Exception):
+    pass
+
+
+# kind -> (async handler(payload), async on_failure(payload, error) or None)
+handlers = {}
+
+
+def register(kind, handler, on_failure=None):
+    # on_failure runs once a job has used up all its attempts
+    handlers[kind] = (handler, on_failure)
+
+
+class JobQueue:
+    def __init__(self, path=JOB_DB, max_pending=JOB_MAX_PENDING):
+        self.path = path
+        self.max_pending = max_pending
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _db(self):
+        # A connection must not cross a fork, worker processes open their own
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SCHEMA)
+            self._pid = os.getpid()
+        return self._conn
+
+    def _transaction(self, fn):
+        with self._lock:
+            db = self._db()
+            # IMMEDIATE takes the write lock up front so two processes can't
+            # claim the same job
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(db)
+                db.execute("COMMIT")
+                return result
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+
+    def enqueue(self, kind, payload, max_attempts=JOB_MAX_ATTEMPTS):
+        def insert(db):
+            pending = db.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+            if pending >= self.max_pending:
+                raise QueueFull(f"{pending} jobs pending")
+            job_id = uuid.uuid4().hex
+            now = time.time()
+            db.execute(
+                "INSERT INTO jobs (id, kind, payload, status, max_attempts, run_after, created, updated) "
+                "VALUES (?, ?, ?, 'queued', ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(payload), max_attempts, now, now, now))
+            return job_id
+        return self._transaction(insert)
+
+    def claim(self, worker, lease=JOB_LEASE):
+        # Next due job, including running ones whose worker stopped renewing
+        # the lease (see Worker._heartbeat)
+        def claim_one(db):
+            now = time.time()
+            row = db.execute(
+                "SELECT * FROM jobs WHERE (status = 'queued' AND run_after <= ?) "
+                "OR (status = 'running' AND locked_until < ?) ORDER BY run_after LIMIT 1",
+                (now, now)).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, locked_until = ?, worker = ?, "
+                "updated = ? WHERE id = ?",
+                (now + lease, worker, now, row["id"]))
+            job = dict(row)
+            job["attempts"] += 1
+            job["payload"] = json.loads(job["payload"])
+            return job
+        return self._transaction(claim_one)
+
+    # The methods below only touch a job while it is still the caller's run:
+    # running, claimed by `worker`, on attempt `attempt`. A run whose lease
+    # ran out and was claimed again can no longer change the job.
+    _OWNED = "id = ? AND status = 'running' AND worker = ? AND attempts = ?"
+
+    def renew(self, job_id, worker, attempt, lease=JOB_LEASE):
+        # Returns False once the run lost its lease
+        cursor = self._transaction(lambda db: db.execute(
+            f"UPDATE jobs SET locked_until = ? WHERE {self._OWNED}",
+            (time.time() + lease, job_id, worker, attempt)))
+        return cursor.rowcount > 0
+
+    def save_payload(self, job_id, worker, attempt, payload):
+        cursor = self._transaction(lambda db: db.execute(
+            f"UPDATE jobs SET payload = ?, updated = ? WHERE {self._OWNED}",
+            (json.dumps(payload), time.time(), job_id, worker, attempt)))
+        return cursor.rowcount > 0
+
+    def complete(self, job_id, worker, attempt, result=None):
+        cursor = self._transaction(lambda db: db.execute(
+            f"UPDATE jobs SET status = 'done', result = ?, locked_until = NULL, updated = ? WHERE {self._OWNED}",
+            (json.dumps(result), time.time(), job_id, worker, attempt)))
+        return cursor.rowcount > 0
+
+    def fail(self, job_id, worker, attempt, error):
+        # Requeues with backoff. True once the job is out of attempts, False
+        # when it will be retried, None when the run no longer owned the job.
+        def update(db):
+            row = db.execute(f"SELECT attempts, max_attempts FROM jobs WHERE {self._OWNED}",
+                             (job_id, worker, attempt)).fetchone()
+            if row is None:
+                return None
+            attempts, max_attempts = row
+            now = time.time()
+            if attempts >= max_attempts:
+                db.execute("UPDATE jobs SET status = 'failed', error = ?, locked_until = NULL, updated = ? "
+                           "WHERE id = ?", (error, now, job_id))
+                return True
+            db.execute("UPDATE jobs SET status = 'queued', error = ?, run_after = ?, locked_until = NULL, "
+                       "updated = ? WHERE id = ?",
+                       (error, now + JOB_RETRY_DELAY * 2 ** (attempts - 1), now, job_id))
+            return False
+        return self._transaction(update)
+
+    def release(self, job_id, worker, attempt):
+        # Hands an interrupted job back without counting the attempt
+        self._transaction(lambda db: db.execute(
+            f"UPDATE jobs SET status = 'queued', attempts = attempts - 1, locked_until = NULL, updated = ? "
+            f"WHERE {self._OWNED}", (time.time(), job_id, worker, attempt)))
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._db().execute(
+                "SELECT id, kind, status, attempts, max_attempts, run_after, worker, result, error, created, updated "
+                "FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def counts(self):
+        with self._lock:
+            rows = self._db().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = dict.fromkeys(STATUSES, 0)
+        counts.update({status: count for status, count in rows})
+        return counts
+
+
+job_queue = JobQueue()
+
+# Workers running in this process, woken up by submit()
+_local_workers = set()
+# (queue, job id, worker, attempt) of the job the current task is running
+_current_run = contextvars.ContextVar("current_run", default=None)
+
+
+async def submit(kind, payload, max_attempts=JOB_MAX_ATTEMPTS):
+    job_id = await asyncio.to_thread(job_queue.enqueue, kind, payload, max_attempts)
+    for worker in _local_workers:
+        worker.wake()
+    return job_id
+
+
+async def checkpoint(payload):
+    # Saves the running job's payload, so a retry starts from what is
+    # already done instead of from scratch. A no-op outside a job; returns
+    # False when the run no longer owns the job.
+    run = _current_run.get()
+    if run is None:
+        return True
+    queue, *owned = run
+    return await asyncio.to_thread(queue.save_payload, *owned, payload)
+
+
+class Worker:
+    # Polls the queue and runs up to `concurrency` jobs at once on the
+    # current event loop
+
+    def __init__(self, queue=job_queue, concurrency=JOB_CONCURRENCY, name=None):
+        self.queue = queue
+        self.concurrency = concurrency
+        self.name = name or f"{os.uname().nodename}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._running = {}  # job id -> task
+        self._wake = asyncio.Event()
+        self._slots = asyncio.Semaphore(concurrency)
+        self._loop_task = None
+        self.counters = {"done": 0, "retried": 0, "failed": 0}
+
+    def start(self):
+        self._loop_task = asyncio.create_task(self._run())
+        _local_workers.add(self)
+
+    def wake(self):
+        # Skips the poll interval when this process just enqueued something
+        self._wake.set()
+
+    def stats(self):
+        return dict(self.counters, running=len(self._running))
+
+    async def _run(self):
+        while True:
+            await self._slots.acquire()
+            try:
+                job = await asyncio.to_thread(self.queue.claim, self.name)
+            except Exception as e:
+                logger.error(f"Claiming a job failed: {e}")
+                job = None
+            if job is None:
+                self._slots.release()
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            task = asyncio.create_task(self._execute(job))
+            self._running[job["id"]] = task
+
+    async def _heartbeat(self, job, run):
+        # Keeps the lease while the job runs so no other worker starts it
+        # again. If the lease was lost anyway (the loop stalled for a whole
+        # lease), the job belongs to someone else now and this run stops.
+        while True:
+            await asyncio.sleep(JOB_LEASE / 3)
+            try:
+                renewed = await asyncio.to_thread(self.queue.renew, job["id"], self.name, job["attempts"])
+            except Exception as e:
+                logger.error(f"Renewing the lease on job {job['id']} failed: {e}")
+                continue
+            if not renewed:
+                logger.warning(f"Job {job['id']} lost its lease, stopping this run")
+                run.cancel()
+                return
+
+    async def _execute(self, job):
+        started = time.time()
+        outcome = "done"
+        owned = (job["id"], self.name, job["attempts"])
+        heartbeat = asyncio.create_task(self._heartbeat(job, asyncio.current_task()))
+        _current_run.set((self.queue, *owned))
+        try:
+            handler, on_failure = handlers[job["kind"]]
+            result = await handler(job["payload"])
+        except asyncio.CancelledError:
+            # Either the worker is stopping or the heartbeat found the lease gone
+            outcome = "lost" if heartbeat.done() and not heartbeat.cancelled() else "released"
+            await asyncio.to_thread(self.queue.release, *owned)
+            raise
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            logger.error(f"Job {job['id']} ({job['kind']}) attempt {job['attempts']} failed: {error}")
+            finished = await asyncio.to_thread(self.queue.fail, *owned, error)
+            if finished is None:
+                outcome = "lost"
+            elif finished:
+                outcome = "failed"
+                self.counters["failed"] += 1
+                on_failure = handlers.get(job["kind"], (None, None))[1]
+                if on_failure is not None:
+                    try:
+                        await on_failure(job["payload"], error)
+                    except Exception as e:
+                        logger.error(f"Failure handler for job {job['id']} failed: {e}")
+            else:
+                outcome = "retried"
+                self.counters["retried"] += 1
+        else:
+            if await asyncio.to_thread(self.queue.complete, *owned, result):
+                self.counters["done"] += 1
+            else:
+                outcome = "lost"
+                logger.warning(f"Job {job['id']} finished after losing its lease, result dropped")
+        finally:
+            heartbeat.cancel()
+            journal.record("job", job=job["kind"], outcome=outcome, attempt=job["attempts"],
+                           seconds=round(time.time() - started, 3), waited=round(started - job["created"], 3))
+            self._running.pop(job["id"], None)
+            self._slots.release()
+
+    async def stop(self, grace=10):
+        # Let running jobs finish for a bit, anything left goes back on the queue
+        _local_workers.discard(self)
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            await asyncio.gather(self._loop_task, return_exceptions=True)
+        running = list(self._running.values())
+        if running:
+            _, pending = await asyncio.wait(running, timeout=grace)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def _serve(handler_module, concurrency):
+    module = importlib.import_module(handler_module)
+    worker = Worker(concurrency=concurrency)
+    worker.start()
+    logger.info(f"Job worker {worker.name} running {sorted(handlers)}")
+    startup, shutdown = getattr(module, "job_worker_startup", None), getattr(module, "job_worker_shutdown", None)
+    if startup:
+        await startup()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await worker.stop()
+        if shutdown:
+            await shutdown()
+
+
+def _worker_process(handler_module, concurrency):
+    try:
+        asyncio.run(_serve(handler_module, concurrency))
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+    worker = commands.add_parser("worker", help="run job workers")
+    worker.add_argument("--processes", type=int, default=1)
+    worker.add_argument("--concurrency", type=int, default=JOB_CONCURRENCY)
+    worker.add_argument("--handlers", default="sms", help="module that registers the job handlers")
+    status = commands.add_parser("status", help="show queue counts or one job")
+    status.add_argument("job_id", nargs="?")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        if args.job_id:
+            print(json.dumps(job_queue.get(args.job_id), indent=2))
+        else:
+            print(json.dumps(job_queue.counts(), indent=2))
+        return
+
+    processes = [multiprocessing.Process(target=_worker_process, args=(args.handlers, args.concurrency))
+                 for _ in range(args.processes)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+import argparse
+import asyncio
+import glob
+import gzip
+import json
+import os
+import time
+from collections import defaultdict
+
+from loguru import logger
+
+# Structured record of production traffic: every SMS, call, voice turn and
+# tool call with its timings. record() only appends to an in-memory buffer;
+# a background task writes batches to rotating gzip JSONL segments in a
+# thread. When the disk falls behind the buffer fills up and new records
+# are dropped (and counted) rather than slowing down a call.
+#
+#   python journal.py analyze [--since HOURS]
+
+JOURNAL_DIR = os.getenv("JOURNAL_DIR", "journal")
+# Set JOURNAL_ENABLED=0 to turn the journal off
+JOURNAL_ENABLED = os.getenv("JOURNAL_ENABLED", "1") != "0"
+# Records waiting to be written; beyond this they are dropped
+JOURNAL_MAX_PENDING = int(os.getenv("JOURNAL_MAX_PENDING", "10000"))
+# A batch is written when it reaches this size or every JOURNAL_FLUSH_INTERVAL seconds
+JOURNAL_BATCH_SIZE = int(os.getenv("JOURNAL_BATCH_SIZE", "500"))
+JOURNAL_FLUSH_INTERVAL = float(os.getenv("JOURNAL_FLUSH_INTERVAL", "2"))
+# A new segment starts past this size (compressed) or age
+JOURNAL_SEGMENT_BYTES = int(os.getenv("JOURNAL_SEGMENT_BYTES", str(16 * 2 ** 20)))
+JOURNAL_SEGMENT_SECONDS = float(os.getenv("JOURNAL_SEGMENT_SECONDS", "3600"))
+# Oldest segments are deleted beyond this many
+JOURNAL_KEEP_SEGMENTS = int(os.getenv("JOURNAL_KEEP_SEGMENTS", "500"))
+
+
+class Journal:
+    def __init__(self, directory=JOURNAL_DIR, max_pending=JOURNAL_MAX_PENDING):
+        self.directory = directory
+        self.max_pending = max_pending
+        self._pending = []
+        self._wake = None
+        self._task = None
+        self._segment = None  # path of the segment being written
+        self._segment_started = 0.0
+        self.counters = {"recorded": 0, "written": 0, "dropped": 0, "batches": 0, "segments": 0, "errors": 0}
+
+    def record(self, kind, **fields):
+        # Never blocks and never raises; cheap enough for the audio path
+        if self._task is None:
+            return
+        if len(self._pending) >= self.max_pending:
+            self.counters["dropped"] += 1
+            return
+        self._pending.append({"ts": round(time.time(), 3), "kind": kind, "pid": os.getpid(), **fields})
+        self.counters["recorded"] += 1
+        if len(self._pending) >= JOURNAL_BATCH_SIZE:
+            self._wake.set()
+
+    def start(self):
+        if not JOURNAL_ENABLED or self._task is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Writes whatever is still buffered
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        await self._flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), JOURNAL_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self._flush()
+
+    async def _flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        try:
+            # The thread is the only thing that waits on the disk
+            await asyncio.to_thread(self._write, batch)
+        except OSError as e:
+            self.counters["errors"] += 1
+            self.counters["dropped"] += len(batch)
+            logger.warning(f"Journal write failed, dropped {len(batch)} records: {e}")
+
+    def _write(self, batch):
+        data = "".join(json.dumps(record, separators=(",", ":"), default=str) + "\n" for record in batch)
+        path = self._current_segment()
+        # Each batch is its own gzip member, so a segment cut short by a
+        # crash is still readable up to the last batch
+        with gzip.open(path, "ab", compresslevel=6) as f:
+            f.write(data.encode())
+        self.counters["written"] += len(batch)
+        self.counters["batches"] += 1
+
+    def _current_segment(self):
+        now = time.time()
+        if (self._segment is None or now - self._segment_started >= JOURNAL_SEGMENT_SECONDS
+                or (os.path.exists(self._segment) and os.path.getsize(self._segment) >= JOURNAL_SEGMENT_BYTES)):
+            stamp = time.strftime("%Y%m%d-%H%M%S", time.gmtime(now))
+            self._segment = os.path.join(self.directory, f"journal-{stamp}-{os.getpid()}.jsonl.gz")
+            self._segment_started = now
+            self.counters["segments"] += 1
+            self._prune()
+        return self._segment
+
+    def _prune(self):
+        segments = sorted(glob.glob(os.path.join(self.directory, "journal-*.jsonl.gz")), key=os.path.getmtime)
+        for path in segments[:max(0, len(segments) - JOURNAL_KEEP_SEGMENTS + 1)]:
+            os.remove(path)
+
+    def stats(self):
+        return dict(self.counters, pending=len(self._pending))
+
+
+journal = Journal()
+
+
+def record(kind, **fields):
+    journal.record(kind, **fields)
+
+
+#
+# Offline analysis
+#
+
+def read_records(directory=JOURNAL_DIR, since=None):
+    for path in sorted(glob.glob(os.path.join(directory, "journal-*.jsonl.gz"))):
+        if since and os.path.getmtime(path) < since:
+            continue
+        try:
+            with gzip.open(path, "rt") as f:
+                for line in f:
+                    record = json.loads(line)
+                    if not since or record["ts"] >= since:
+                        yield record
+        except (EOFError, gzip.BadGzipFile, json.JSONDecodeError) as e:
+            # A segment still being written or cut short by a crash
+            logger.warning(f"Stopped reading {path}: {e}")
+
+
+def percentiles(values, points=(50, 90, 99)):
+    values = sorted(values)
+    if not values:
+        return {p: None for p in points}
+    return {p: values[min(len(values) - 1, int(p / 100 * len(values)))] for p in points}
+
+
+def _row(label, values, width=28):
+    p = percentiles(values)
+    cells = "".join(f"{p[point]:>9.3f}" if p[point] is not None else f"{'-':>9}" for point in (50, 90, 99))
+    return f"  {label:<{width}}{len(values):>7}{cells}"
+
+
+def analyze(records):
+    turns = defaultdict(list)
+    tools = defaultdict(list)
+    tool_outcomes = defaultdict(lambda: defaultdict(int))
+    sms = defaultdict(list)
+    replies = defaultdict(list)
+    job_runs = defaultdict(list)
+    job_waits = defaultdict(list)
+    calls = []
+    counts = defaultdict(int)
+    first = last = None
+    for record in records:
+        counts[record["kind"]] += 1
+        first = record["ts"] if first is None else min(first, record["ts"])
+        last = record["ts"] if last is None else max(last, record["ts"])
+        if record["kind"] == "turn":
+            for stage, seconds in record.get("stages", {}).items():
+                turns[stage].append(seconds)
+            if record.get("mouth_to_ear") is not None:
+                turns["mouth_to_ear"].append(record["mouth_to_ear"])
+        elif record["kind"] == "tool":
+            key = f"{record['tool']} ({record.get('path')})"
+            tools[key].append(record["seconds"])
+            tool_outcomes[key][record.get("outcome", "ok")] += 1
+        elif record["kind"] == "sms":
+            sms[record.get("outcome", "unknown")].append(record["seconds"])
+        elif record["kind"] == "sms_reply":
+            if record.get("first_message") is not None:
+                replies["first message"].append(record["first_message"])
+            replies["complete"].append(record["seconds"])
+        elif record["kind"] == "job":
+            job_runs[f"{record['job']} {record['outcome']}"].append(record["seconds"])
+            job_waits[record["job"]].append(record.get("waited", 0))
+        elif record["kind"] == "call":
+            calls.append(record["seconds"])
+
+    if not counts:
+        print("No journal records")
+        return
+    span = (last - first) / 3600
+    print(f"{sum(counts.values())} records over {span:.1f}h: " + ", ".join(f"{n} {k}" for k, n in sorted(counts.items())))
+    header = f"  {'':<28}{'count':>7}{'p50':>9}{'p90':>9}{'p99':>9}"
+
+    if turns:
+        print("\nVoice turns (seconds)")
+        print(header)
+        for stage in sorted(turns, key=lambda s: s == "mouth_to_ear"):
+            print(_row(stage, turns[stage]))
+    if calls:
+        print("\nCalls (seconds)")
+        print(header)
+        print(_row("duration", calls))
+    if tools:
+        print("\nTool calls (seconds)")
+        print(header + "  outcomes")
+        for key in sorted(tools, key=lambda k: -len(tools[k])):
+            outcomes = ", ".join(f"{n} {outcome}" for outcome, n in sorted(tool_outcomes[key].items()))
+            print(_row(key, tools[key]) + f"  {outcomes}")
+    if sms:
+        print("\nSMS webhook by outcome (seconds)")
+        print(header)
+        for outcome in sorted(sms, key=lambda o: -len(sms[o])):
+            print(_row(outcome, sms[outcome]))
+    if replies:
+        print("\nSMS tool replies (seconds)")
+        print(header)
+        for key in ("first message", "complete"):
+            print(_row(key, replies[key]))
+    if job_runs:
+        print("\nJobs (seconds)")
+        print(header)
+        for key in sorted(job_runs):
+            print(_row(key, job_runs[key]))
+        for kind in sorted(job_waits):
+            print(_row(f"{kind} queued", job_waits[kind]))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+    report = commands.add_parser("analyze", help="latency percentiles and tool usage from the journal")
+    report.add_argument("--dir", default=JOURNAL_DIR)
+    report.add_argument("--since", type=float, help="only the last N hours")
+    args = parser.parse_args()
+
+    if args.command == "analyze":
+        since = time.time() - args.since * 3600 if args.since else None
+        analyze(read_records(args.dir, since))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import bisect
+import threading
+
+# Minimal in-process metrics with Prometheus text exposition, served by
+# server.py on /metrics. Everything here is cheap enough for the audio path.
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0, 30.0)
+
+_registry = []
+
+
+def _label_str(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values)) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        # Copied under the lock: tool threads increment while a scrape renders
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_label_str(self.labelnames, key)} {value}" for key, value in values]
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        # function, if given, is called at scrape time and returns a number
+        # (or a {label value: number} dict for a single-label gauge)
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+        self._function = function
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            values = dict(self._values)
+        if self._function is not None:
+            result = self._function()
+            values = {(str(k),): v for k, v in result.items()} if isinstance(result, dict) else {(): result}
+        return [f"{self.name}{_label_str(self.labelnames, key)} {value}" for key, value in values.items()]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def _samples(self):
+        with self._lock:
+            snapshot = [(key, list(series)) for key, series in self._series.items()]
+        lines = []
+        for key, series in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_label_str(self.labelnames, key, ('le', bound))} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_str(self.labelnames, key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_label_str(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+def render():
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+# Voice turn stages, see turn_metrics.TurnTracker
+turn_stage_seconds = Histogram(
+    "voice_turn_stage_seconds",
+    "Time spent in each stage of a voice turn",
+    labelnames=("stage",))
+turn_mouth_to_ear_seconds = Histogram(
+    "voice_turn_mouth_to_ear_seconds",
+    "From the caller's VAD end of speech to the first outbound audio frame")
+tool_seconds = Histogram(
+    "tool_seconds",
+    "Tool call duration",
+    labelnames=("tool", "path"))
+context_tokens = Histogram(
+    "voice_context_tokens",
+    "Approximate prompt tokens per voice LLM request, after compaction",
+    buckets=(500, 1000, 2000, 3000, 4000, 5000, 6000, 7000, 8000))
+context_compactions = Counter(
+    "voice_context_compactions",
+    "Context compactions by kind (tool_output, summary, drop)",
+    labelnames=("kind",))
+sms_router_decisions = Counter(
+    "sms_router_decisions",
+    "How SMS messages were routed: local rule, local model or the LLM",
+    labelnames=("route",))
+groq_wait_seconds = Histogram(
+    "groq_wait_seconds",
+    "Time a Groq request waited on the shared rate limits",
+    labelnames=("priority",))
+sms_sent = Counter("sms_sent", "Outbound SMS accepted by Twilio")
+cancelled_work = Counter(
+    "voice_cancelled_work",
+    "Tool calls, TTS and LLM streams abandoned because the caller interrupted",
+    labelnames=("kind",))
+stale_results = Counter(
+    "voice_stale_results",
+    "Tool results that arrived after the caller interrupted and were dropped",
+    labelnames=("kind",))
+
+active_calls = Gauge("active_calls", "Voice calls currently connected")
@@ -0,0 +1,129 @@
+import asyncio
+import hashlib
+import os
+import random
+
+from dotenv import load_dotenv
+from loguru import logger
+
+from pipecat.frames.frames import AudioRawFrame
+
+import clients
+
+load_dotenv(override=True)
+
+# Audio for the fixed things Lucy says on every call, synthesized once and kept
+# in Twilio's native 8 kHz mu-law both in memory and on disk.
+
+PHRASE_CACHE_DIR = os.getenv("PHRASE_CACHE_DIR", "phrase_cache")
+ASSISTANT_NAME = "Lucy"
+
+GREETING = "Hey there, it's {name}! What can I do for you today?"
+
+SEARCH_FILLERS = [
+    "Let me search for that. Give me one second.",
+    "Good question, let me look that up.",
+    "One sec, I'm checking the web for you.",
+]
+
+elevenlabs_tts_url = "https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
+
+_audio = {}  # rendered phrase -> mu-law bytes
+_pcm = {}  # rendered phrase -> 16 kHz PCM, expanded on first playback
+
+
+def render(template):
+    return template.format(name=ASSISTANT_NAME)
+
+
+def all_phrases():
+    return [render(GREETING)] + [render(filler) for filler in SEARCH_FILLERS]
+
+
+def _voice_id():
+    return os.getenv("ELEVENLABS_VOICE_ID")
+
+
+def _path(phrase):
+    # The voice is part of the key so switching voices never replays stale audio
+    digest = hashlib.sha1(f"{_voice_id()}:{phrase}".encode()).hexdigest()[:16]
+    return os.path.join(PHRASE_CACHE_DIR, f"{digest}.ulaw")
+
+
+async def _synthesize(phrase):
+    url = elevenlabs_tts_url.format(voice_id=_voice_id())
+    headers = {"xi-api-key": os.getenv("ELEVENLABS_API_KEY"), "Content-Type": "application/json"}
+    payload = {"text": phrase, "model_id": "eleven_turbo_v2"}
+    async with clients.http_session().post(url, json=payload, headers=headers,
+                                           params={"output_format": "ulaw_8000"}) as response:
+        if response.status != 200:
+            raise Exception(f"Error synthesizing phrase (status: {response.status}, error: {await response.text()})")
+        return await response.read()
+
+
+def _write(path, audio):
+    os.makedirs(PHRASE_CACHE_DIR, exist_ok=True)
+    tmp_path = path + ".part"
+    with open(tmp_path, "wb") as f:
+        f.write(audio)
+    os.replace(tmp_path, path)
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def load(phrase):
+    if phrase in _audio:
+        return _audio[phrase]
+
+    path = _path(phrase)
+    if os.path.exists(path):
+        audio = await asyncio.to_thread(_read, path)
+    else:
+        audio = await _synthesize(phrase)
+        await asyncio.to_thread(_write, path, audio)
+        logger.debug(f"Cached phrase audio: [{phrase}]")
+    _audio[phrase] = audio
+    return audio
+
+
+async def warm(phrases=None):
+    # Missing phrases simply fall back to live TTS, so failures are only logged
+    phrases = phrases or all_phrases()
+    results = await asyncio.gather(*[load(phrase) for phrase in phrases], return_exceptions=True)
+    for phrase, result in zip(phrases, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Could not cache phrase [{phrase}]: {result}")
+    logger.info(f"Phrase cache holds {len(_audio)} phrases")
+
+
+def _to_pcm(ulaw):
+    # pipecat.utils.audio pulls in pyloudnorm and scipy; the web server only
+    # pays for that once a call actually needs audio
+    from pipecat.utils.audio import ulaw_8000_to_pcm_16000
+    return ulaw_8000_to_pcm_16000(ulaw)
+
+
+def ulaw_to_frame(ulaw):
+    # The pipecat output transport and Twilio serializer expect 16 kHz PCM
+    return AudioRawFrame(audio=_to_pcm(ulaw), sample_rate=16000, num_channels=1)
+
+
+def frame(phrase):
+    # Returns None when the phrase isn't cached yet; callers fall back to TTS
+    pcm = _pcm.get(phrase)
+    if pcm is None:
+        if phrase not in _audio:
+            return None
+        pcm = _pcm[phrase] = _to_pcm(_audio[phrase])
+    return AudioRawFrame(audio=pcm, sample_rate=16000, num_channels=1)
+
+
+def greeting():
+    return render(GREETING)
+
+
+def search_filler():
+    return render(random.choice(SEARCH_FILLERS))
@@ -0,0 +1,112 @@
+import asyncio
+import os
+import time
+
+from loguru import logger
+
+from pipecat.vad.vad_analyzer import VADState
+
+# Number of calls that can be picked up without loading anything
+CALL_POOL_SIZE = int(os.getenv("CALL_POOL_SIZE", "2"))
+
+
+class CallComponents:
+    def __init__(self, vad, services, cold):
+        self.vad = vad
+        self.services = services
+        self.cold = cold
+
+
+def reset_vad(vad):
+    # Bring a used analyzer back to the state of a freshly loaded one
+    vad._model.reset_states()
+    vad._vad_buffer = b""
+    vad._vad_state = VADState.QUIET
+    vad._vad_starting_count = 0
+    vad._vad_stopping_count = 0
+    vad._prev_volume = 0
+
+
+class ComponentPool:
+    # VAD analyzers are expensive (model load) and are reset and reused across
+    # calls. Pipecat services are frame processors that get linked into a
+    # single pipeline, so those are built ahead of time but used only once and
+    # replaced in the background.
+
+    def __init__(self, create_vad, create_services, size=CALL_POOL_SIZE):
+        self._create_vad = create_vad
+        self._create_services = create_services
+        self.size = size
+        self._vads = asyncio.Queue()
+        self._services = asyncio.Queue()
+        self._refills = set()
+        self.counters = {"checkouts": 0, "cold_vads": 0, "cold_services": 0, "released": 0}
+        self.checkout_seconds = {"total": 0.0, "max": 0.0, "last": 0.0}
+
+    async def start(self):
+        started = time.perf_counter()
+        # torch.hub shares a cache directory, so load the models one at a time
+        for _ in range(self.size):
+            self._vads.put_nowait(await asyncio.to_thread(self._create_vad))
+            self._services.put_nowait(self._create_services())
+        logger.info(f"Warmed {self.size} call pipelines in {time.perf_counter() - started:.2f}s")
+
+    async def checkout(self):
+        started = time.perf_counter()
+        cold = False
+        try:
+            vad = self._vads.get_nowait()
+        except asyncio.QueueEmpty:
+            cold = True
+            self.counters["cold_vads"] += 1
+            vad = await asyncio.to_thread(self._create_vad)
+
+        try:
+            services = self._services.get_nowait()
+        except asyncio.QueueEmpty:
+            cold = True
+            self.counters["cold_services"] += 1
+            services = self._create_services()
+        self._refill_services()
+
+        elapsed = time.perf_counter() - started
+        self.counters["checkouts"] += 1
+        self.checkout_seconds["total"] += elapsed
+        self.checkout_seconds["last"] = elapsed
+        self.checkout_seconds["max"] = max(self.checkout_seconds["max"], elapsed)
+        logger.debug(f"Checked out call pipeline in {elapsed * 1000:.1f}ms{' (cold)' if cold else ''}")
+        return CallComponents(vad, services, cold)
+
+    def release(self, components):
+        self.counters["released"] += 1
+        try:
+            reset_vad(components.vad)
+        except Exception as e:
+            logger.warning(f"Dropping VAD analyzer that failed to reset: {e}")
+            return
+        # Don't hoard analyzers created during a burst beyond twice the pool size
+        if self._vads.qsize() < self.size * 2:
+            self._vads.put_nowait(components.vad)
+
+    def _refill_services(self):
+        if self._services.qsize() + len(self._refills) >= self.size:
+            return
+        task = asyncio.create_task(self._build_services())
+        self._refills.add(task)
+        task.add_done_callback(self._refills.discard)
+
+    async def _build_services(self):
+        # Yield first so the refill never delays the call that triggered it
+        await asyncio.sleep(0)
+        self._services.put_nowait(self._create_services())
+
+    def stats(self):
+        checkouts = self.counters["checkouts"]
+        return {
+            **self.counters,
+            "idle_vads": self._vads.qsize(),
+            "idle_services": self._services.qsize(),
+            "checkout_avg_ms": self.checkout_seconds["total"] / checkouts * 1000 if checkouts else 0.0,
+            "checkout_max_ms": self.checkout_seconds["max"] * 1000,
+            "checkout_last_ms": self.checkout_seconds["last"] * 1000,
+        }
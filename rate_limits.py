@@ -0,0 +1,162 @@
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import re
+import time
+
+from loguru import logger
+
+import metrics
+
+# Shares the Groq API key's rate limits between live calls and SMS work.
+# Every completion first takes requests and tokens from its model's buckets;
+# when they run dry, requests queue by priority so a voice turn is never
+# stuck behind a burst of texts. The buckets follow Groq's x-ratelimit
+# headers, see clients._on_response.
+
+VOICE, SMS, BACKGROUND = 0, 1, 2
+PRIORITY_NAMES = {VOICE: "voice", SMS: "sms", BACKGROUND: "background"}
+
+# Share of the token bucket only voice turns may use
+RESERVE = {VOICE: 0.0, SMS: 0.2, BACKGROUND: 0.3}
+
+# (requests per minute, tokens per minute), Groq's free tier
+DEFAULT_LIMITS = {
+    "llama3-groq-70b-8192-tool-use-preview": (30, 15000),
+    "mixtral-8x7b-32768": (30, 5000),
+    "llama3-8b-8192": (30, 30000),
+}
+FALLBACK_LIMITS = (30, 6000)
+# {"model": [rpm, tpm]} overrides for paid keys
+GROQ_RATE_LIMITS = {**DEFAULT_LIMITS, **{model: tuple(limits) for model, limits in
+                                         json.loads(os.getenv("GROQ_RATE_LIMITS") or "{}").items()}}
+
+# Completion tokens counted up front; headers correct the estimate afterwards
+EXPECTED_COMPLETION_TOKENS = 256
+
+
+def estimate_tokens(messages, max_tokens=None):
+    prompt = sum(len(json.dumps(message, default=str)) // 4 for message in messages)
+    return prompt + min(max_tokens or EXPECTED_COMPLETION_TOKENS, EXPECTED_COMPLETION_TOKENS)
+
+
+def parse_duration(value):
+    # Groq sends resets like "7.66s", "2m59.56s" or "120ms"
+    seconds = 0.0
+    for amount, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value or ""):
+        seconds += float(amount) * {"ms": 0.001, "h": 3600, "m": 60, "s": 1}[unit]
+    return seconds
+
+
+class TokenBucket:
+    def __init__(self, capacity, per_second):
+        self.capacity = capacity
+        self.per_second = per_second
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.per_second)
+        self.updated = now
+
+    def delay(self, amount, reserve=0.0):
+        # Seconds until `amount` can be taken while leaving `reserve` in the bucket
+        self.refill()
+        needed = min(amount, self.capacity) + reserve * self.capacity - self.level
+        return max(0.0, needed / self.per_second)
+
+    def take(self, amount):
+        self.refill()
+        self.level -= amount
+
+
+class ModelLimits:
+    def __init__(self, model):
+        rpm, tpm = GROQ_RATE_LIMITS.get(model, FALLBACK_LIMITS)
+        self.requests = TokenBucket(rpm, rpm / 60)
+        self.tokens = TokenBucket(tpm, tpm / 60)
+        self.paused_until = 0.0
+        self.waiters = []  # heap of (priority, sequence)
+        self.changed = asyncio.Event()
+
+    def notify(self):
+        # Wake every waiter so the new head of the queue re-checks the buckets
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+    def delay(self, tokens, priority):
+        pause = self.paused_until - time.monotonic()
+        return max(pause, self.requests.delay(1), self.tokens.delay(tokens, RESERVE[priority]))
+
+
+class GroqScheduler:
+    def __init__(self):
+        self._models = {}
+        self._sequence = itertools.count()
+        self.counters = {"rate_limited": 0, "header_updates": 0}
+
+    def limits(self, model):
+        if model not in self._models:
+            self._models[model] = ModelLimits(model)
+        return self._models[model]
+
+    async def acquire(self, model, tokens, priority=SMS):
+        limits = self.limits(model)
+        entry = (priority, next(self._sequence))
+        heapq.heappush(limits.waiters, entry)
+        started = time.perf_counter()
+        try:
+            while True:
+                changed = limits.changed
+                delay = limits.delay(tokens, priority) if limits.waiters[0] == entry else None
+                if delay == 0:
+                    limits.requests.take(1)
+                    limits.tokens.take(tokens)
+                    break
+                try:
+                    await asyncio.wait_for(changed.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            limits.waiters.remove(entry)
+            heapq.heapify(limits.waiters)
+            limits.notify()
+        waited = time.perf_counter() - started
+        metrics.groq_wait_seconds.observe(waited, priority=PRIORITY_NAMES[priority])
+        if waited > 1:
+            logger.debug(f"Waited {waited:.2f}s for the {model} rate limit ({PRIORITY_NAMES[priority]})")
+        return waited
+
+    def observe(self, model, status, headers):
+        # Trust the server's view of the token bucket over our estimate
+        limits = self.limits(model)
+        if "x-ratelimit-remaining-tokens" in headers:
+            self.counters["header_updates"] += 1
+            limit = float(headers.get("x-ratelimit-limit-tokens", limits.tokens.capacity))
+            limits.tokens.capacity = limit
+            limits.tokens.per_second = limit / 60
+            limits.tokens.refill()
+            limits.tokens.level = float(headers["x-ratelimit-remaining-tokens"])
+        # Groq's request limit in the headers is per day; only stop when it is spent
+        if headers.get("x-ratelimit-remaining-requests") == "0":
+            reset = parse_duration(headers.get("x-ratelimit-reset-requests"))
+            limits.paused_until = max(limits.paused_until, time.monotonic() + reset)
+        if status == 429:
+            self.counters["rate_limited"] += 1
+            retry_after = float(headers.get("retry-after") or 0) or parse_duration(headers.get("x-ratelimit-reset-tokens"))
+            limits.paused_until = max(limits.paused_until, time.monotonic() + (retry_after or 1))
+            logger.warning(f"Groq rate limited {model}, pausing for {retry_after or 1:.1f}s")
+        limits.notify()
+
+    def queue_depth(self):
+        depth = dict.fromkeys(PRIORITY_NAMES.values(), 0)
+        for limits in self._models.values():
+            for priority, _ in limits.waiters:
+                depth[PRIORITY_NAMES[priority]] += 1
+        return depth
+
+
+groq_scheduler = GroqScheduler()
@@ -1,24 +1,97 @@
+import importlib
 import json
 import os
+import sys
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime
 from typing import Annotated
 
 import uvicorn
+from loguru import logger
 
-from fastapi import FastAPI, WebSocket, Response
+from fastapi import FastAPI, WebSocket, Response, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from starlette.responses import HTMLResponse
+from starlette.responses import HTMLResponse, PlainTextResponse
 from fastapi.requests import Request
 
 from twilio.twiml.messaging_response import MessagingResponse
-from twilio.rest import Client
-from bot import run_bot, handle_tools, choose_tools
+from sms import queue_tools, choose_tools, finish_sms
+from tools.search_cache import search_cache
+import clients
+import jobs
+import journal
+import metrics
+import phrase_cache
+import rate_limits
+from sms_sender import sms_sender, split_message
+from sound_library import sound_library
+from tools import executor
 import asyncio
 
 
 
-app = FastAPI()
+# The voice stack (pipecat, torch, the VAD models) loads in the background
+# after the server starts listening; /sms never waits for it
+VOICE_READY_TIMEOUT = float(os.getenv("VOICE_READY_TIMEOUT", "60"))
+voice_ready = asyncio.Event()
+# Set once get_ready has finished, whether or not it succeeded
+startup_finished = asyncio.Event()
+started_at = time.perf_counter()
+ready_seconds = {}  # also holds "error" when startup failed
+
+
+async def get_ready():
+    # Heavy imports run in a thread so the event loop keeps serving webhooks
+    await asyncio.to_thread(importlib.import_module, "groq")
+    await clients.startup()
+    ready_seconds["sms"] = time.perf_counter() - started_at
+
+    # Calls fall back to live TTS until the phrase audio is ready
+    run_in_background(phrase_cache.warm())
+    run_in_background(asyncio.to_thread(sound_library.load))
+
+    bot = await asyncio.to_thread(importlib.import_module, "bot")
+    await bot.call_pool.start()
+    voice_ready.set()
+    ready_seconds["voice"] = time.perf_counter() - started_at
+    print(f"Ready in {ready_seconds['voice']:.2f}s (SMS after {ready_seconds['sms']:.2f}s)", flush=True)
+
+
+def startup_done(task):
+    # Without this a failed startup only shows up as "Task exception was
+    # never retrieved" while /ready and /ws wait forever
+    startup_finished.set()
+    if task.cancelled():
+        return
+    if task.exception() is not None:
+        error = task.exception()
+        ready_seconds["error"] = f"{type(error).__name__}: {error}"
+        logger.opt(exception=error).error(f"Startup failed after {time.perf_counter() - started_at:.2f}s")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    journal.journal.start()
+    # Queued SMS jobs don't depend on the voice stack, so they start right away
+    if JOB_WORKER_IN_PROCESS:
+        job_worker.start()
+    run_in_background(get_ready()).add_done_callback(startup_done)
+    yield
+    await job_worker.stop()
+    await sms_sender.flush()
+    executor.shutdown()
+    await clients.shutdown()
+    await journal.journal.stop()
+
+
+def call_pool_stats():
+    bot = sys.modules.get("bot")
+    return bot.call_pool.stats() if bot is not None and voice_ready.is_set() else {}
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -30,39 +103,106 @@ app.add_middleware(
 
 allowed_numbers = ['+16138626109', '+16138570911', '+16138570912']
 
+# Seconds the /sms webhook waits on tool routing before replying
+# "working on it" and finishing in the background (Twilio gives up at 15s)
+SMS_ROUTING_BUDGET = float(os.getenv("SMS_ROUTING_BUDGET", "5"))
+
+# Set JOB_WORKER_IN_PROCESS=0 when SMS tool jobs are left to `python jobs.py worker`
+JOB_WORKER_IN_PROCESS = os.getenv("JOB_WORKER_IN_PROCESS", "1") != "0"
+job_worker = jobs.Worker()
+
+# Keep references to background work so it isn't garbage collected mid-flight
+background_tasks = set()
+# Texts whose tool routing outlived the webhook, see finish_sms
+deferred_sms = set()
+
+
+def run_in_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+metrics.Gauge("deferred_sms", "Texts still being routed after the webhook answered",
+              function=lambda: len(deferred_sms))
+metrics.Gauge("jobs", "SMS tool jobs in the queue by status", labelnames=("status",),
+              function=jobs.job_queue.counts)
+metrics.Gauge("job_worker", "Jobs finished by this process's worker", labelnames=("counter",),
+              function=job_worker.stats)
+metrics.Gauge("groq_queue_depth", "Groq requests waiting on the rate limits", labelnames=("priority",),
+              function=rate_limits.groq_scheduler.queue_depth)
+metrics.Gauge("groq_scheduler", "Groq rate limit events", labelnames=("counter",),
+              function=lambda: rate_limits.groq_scheduler.counters)
+metrics.Gauge("sms_sender", "Outbound SMS queue", labelnames=("counter",),
+              function=sms_sender.stats)
+metrics.Gauge("search_cache", "Search cache counters", labelnames=("counter",),
+              function=search_cache.stats)
+metrics.Gauge("journal", "Traffic journal records", labelnames=("counter",),
+              function=journal.journal.stats)
+metrics.Gauge("call_pool", "Warm call pipeline pool", labelnames=("counter",),
+              function=call_pool_stats)
+metrics.Gauge("http_connections_opened", "New upstream HTTP connections", labelnames=("client",),
+              function=lambda: {name: c["opened"] for name, c in clients.connection_stats().items()})
+metrics.Gauge("http_connections_reused", "Pooled upstream HTTP connection reuses", labelnames=("client",),
+              function=lambda: {name: c["reused"] for name, c in clients.connection_stats().items()})
+
 class SMSRequest(BaseModel):
     Body: str
 
 @app.post('/sms')
 async def sms(request: Request):
     resp = MessagingResponse()
+    started = time.perf_counter()
+    outcome, tool_names, body = "error", [], None
     try:
         form = await request.form()
         body = form.get('Body')
         
         from_ = form.get('From')
         if from_ not in allowed_numbers:
-            raise HTTPException(status_code=403, details="Forbidden")
+            outcome = "forbidden"
+            raise HTTPException(status_code=403, detail="Forbidden")
             
-        (messages, tool_calls) = choose_tools(body)
+        to_ = form.get('To')
+        routing = asyncio.create_task(choose_tools(body))
+        try:
+            (messages, tool_calls) = await asyncio.wait_for(asyncio.shield(routing), SMS_ROUTING_BUDGET)
+        except asyncio.TimeoutError:
+            outcome = "deferred"
+            resp.message("Working on it, I'll text you back shortly.")
+            task = run_in_background(finish_sms(routing, from_, to_))
+            deferred_sms.add(task)
+            task.add_done_callback(deferred_sms.discard)
+            return Response(content=str(resp), media_type="application/xml")
+
         if not tool_calls:
             # can just return the response
-            resp.message(messages)
+            outcome = "reply"
+            for part in split_message(messages):
+                resp.message(part)
         else:
-            tool_names = [tool_call.function.name for tool_call in tool_calls]
-            resp.message("Calling tools: " + ", ".join(tool_names))
+            # Tools may take longer than the 15s limit for the twilio webhook,
+            # so they run as a queued job that texts the result back
+            try:
+                await queue_tools(messages, tool_calls, from_, to_)
+            except jobs.QueueFull:
+                outcome = "queue_full"
+                resp.message("I'm swamped right now, try again in a few minutes.")
+                return Response(content=str(resp), media_type="application/xml")
 
-            # Start an async task to handle the tools
-            # (as they may take longer than 15s limit for twilio webbook)
-            
-            to_ = form.get('To')
-            _ = asyncio.create_task(handle_tools(messages, tool_calls, from_, to_))
+            outcome = "tools"
+            tool_names = [tool_call["function"]["name"] for tool_call in tool_calls]
+            resp.message("Calling tools: " + ", ".join(tool_names))
 
         #print("Response sent", str(resp))
         return Response(content=str(resp), media_type="application/xml")
     except Exception as e:
         resp.message(f"An error occurred {e}")
         return Response(content=str(resp), media_type="application/xml")
+    finally:
+        journal.record("sms", outcome=outcome, tools=tool_names, chars=len(body or ""),
+                       seconds=round(time.perf_counter() - started, 3))
 
 
 @app.post('/start_call')
@@ -72,8 +212,10 @@ async def start_call(request: Request):
 
         from_ = form.get('From')
         if from_ not in allowed_numbers:
-            raise HTTPException(status_code=403, details="Forbidden")
-            
+            raise HTTPException(status_code=403, detail="Forbidden")
+    except HTTPException:
+        raise
+
     host = request.headers['Host']
     xml = f"""<?xml version="1.0" encoding="UTF-8"?>
 <Response>
@@ -86,8 +228,41 @@ async def start_call(request: Request):
     return HTMLResponse(content=xml, media_type="application/xml")
 
 
+@app.get('/metrics')
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get('/jobs/{job_id}')
+async def get_job(job_id: str):
+    job = await asyncio.to_thread(jobs.job_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get('/ready')
+async def ready():
+    # 503 until calls can be taken, for load balancers and the startup benchmark
+    status = {"sms": "sms" in ready_seconds, "voice": voice_ready.is_set(),
+              "seconds": {k: v for k, v in ready_seconds.items() if k != "error"},
+              "error": ready_seconds.get("error")}
+    return Response(content=json.dumps(status), media_type="application/json",
+                    status_code=200 if voice_ready.is_set() else 503)
+
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
+    try:
+        await asyncio.wait_for(startup_finished.wait(), VOICE_READY_TIMEOUT)
+    except asyncio.TimeoutError:
+        pass
+    if not voice_ready.is_set():
+        # Still loading, or startup failed (see /ready)
+        await websocket.close(code=1013 if "error" not in ready_seconds else 1011)
+        return
+    from bot import run_bot
+
     await websocket.accept()
     start_data = websocket.iter_text()
     await start_data.__anext__()
@@ -99,4 +274,4 @@ async def websocket_endpoint(websocket: WebSocket):
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8765)
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", "8765")))
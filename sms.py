@@ -0,0 +1,222 @@
+import asyncio
+import json
+import time
+import uuid
+from functools import partial
+
+from loguru import logger
+
+import clients
+import jobs
+import journal
+from intent_router import SIDE_EFFECT_INTENTS, intent_router
+from sms_sender import StreamSplitter, sms_sender
+from tools import executor
+from tools.executor import run_tool_calls
+from tools.quick_research import quick_research
+from tools.search_extract import format_sources
+from tools.specs import get_tools
+from tools.web_search import search_bing
+
+# The SMS side of the assistant: tool routing for /sms and the queued
+# "sms_tools" jobs. Nothing here imports pipecat, so the web server can answer
+# texts before the voice stack (bot.py) has loaded.
+
+
+def toggle_wifi():
+    # Selenium and webdriver_manager load on the first toggle, in the tool thread
+    from tools.wifi_controller import toggle_wifi
+    return toggle_wifi()
+
+
+SUMMARY_PROMPT = {"role": "system", "content": "Summarize the tool results in a concise and informative way. Don't use markdown formatting because it will be sent as a text message."}
+
+
+async def run_tools(tool_calls, skip_side_effects=False):
+    # (tool messages, sources footer). skip_side_effects stands in a note
+    # for tools like toggle_wifi that an earlier attempt may already have run.
+    available_functions = {
+        "search_bing": partial(search_bing, with_sources=True),
+        "quick_research": partial(quick_research, with_sources=True),
+        "toggle_wifi": toggle_wifi
+    }
+    if skip_side_effects:
+        for name in SIDE_EFFECT_INTENTS:
+            available_functions[name] = lambda **_: "An earlier attempt may already have done this, it was not repeated."
+
+    # Independent tool calls run concurrently; results keep the call order
+    messages, sources = [], []
+    for tool_call, function_response in await run_tool_calls(tool_calls, available_functions):
+        if isinstance(function_response, tuple):
+            function_response, tool_sources = function_response
+            sources.extend(tool_sources)
+        messages.append({"role": "tool", "content": function_response, "tool_call_id": tool_call["id"], "name": tool_call["function"]["name"]})
+    return messages, format_sources(sources) if sources else ""
+
+
+async def handle_tools(payload):
+    # Runs as an "sms_tools" job, see jobs.py. Errors propagate so the job is
+    # retried; the caller is only told once every attempt failed. The tool
+    # results are saved on the job before the summary, so a retry only
+    # summarizes again and never toggles the wifi a second time.
+    if "tool_messages" not in payload:
+        started = payload.get("tools_started", False)
+        if not started and any(call["function"]["name"] in SIDE_EFFECT_INTENTS for call in payload["tool_calls"]):
+            payload["tools_started"] = True
+            await jobs.checkpoint(payload)
+        payload["tool_messages"], payload["footer"] = await run_tools(payload["tool_calls"], skip_side_effects=started)
+        await jobs.checkpoint(payload)
+
+    messages = payload["messages"] + payload["tool_messages"] + [SUMMARY_PROMPT]
+    return await stream_summary(messages, payload["footer"], payload["from_"], payload["to_"])
+
+
+async def stream_summary(messages, footer, from_, to_):
+    # Texts the summary while it is generated: each message goes out as soon
+    # as its sentences are complete, so the first one arrives about one
+    # time-to-first-token after the request. Messages keep their order
+    # through the sender's per-recipient queue.
+    started = time.perf_counter()
+    splitter = StreamSplitter(footer=footer)
+    queued = []  # futures of every message handed to the sender
+    first_part = None
+    summary = ""
+
+    def send(parts):
+        nonlocal first_part
+        for part in parts:
+            queued.extend(sms_sender.enqueue(to=from_, from_=to_, body=part))
+        if parts and first_part is None:
+            first_part = time.perf_counter() - started
+
+    stream = await clients.groq_chat(
+        messages=messages,
+        model="mixtral-8x7b-32768",
+        max_tokens=4096,
+        stream=True
+    )
+    try:
+        async for chunk in stream:
+            text = chunk.choices[0].delta.content if chunk.choices else None
+            if not text:
+                continue
+            summary += text
+            send(splitter.feed(text))
+            if splitter.truncated:
+                # Out of segments; stop paying for tokens nobody will read
+                break
+    except Exception as e:
+        if not queued:
+            # Nothing reached the user yet, let the job retry. The tool
+            # results are saved on the job (see handle_tools), so the retry
+            # only asks for the summary again.
+            raise
+        logger.error(f"Summary stream failed after {splitter.parts} messages: {e}")
+    finally:
+        await stream.close()
+
+    send(splitter.finish())
+    results = await asyncio.gather(*queued, return_exceptions=True)
+    errors = [result for result in results if isinstance(result, Exception)]
+    if errors and len(errors) == len(results):
+        # Not one message went out, let the job retry
+        raise errors[0]
+    for error in errors:
+        # Retrying would text the messages that did arrive a second time
+        logger.error(f"Summary message failed to send: {error}")
+    journal.record("sms_reply", messages=len(queued), failed=len(errors), truncated=splitter.truncated,
+                   first_message=round(first_part, 3) if first_part is not None else None,
+                   seconds=round(time.perf_counter() - started, 3))
+    return summary
+
+
+async def sms_tools_failed(payload, error):
+    await sms_sender.send(to=payload["from_"], from_=payload["to_"], body=f"An error occurred {error}")
+
+
+jobs.register("sms_tools", handle_tools, on_failure=sms_tools_failed)
+
+
+async def queue_tools(messages, tool_calls, from_, to_):
+    return await jobs.submit("sms_tools", {"messages": messages, "tool_calls": tool_calls, "from_": from_, "to_": to_})
+
+
+async def job_worker_startup():
+    # Hooks for `python jobs.py worker`, which runs handle_tools out of process
+    await clients.startup()
+    journal.journal.start()
+
+
+async def job_worker_shutdown():
+    await sms_sender.flush()
+    executor.shutdown()
+    await clients.shutdown()
+    await journal.journal.stop()
+
+
+EMPTY_REPLY = "Sorry, I don't have an answer for that. Could you rephrase?"
+
+
+async def choose_tools(message):
+    messages = [
+        {
+            "role": "system",
+            "content": "you are an assistant responding to a SMS message. Use the tools if the user asks for them. ",
+        },
+        {
+            "role": "user",
+            "content": message
+        }
+    ]
+    
+    
+    # Obvious requests go straight to the tool without the LLM round trip
+    routed = intent_router.route(message)
+    if routed:
+        tool_calls = [{
+            "id": f"call_local_{uuid.uuid4().hex[:12]}",
+            "type": "function",
+            "function": {"name": routed["name"], "arguments": json.dumps(routed["arguments"])},
+        }]
+        messages.append({"role": "assistant", "tool_calls": tool_calls})
+        return messages, tool_calls
+
+    tool_choice = "auto"
+    
+    if message.lower() == 'wifi':
+        tool_choice = {"type": "function", "function": {"name": "toggle_wifi"}}
+
+    # sound effects only make sense on a call
+    tools = [tool for tool in get_tools() if tool["function"]["name"] != "play_sound_effect"]
+    response = await clients.groq_chat(
+        messages=messages,
+        model="llama3-groq-70b-8192-tool-use-preview",
+        tools=tools,
+        tool_choice=tool_choice,
+        max_tokens=4096
+    )
+
+    response_message = response.choices[0].message
+    tool_calls = response_message.tool_calls
+
+    if tool_calls:
+        # Plain dicts so the conversation can be stored with the job
+        messages.append(response_message.model_dump(exclude_none=True))
+        return messages, [tool_call.model_dump() for tool_call in tool_calls]
+
+    # A reply with neither text nor tool calls would be an empty SMS, which Twilio rejects
+    return (response_message.content or "").strip() or EMPTY_REPLY, None
+
+
+async def finish_sms(routing, from_, to_):
+    # Picks up an SMS whose tool routing ran past the webhook budget and
+    # texts the result back once it is ready
+    try:
+        messages, tool_calls = await routing
+        if tool_calls:
+            await queue_tools(messages, tool_calls, from_, to_)
+        else:
+            await sms_sender.send(to=from_, from_=to_, body=messages)
+    except Exception as e:
+        logger.error(f"Error: {e}")
+        await sms_sender.send(to=from_, from_=to_, body=f"An error occurred {e}")
@@ -0,0 +1,292 @@
+import asyncio
+import os
+import re
+import time
+
+import aiohttp
+from loguru import logger
+
+import clients
+import metrics
+
+# Outbound SMS straight against the Twilio Messages API on the shared aiohttp
+# session. Long bodies are split on segment boundaries, each recipient gets
+# its own FIFO with a rate cap, and transient failures are retried.
+#
+# TWILIO_API_URL points it at a stub, see benchmarks/stubs.py.
+
+TWILIO_API_URL = os.getenv("TWILIO_API_URL", "https://api.twilio.com")
+# Segments per outgoing message; longer replies go out as numbered parts
+SMS_MAX_SEGMENTS = int(os.getenv("SMS_MAX_SEGMENTS", "3"))
+# Minimum seconds between messages to one recipient
+SMS_RECIPIENT_INTERVAL = float(os.getenv("SMS_RECIPIENT_INTERVAL", "1"))
+SMS_MAX_ATTEMPTS = int(os.getenv("SMS_MAX_ATTEMPTS", "4"))
+SMS_CONCURRENCY = int(os.getenv("SMS_CONCURRENCY", "10"))
+SMS_TIMEOUT = 10
+# Streamed replies (see StreamSplitter): the first message goes out at the
+# first sentence end past this many characters
+SMS_FIRST_PART_CHARS = int(os.getenv("SMS_FIRST_PART_CHARS", "40"))
+# Segments one streamed reply may use across all of its messages
+SMS_REPLY_MAX_SEGMENTS = int(os.getenv("SMS_REPLY_MAX_SEGMENTS", "9"))
+
+GSM7 = set(
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà")
+# Escaped characters take two septets
+GSM7_EXTENDED = set("^{}\\[~]|€\f")
+
+
+class SmsError(Exception):
+    pass
+
+
+def is_gsm7(text):
+    return all(c in GSM7 or c in GSM7_EXTENDED for c in text)
+
+
+def segment_length(text):
+    # Septets for GSM-7, UTF-16 code units for UCS-2
+    if is_gsm7(text):
+        return sum(2 if c in GSM7_EXTENDED else 1 for c in text)
+    return len(text.encode("utf-16-le")) // 2
+
+
+def segment_count(text):
+    gsm = is_gsm7(text)
+    single, multi = (160, 153) if gsm else (70, 67)
+    length = segment_length(text)
+    return 1 if length <= single else -(-length // multi)
+
+
+def split_message(text, max_segments=SMS_MAX_SEGMENTS):
+    # Splits on word boundaries so every part fits in max_segments. Parts
+    # are numbered "(1/3)" when there is more than one.
+    text = text.strip()
+    if segment_count(text) <= max_segments:
+        return [text]
+    multi = 153 if is_gsm7(text) else 67
+    budget = multi * max_segments - len(" (10/10)")
+
+    parts, current = [], ""
+    for piece in re.findall(r"\S+\s*", text):
+        if segment_length(current + piece.rstrip()) <= budget:
+            current += piece
+            continue
+        if current:
+            parts.append(current.rstrip())
+        # A single word longer than the budget gets cut
+        while segment_length(piece.rstrip()) > budget:
+            parts.append(piece[:budget])
+            piece = piece[budget:]
+        current = piece
+    if current.strip():
+        parts.append(current.rstrip())
+    if len(parts) == 1:
+        return parts
+    return [f"{part} ({i}/{len(parts)})" for i, part in enumerate(parts, 1)]
+
+
+SENTENCE_END = re.compile(r"[.!?]+[\"')]*\s+|\n+")
+
+
+def _truncate(text, budget):
+    # The longest prefix of whole words, plus an ellipsis, within budget segments
+    words = text.split()
+    while words and segment_count(" ".join(words) + "...") > budget:
+        words.pop()
+    return " ".join(words) + "..." if words else ""
+
+
+class StreamSplitter:
+    # Cuts a streamed reply into messages at sentence ends. The first message
+    # goes out as soon as it holds a sentence, later ones fill up to
+    # max_segments each, and the whole reply (footer included) stays within
+    # total_segments. Once that is spent `truncated` is set and the rest of
+    # the stream can be dropped.
+
+    def __init__(self, footer="", max_segments=SMS_MAX_SEGMENTS, total_segments=SMS_REPLY_MAX_SEGMENTS,
+                 first_chars=SMS_FIRST_PART_CHARS):
+        self.footer = footer
+        self.max_segments = max_segments
+        self.budget = total_segments - (segment_count(footer) if footer else 0)
+        self.first_chars = first_chars
+        self.parts = 0
+        self.truncated = False
+        self._tail = ""  # text after the last sentence end
+        self._sentences = []  # complete sentences not sent yet
+
+    def feed(self, text):
+        # Returns the messages that are ready to send
+        if self.truncated:
+            return []
+        self._tail += text
+        start = 0
+        for match in SENTENCE_END.finditer(self._tail):
+            self._sentences.append(self._tail[start:match.end()])
+            start = match.end()
+        self._tail = self._tail[start:]
+
+        ready = []
+        while self._sentences and not self.truncated:
+            if self.parts == 0 and not ready:
+                if len("".join(self._sentences).strip()) < self.first_chars:
+                    break
+                count = len(self._sentences)
+            else:
+                count = self._fitting()
+                if count == len(self._sentences):
+                    # Might still take more sentences, wait for them
+                    break
+            ready.extend(self._emit(count))
+        return ready
+
+    def finish(self):
+        # The rest of the reply once the stream ended, footer included
+        if not self.truncated:
+            self._sentences.append(self._tail)
+        self._tail = ""
+        parts = []
+        while not self.truncated and "".join(self._sentences).strip():
+            parts.extend(self._emit(self._fitting()))
+        if self.footer:
+            if parts and segment_count(f"{parts[-1]}\n{self.footer}") <= self.max_segments:
+                parts[-1] = f"{parts[-1]}\n{self.footer}"
+            else:
+                parts.append(self.footer)
+        return parts
+
+    def _fitting(self):
+        # How many of the leading sentences fit in one message (at least one)
+        for count in range(1, len(self._sentences) + 1):
+            if segment_count("".join(self._sentences[:count]).strip()) > self.max_segments:
+                return max(1, count - 1)
+        return len(self._sentences)
+
+    def _emit(self, count):
+        text = "".join(self._sentences[:count]).strip()
+        del self._sentences[:count]
+        if not text:
+            return []
+        parts = []
+        for part in split_message(text, self.max_segments):
+            if segment_count(part) > self.budget:
+                part = _truncate(part, self.budget)
+                self.truncated = True
+            if part:
+                self.budget -= segment_count(part)
+                self.parts += 1
+                parts.append(part)
+            if self.truncated:
+                break
+        return parts
+
+
+class SmsSender:
+    def __init__(self, account_sid=None, auth_token=None, base_url=TWILIO_API_URL):
+        self.account_sid = account_sid or os.getenv("TWILIO_ACCOUNT_SID")
+        self.auth_token = auth_token or os.getenv("TWILIO_AUTH_TOKEN")
+        self.base_url = base_url.rstrip("/")
+        self._queues = {}  # recipient -> asyncio.Queue of (from_, body, future)
+        self._workers = {}  # recipient -> task
+        self._last_sent = {}  # recipient -> monotonic time
+        self._slots = None
+        self.counters = {"messages": 0, "segments": 0, "retries": 0, "failed": 0}
+
+    def _url(self):
+        return f"{self.base_url}/2010-04-01/Accounts/{self.account_sid}/Messages.json"
+
+    async def send(self, to, from_, body):
+        # Queues the body (split if needed) and waits until every part is
+        # accepted by Twilio. Messages to one recipient go out in order.
+        return await asyncio.gather(*self.enqueue(to, from_, body))
+
+    def enqueue(self, to, from_, body):
+        # Like send() without waiting; returns a future per message part
+        loop = asyncio.get_running_loop()
+        queue = self._queues.setdefault(to, asyncio.Queue())
+        futures = []
+        for part in split_message(body):
+            future = loop.create_future()
+            queue.put_nowait((from_, part, future))
+            futures.append(future)
+        if to not in self._workers:
+            self._workers[to] = asyncio.create_task(self._drain(to))
+        return futures
+
+    async def _drain(self, to):
+        # One worker per recipient with queued messages, exits when idle
+        queue = self._queues[to]
+        try:
+            while not queue.empty():
+                from_, body, future = queue.get_nowait()
+                wait = self._last_sent.get(to, 0) + SMS_RECIPIENT_INTERVAL - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                try:
+                    result = await self._post(to, from_, body)
+                except Exception as e:
+                    self.counters["failed"] += 1
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+                finally:
+                    self._last_sent[to] = time.monotonic()
+        finally:
+            self._workers.pop(to, None)
+            if queue.empty():
+                self._queues.pop(to, None)
+
+    async def _post(self, to, from_, body):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(SMS_CONCURRENCY)
+        data = {"To": to, "From": from_, "Body": body}
+        auth = aiohttp.BasicAuth(self.account_sid or "", self.auth_token or "")
+        for attempt in range(1, SMS_MAX_ATTEMPTS + 1):
+            retry_after = None
+            try:
+                async with self._slots:
+                    async with clients.http_session().post(self._url(), data=data, auth=auth,
+                                                           timeout=aiohttp.ClientTimeout(total=SMS_TIMEOUT)) as response:
+                        if response.status < 300:
+                            # Delivered; from here on nothing may send it again
+                            self.counters["messages"] += 1
+                            self.counters["segments"] += segment_count(body)
+                            metrics.sms_sent.inc()
+                            return await self._read_sid(response)
+                        text = await response.text()
+                        # 429 and 5xx are worth another try, other 4xx are not
+                        if response.status != 429 and response.status < 500:
+                            raise SmsError(f"Twilio rejected the message ({response.status}): {text}")
+                        retry_after = response.headers.get("Retry-After")
+                        error = SmsError(f"Twilio returned {response.status}: {text}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+            if attempt == SMS_MAX_ATTEMPTS:
+                raise error
+            self.counters["retries"] += 1
+            delay = float(retry_after) if retry_after and retry_after.isdigit() else 2 ** (attempt - 1)
+            logger.warning(f"Sending SMS to {to} failed ({error}), retrying in {delay}s")
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    async def _read_sid(response):
+        try:
+            payload = await response.json(content_type=None)
+            return payload.get("sid") if isinstance(payload, dict) else None
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            logger.warning(f"Twilio accepted the message but its response was unreadable: {e}")
+            return None
+
+    def stats(self):
+        return dict(self.counters, queued=sum(q.qsize() for q in self._queues.values()),
+                    recipients=len(self._workers))
+
+    async def flush(self, timeout=10):
+        # Gives queued messages a chance to go out on shutdown
+        if self._workers:
+            await asyncio.wait(list(self._workers.values()), timeout=timeout)
+
+
+sms_sender = SmsSender()
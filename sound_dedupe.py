@@ -0,0 +1,233 @@
+import hashlib
+import json
+import math
+import os
+from itertools import combinations
+
+from sound_library import AUDIO_EXTENSIONS, LIBRARY_DIR, sound_library, normalize_name
+
+# Exact content hashes plus a cheap loudness-envelope fingerprint over the
+# sound_effects/ folder, so we stop paying for and loading the same clip twice.
+
+DEDUPE_PATH = os.path.join(LIBRARY_DIR, "dedupe.json")
+ENVELOPE_BINS = 32
+NEAR_DUPLICATE_SIMILARITY = 0.97
+NEAR_DUPLICATE_DURATION = 0.1  # relative difference
+CROSSING_WEIGHT = 4.0
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _ulaw_table():
+    # G.711 mu-law byte -> 16-bit sample, the same values audioop.ulaw2lin
+    # gave (audioop is gone in Python 3.13)
+    table = []
+    for byte in range(256):
+        u = ~byte & 0xFF
+        magnitude = (((u & 0x0F) << 3) + 0x84) << ((u & 0x70) >> 4)
+        table.append(0x84 - magnitude if u & 0x80 else magnitude - 0x84)
+    return table
+
+
+ULAW_TO_LINEAR = _ulaw_table()
+
+
+def _rms(samples):
+    return int(math.sqrt(sum(v * v for v in samples) / len(samples))) if samples else 0
+
+
+def _crossings(samples):
+    # Sign changes, counted the way audioop.cross did so fingerprints in an
+    # existing dedupe.json stay comparable
+    signs = [v < 0 for v in samples]
+    return sum(a != b for a, b in zip(signs, signs[1:]))
+
+
+def fingerprint(ulaw):
+    # Per slice: RMS loudness (normalized to unit length over the clip) and
+    # zero-crossing rate as a rough stand-in for brightness. Loudness alone
+    # can't tell steady noises like wind and rain apart.
+    samples = [ULAW_TO_LINEAR[b] for b in ulaw]
+    step = max(1, len(samples) // ENVELOPE_BINS)
+    slices = [samples[i:i + step] for i in range(0, step * ENVELOPE_BINS, step)]
+    envelope = [_rms(s) for s in slices]
+    norm = math.sqrt(sum(v * v for v in envelope)) or 1.0
+    crossings = [_crossings(s) / len(s) if s else 0.0 for s in slices]
+    return {
+        "envelope": [round(v / norm, 4) for v in envelope],
+        "crossings": [round(v, 4) for v in crossings],
+    }
+
+
+def similarity(a, b):
+    # 1.0 for identical fingerprints; the crossing-rate distance is a penalty
+    envelope = sum(x * y for x, y in zip(a["envelope"], b["envelope"]))
+    crossings = sum(abs(x - y) for x, y in zip(a["crossings"], b["crossings"])) / ENVELOPE_BINS
+    return envelope - CROSSING_WEIGHT * crossings
+
+
+def prompt_text(description):
+    return normalize_name(description or "")
+
+
+def _library_files(directory):
+    # filename -> (mtime, size), what DedupeIndex.build records for each clip
+    files = {}
+    for filename in os.listdir(directory):
+        if filename.lower().endswith(AUDIO_EXTENSIONS):
+            stat = os.stat(os.path.join(directory, filename))
+            files[filename] = (stat.st_mtime, stat.st_size)
+    return files
+
+
+class DedupeIndex:
+    def __init__(self):
+        self.files = {}  # filename -> {mtime, size, sha256, duration, fingerprint}
+
+    def load(self):
+        try:
+            with open(DEDUPE_PATH) as f:
+                self.files = json.load(f)
+        except (OSError, ValueError):
+            self.files = {}
+
+    def save(self):
+        os.makedirs(LIBRARY_DIR, exist_ok=True)
+        with open(DEDUPE_PATH + ".part", "w") as f:
+            json.dump(self.files, f)
+        os.replace(DEDUPE_PATH + ".part", DEDUPE_PATH)
+
+    def build(self):
+        # Only files that changed since the last run are hashed again
+        self.load()
+        sound_library.load()
+        files = {}
+        for filename, clip in sound_library.clips.items():
+            old = self.files.get(filename)
+            if old and old.get("mtime") == clip["mtime"] and old.get("size") == clip["size"] and "fingerprint" in old:
+                files[filename] = old
+                continue
+            files[filename] = {
+                "mtime": clip["mtime"],
+                "size": clip["size"],
+                "sha256": file_hash(os.path.join(sound_library.directory, filename)),
+                "duration": clip["duration"],
+                "description": clip["description"],
+                "fingerprint": fingerprint(b"".join(sound_library.audio(clip))),
+            }
+        self.files = files
+        self.save()
+
+    def is_stale(self):
+        # True when clips were added, changed or removed since the last build
+        try:
+            files = _library_files(sound_library.directory)
+        except OSError:
+            return False
+        return files != {f: (e.get("mtime"), e.get("size")) for f, e in self.files.items()}
+
+    def ensure(self):
+        # Loads the index, building it first when it is missing or stale
+        self.load()
+        if not self.files or self.is_stale():
+            self.build()
+
+    def exact_duplicates(self):
+        groups = {}
+        for filename, entry in self.files.items():
+            groups.setdefault(entry["sha256"], []).append(filename)
+        return [sorted(group) for group in groups.values() if len(group) > 1]
+
+    def near_duplicates(self):
+        # Pairs with the same length and loudness envelope but different bytes
+        pairs = []
+        fingerprinted = [(f, e) for f, e in sorted(self.files.items()) if "fingerprint" in e]
+        for (a, ea), (b, eb) in combinations(fingerprinted, 2):
+            if ea["sha256"] == eb["sha256"]:
+                continue
+            longest = max(ea["duration"], eb["duration"]) or 1.0
+            if abs(ea["duration"] - eb["duration"]) / longest > NEAR_DUPLICATE_DURATION:
+                continue
+            score = similarity(ea["fingerprint"], eb["fingerprint"])
+            if score >= NEAR_DUPLICATE_SIMILARITY:
+                pairs.append((a, b, score))
+        return pairs
+
+    def same_prompt(self):
+        # Takes rendered from one name or description: "Wind Chime" three
+        # times over. Not duplicates as such (find() picks a random take),
+        # but every extra take was paid for and sits in the blob.
+        groups = {}
+        for filename, entry in self.files.items():
+            text = prompt_text(entry.get("description"))
+            if text:
+                groups.setdefault(text, []).append(filename)
+        exact = {frozenset(group) for group in self.exact_duplicates()}
+        return [sorted(group) for group in groups.values() if len(group) > 1 and frozenset(group) not in exact]
+
+    def remember(self, filename, sha256, description):
+        # Clips generated since the last build, until the next build fingerprints them
+        self.files[filename] = {"sha256": sha256, "description": description}
+
+    def find_hash(self, sha256):
+        for filename, entry in self.files.items():
+            if entry["sha256"] == sha256:
+                return filename
+        return None
+
+    def find_prompt(self, description):
+        # A clip already rendered from the same description
+        text = prompt_text(description)
+        for filename, entry in self.files.items():
+            if text and prompt_text(entry.get("description")) == text:
+                return filename
+        return None
+
+    def report(self):
+        reclaimable = 0
+        print("Exact duplicates:")
+        for group in self.exact_duplicates():
+            size = self.files[group[0]].get("size", 0)
+            reclaimable += size * (len(group) - 1)
+            print(f"  {', '.join(group)} ({size / 1e3:.0f} kB each)")
+
+        print("Near duplicates:")
+        near = self.near_duplicates()
+        for a, b, score in near:
+            print(f"  {a} ~ {b} (similarity {score:.3f})")
+
+        # Count each near-duplicate cluster once, keeping its largest file
+        clusters = []
+        for a, b, _ in near:
+            merged = [c for c in clusters if a in c or b in c]
+            cluster = set().union({a, b}, *merged)
+            clusters = [c for c in clusters if c not in merged] + [cluster]
+        for cluster in clusters:
+            sizes = sorted(self.files[f]["size"] for f in cluster)
+            reclaimable += sum(sizes[:-1])
+
+        print("Same prompt:")
+        extra_takes = 0
+        for group in self.same_prompt():
+            sizes = sorted(self.files[f].get("size", 0) for f in group)
+            extra_takes += sum(sizes[:-1])
+            print(f"  {len(group)}x {self.files[group[0]].get('description')!r}: {', '.join(group)}")
+
+        total = sum(entry.get("size", 0) for entry in self.files.values())
+        print(f"{len(self.files)} clips, {total / 1e6:.1f} MB, {reclaimable / 1e6:.1f} MB reclaimable, "
+              f"{extra_takes / 1e6:.1f} MB more in extra takes of the same prompt")
+        return reclaimable
+
+
+dedupe_index = DedupeIndex()
+
+
+if __name__ == "__main__":
+    dedupe_index.build()
+    dedupe_index.report()
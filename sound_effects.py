@@ -1,11 +1,18 @@
 from datetime import datetime
 
+import aiohttp
+import asyncio
+import hashlib
 import requests
 import json
 import os
+import random
 from dotenv import load_dotenv
 import math
 
+from sound_dedupe import dedupe_index, file_hash
+from sound_library import sound_library
+
 # Load environment variables from .env file
 load_dotenv(override=True)
 
@@ -29,6 +36,12 @@ elevenlabs_headers = {
     "Content-Type": "application/json"
 }
 
+# Batch generation settings
+MAX_CONCURRENCY = int(os.getenv("SOUND_GENERATION_CONCURRENCY", "4"))
+MAX_ATTEMPTS = 5
+CHUNK_SIZE = 64 * 1024
+MANIFEST_NAME = "manifest.json"
+
 
 # Generate sound effect prompts using Together AI
 def generate_prompts(model, scenario, n=10):
@@ -92,31 +105,153 @@ Don't say "Here is the list of sound effects" or anything like that. Just start
     return prompts
 
 
-# Generate sound effects using ElevenLabs
-def generate_sound_effects(prompts, output_folder="sound_effects"):
+def prompt_key(prompt):
+    # Identifies a prompt across runs so finished clips are never paid for twice
+    text = "|".join([prompt["name"].strip().lower(), prompt["description"].strip().lower(), str(prompt["duration"])])
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def load_manifest(output_folder):
+    try:
+        with open(os.path.join(output_folder, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"clips": {}}
+
+
+def save_manifest(output_folder, manifest):
+    path = os.path.join(output_folder, MANIFEST_NAME)
+    with open(path + ".part", "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + ".part", path)
+
+
+def retry_delay(attempt, response=None):
+    # Honour Retry-After on rate limits, otherwise exponential backoff with jitter
+    if response is not None and response.headers.get("Retry-After"):
+        try:
+            return float(response.headers["Retry-After"])
+        except ValueError:
+            pass
+    return min(30.0, 2 ** attempt) * (0.5 + random.random() / 2)
+
+
+async def generate_sound_effect(session, semaphore, prompt, output_folder, manifest, url=elevenlabs_url,
+                                index=None):
+    # index is the dedupe index of the library output_folder belongs to, if any
+    key = prompt_key(prompt)
+    entry = manifest["clips"].get(key)
+    if entry and entry.get("status") == "done" and os.path.exists(os.path.join(output_folder, entry["file"])):
+        print(f"Skipping {prompt['name']}, already generated as {entry['file']}")
+        return entry
+    if entry and entry.get("status") == "duplicate":
+        return entry
+
+    # Same description already rendered somewhere in the library
+    existing = index.find_prompt(prompt["description"]) if index else None
+    if existing:
+        print(f"Skipping {prompt['name']}, same prompt as {existing}")
+        manifest["clips"][key] = {"name": prompt["name"], "description": prompt["description"].strip(),
+                                  "duration": prompt["duration"], "file": None, "status": "duplicate",
+                                  "duplicate_of": existing}
+        return manifest["clips"][key]
+
+    payload = {
+        "text": prompt["description"].strip(),
+        "duration_seconds": prompt["duration"],
+        "prompt_influence": 0.3
+    }
+    entry = manifest["clips"][key] = {
+        "name": prompt["name"],
+        "description": prompt["description"].strip(),
+        "duration": prompt["duration"],
+        "file": None,
+        "status": "pending",
+        "attempts": 0,
+    }
+
+    async with semaphore:
+        for attempt in range(MAX_ATTEMPTS):
+            entry["attempts"] = attempt + 1
+            try:
+                async with session.post(url, headers=elevenlabs_headers, json=payload) as response:
+                    if response.status == 429 or response.status >= 500:
+                        entry["error"] = f"{response.status}: {await response.text()}"
+                        await asyncio.sleep(retry_delay(attempt, response))
+                        continue
+                    if response.status != 200:
+                        # Bad prompt or key, retrying won't help
+                        entry["error"] = f"{response.status}: {await response.text()}"
+                        break
+
+                    current_date_time = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+                    # The key suffix keeps concurrent takes of one name from colliding
+                    filename = f"{prompt['name']}_{current_date_time}_{key[:6]}.wav"
+                    path = os.path.join(output_folder, filename)
+                    # Stream to a partial file so an interrupted run never leaves a truncated clip
+                    with open(path + ".part", "wb") as sound_file:
+                        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                            sound_file.write(chunk)
+                    os.replace(path + ".part", path)
+
+                    # Byte-identical to a clip we already have, keep only one copy
+                    sha256 = file_hash(path)
+                    existing = index.find_hash(sha256) if index else None
+                    if existing:
+                        os.remove(path)
+                        entry.update({"status": "duplicate", "duplicate_of": existing})
+                        save_manifest(output_folder, manifest)
+                        print(f"Dropped {prompt['name']}, identical to {existing}")
+                        return entry
+
+                    if index:
+                        index.remember(filename, sha256, entry["description"])
+                    entry.update({"file": filename, "status": "done"})
+                    entry.pop("error", None)
+                    save_manifest(output_folder, manifest)
+                    print(f"Saved sound effect {prompt['name']} to {output_folder}")
+                    return entry
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                entry["error"] = str(e)
+                await asyncio.sleep(retry_delay(attempt))
+
+    entry["status"] = "failed"
+    save_manifest(output_folder, manifest)
+    print(f"Error generating sound effect {prompt['name']}: {entry.get('error')}")
+    return entry
+
+
+async def generate_sound_effects_async(prompts, output_folder="sound_effects", concurrency=MAX_CONCURRENCY,
+                                       url=elevenlabs_url):
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
-    for idx, prompt in enumerate(prompts):
-        print(prompt)
-
-        payload = {
-            "text": prompt["description"].strip(),
-            "duration_seconds": prompt["duration"],
-            "prompt_influence": 0.3
-        }
-
-        response = requests.post(elevenlabs_url, headers=elevenlabs_headers, json=payload)
-        if response.status_code == 200:
-            sound_data = response.content
-
-            filename = prompt["name"]
-            current_date_time = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-            with open(os.path.join(output_folder, f"{filename}_{current_date_time}.wav"), 'wb') as sound_file:
-                sound_file.write(sound_data)
-            print(f"Saved sound effect {filename} to {output_folder}")
-        else:
-            print(f"Error generating sound effect: {response.text}")
+    manifest = load_manifest(output_folder)
+    # The dedupe index covers the sound library only; a batch written
+    # anywhere else is generated without prompt and hash checks
+    index = None
+    if os.path.abspath(output_folder) == os.path.abspath(sound_library.directory):
+        # Prompt and hash checks need every clip on disk in the index
+        await asyncio.to_thread(dedupe_index.ensure)
+        index = dedupe_index
+    semaphore = asyncio.Semaphore(concurrency)
+    timeout = aiohttp.ClientTimeout(total=120, sock_read=60)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        entries = await asyncio.gather(*[
+            generate_sound_effect(session, semaphore, prompt, output_folder, manifest, url, index)
+            for prompt in prompts
+        ])
+
+    failed = [entry for entry in entries if entry["status"] == "failed"]
+    duplicates = [entry for entry in entries if entry["status"] == "duplicate"]
+    print(f"Generated {len(entries) - len(failed) - len(duplicates)}/{len(entries)} sound effects, "
+          f"{len(duplicates)} duplicates skipped, {len(failed)} failed")
+    return entries
+
+
+# Generate sound effects using ElevenLabs
+def generate_sound_effects(prompts, output_folder="sound_effects", concurrency=MAX_CONCURRENCY, url=elevenlabs_url):
+    return asyncio.run(generate_sound_effects_async(prompts, output_folder, concurrency, url))
 
 
 # Main function
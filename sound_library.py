@@ -0,0 +1,209 @@
+import difflib
+import hashlib
+import json
+import mmap
+import os
+import random
+import re
+import subprocess
+import threading
+import time
+
+from loguru import logger
+
+# The clips in sound_effects/ are 44.1 kHz stereo MP3s (whatever the extension
+# says). They are transcoded once into a single 8 kHz mu-law blob with an offset
+# table, so playing one in a call is just a slice of a memory map.
+
+SOUND_EFFECTS_DIR = os.getenv("SOUND_EFFECTS_DIR", "sound_effects")
+LIBRARY_DIR = os.path.join(SOUND_EFFECTS_DIR, ".library")
+INDEX_PATH = os.path.join(LIBRARY_DIR, "index.json")
+BLOB_PATH = os.path.join(LIBRARY_DIR, "clips.ulaw")
+MANIFEST_PATH = os.path.join(SOUND_EFFECTS_DIR, "manifest.json")
+
+FFMPEG = os.getenv("FFMPEG", "ffmpeg")
+AUDIO_EXTENSIONS = (".wav", ".mp3")
+SAMPLE_RATE = 8000
+
+
+def clip_name(filename):
+    # "Wind Chime_2024-07-22_10-13-32.wav" -> "Wind Chime", "-_Beep.wav" -> "Beep"
+    name = os.path.splitext(filename)[0]
+    name = re.sub(r"_\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}(_[0-9a-f]{6})?$", "", name)
+    return name.lstrip("-_ ").strip() or name
+
+
+def normalize_name(name):
+    return " ".join(re.sub(r"[^\w\s]", " ", name.lower()).split())
+
+
+def transcode(path):
+    result = subprocess.run(
+        [FFMPEG, "-v", "error", "-i", path, "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "mulaw", "pipe:1"],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    return result.stdout
+
+
+def _load_descriptions():
+    # sound_effects.generate_sound_effects records the prompt behind each file
+    try:
+        with open(MANIFEST_PATH) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return {entry["file"]: entry.get("description") for entry in manifest.get("clips", {}).values()
+            if entry.get("file")}
+
+
+class SoundLibrary:
+    def __init__(self, directory=SOUND_EFFECTS_DIR):
+        self.directory = directory
+        self.clips = {}  # filename -> index entry
+        self._by_name = {}  # normalized name -> [filename]
+        self._blob = None
+        self._dir_mtime = None
+        self._lock = threading.Lock()
+
+    def _scan(self):
+        files = {}
+        for filename in sorted(os.listdir(self.directory)):
+            if filename.lower().endswith(AUDIO_EXTENSIONS):
+                stat = os.stat(os.path.join(self.directory, filename))
+                files[filename] = (stat.st_mtime, stat.st_size)
+        return files
+
+    def _load_index(self):
+        try:
+            with open(INDEX_PATH) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _read_clip(self, entry):
+        return bytes(self._blob[entry["offset"]:entry["offset"] + entry["length"]])
+
+    def build(self):
+        # Incremental: clips whose file is unchanged are copied from the old
+        # blob, only new or modified files go through ffmpeg
+        with self._lock:
+            started = time.perf_counter()
+            self._dir_mtime = os.stat(self.directory).st_mtime
+            files = self._scan()
+            old_index = self._load_index()
+            if self._blob is None and old_index and os.path.exists(BLOB_PATH):
+                self._open_blob()
+
+            descriptions = _load_descriptions()
+            os.makedirs(LIBRARY_DIR, exist_ok=True)
+            index = {}
+            transcoded = 0
+            offset = 0
+            stored = {}  # audio hash -> offset, identical clips share one copy
+            tmp_path = BLOB_PATH + ".part"
+            with open(tmp_path, "wb") as blob:
+                for filename, (mtime, size) in files.items():
+                    old = old_index.get(filename)
+                    if old and self._blob is not None and old["mtime"] == mtime and old["size"] == size:
+                        audio = self._read_clip(old)
+                    else:
+                        try:
+                            audio = transcode(os.path.join(self.directory, filename))
+                        except (OSError, subprocess.CalledProcessError) as e:
+                            logger.warning(f"Skipping sound effect {filename}: {e}")
+                            continue
+                        transcoded += 1
+
+                    name = clip_name(filename)
+                    digest = hashlib.sha1(audio).hexdigest()
+                    if digest not in stored:
+                        stored[digest] = offset
+                        blob.write(audio)
+                        offset += len(audio)
+                    index[filename] = {
+                        "name": name,
+                        "description": descriptions.get(filename) or (old or {}).get("description") or name,
+                        "mtime": mtime,
+                        "size": size,
+                        "offset": stored[digest],
+                        "length": len(audio),
+                        "duration": round(len(audio) / SAMPLE_RATE, 2),
+                    }
+
+            os.replace(tmp_path, BLOB_PATH)
+            self._open_blob()
+            with open(INDEX_PATH + ".part", "w") as f:
+                json.dump(index, f, indent=1)
+            os.replace(INDEX_PATH + ".part", INDEX_PATH)
+            self._set_index(index)
+            logger.info(f"Sound library: {len(index)} clips, {offset / 1e6:.1f} MB, "
+                        f"{transcoded} transcoded in {time.perf_counter() - started:.1f}s")
+
+    def load(self):
+        # Use the on-disk index as is when it matches the folder, otherwise rebuild
+        index = self._load_index()
+        files = self._scan()
+        if index and os.path.exists(BLOB_PATH) and \
+                {f: (e["mtime"], e["size"]) for f, e in index.items()} == files:
+            with self._lock:
+                self._dir_mtime = os.stat(self.directory).st_mtime
+                self._open_blob()
+                self._set_index(index)
+        else:
+            self.build()
+
+    def refresh(self):
+        # Cheap check on the folder mtime, rebuilds only when files came or went
+        try:
+            if os.stat(self.directory).st_mtime != self._dir_mtime:
+                self.build()
+        except OSError as e:
+            logger.warning(f"Could not refresh sound library: {e}")
+
+    def _set_index(self, index):
+        self.clips = index
+        self._by_name = {}
+        for filename, entry in index.items():
+            self._by_name.setdefault(normalize_name(entry["name"]), []).append(filename)
+
+    def _open_blob(self):
+        # The previous map isn't closed explicitly: a clip that is still
+        # playing keeps it alive until it finishes
+        if os.path.getsize(BLOB_PATH) == 0:
+            self._blob = None
+            return
+        with open(BLOB_PATH, "rb") as f:
+            self._blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def names(self):
+        return sorted({entry["name"] for entry in self.clips.values()})
+
+    def find(self, name):
+        # Exact name, then the closest partial match or spelling; a random take
+        # if there are several recordings of the same effect
+        key = normalize_name(name)
+        match = key if key in self._by_name else None
+        if match is None:
+            partial = [n for n in self._by_name if key and (key in n or n in key)]
+            close = partial or difflib.get_close_matches(key, list(self._by_name), n=3, cutoff=0.6)
+            if close:
+                match = max(close, key=lambda n: difflib.SequenceMatcher(None, key, n).ratio())
+        if match is None:
+            return None
+        return self.clips[random.choice(self._by_name[match])]
+
+    def audio(self, entry, chunk_seconds=0.5):
+        # Yields mu-law chunks straight out of the memory map
+        blob = self._blob
+        chunk_size = int(SAMPLE_RATE * chunk_seconds)
+        end = entry["offset"] + entry["length"]
+        for start in range(entry["offset"], end, chunk_size):
+            yield blob[start:min(start + chunk_size, end)]
+
+
+sound_library = SoundLibrary()
+
+
+if __name__ == "__main__":
+    sound_library.build()
+    for filename, entry in sound_library.clips.items():
+        print(f"{entry['name']:<20} {entry['duration']:>6.2f}s  {filename}")
@@ -0,0 +1,71 @@
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from loguru import logger
+
+import journal
+import metrics
+
+# Blocking tools (Selenium, requests) run here so they never stall the event loop
+TOOL_WORKERS = int(os.getenv("TOOL_WORKERS", "8"))
+
+DEFAULT_TIMEOUT = float(os.getenv("TOOL_TIMEOUT", "20"))
+
+# Per-tool overrides, in seconds
+TOOL_TIMEOUTS = {
+    "search_bing": 10,
+    "quick_research": 10,
+    "toggle_wifi": 60,
+}
+
+_pool = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="tool")
+
+
+async def run_tool(function_name, function_to_call, function_args, timeout=None):
+    timeout = timeout or TOOL_TIMEOUTS.get(function_name, DEFAULT_TIMEOUT)
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        if asyncio.iscoroutinefunction(function_to_call):
+            call = function_to_call(**function_args)
+        else:
+            loop = asyncio.get_running_loop()
+            call = loop.run_in_executor(_pool, partial(function_to_call, **function_args))
+        # A worker thread can't be interrupted, but we stop waiting on it
+        return await asyncio.wait_for(call, timeout)
+    except asyncio.TimeoutError:
+        outcome = "timeout"
+        logger.warning(f"Tool {function_name} timed out after {timeout}s")
+        return f"{function_name} timed out"
+    except Exception as e:
+        outcome = "error"
+        logger.error(f"Tool {function_name} failed: {e}")
+        return f"{function_name} failed: {e}"
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.tool_seconds.observe(elapsed, tool=function_name, path="sms")
+        journal.record("tool", tool=function_name, path="sms", outcome=outcome, seconds=round(elapsed, 3))
+        logger.debug(f"Tool {function_name} took {elapsed:.2f}s")
+
+
+async def run_tool_calls(tool_calls, available_functions):
+    # tool_calls are OpenAI-style dicts. Runs every tool call at once and returns (tool_call, response) pairs in
+    # the order the calls were given. Unknown tools are skipped.
+    jobs = []
+    for tool_call in tool_calls:
+        function_name = tool_call["function"]["name"]
+        function_to_call = available_functions.get(function_name, None)
+        if function_to_call:
+            function_args = json.loads(tool_call["function"]["arguments"] or "{}")
+            jobs.append((tool_call, run_tool(function_name, function_to_call, function_args)))
+
+    responses = await asyncio.gather(*[job for _, job in jobs])
+    return [(tool_call, response) for (tool_call, _), response in zip(jobs, responses)]
+
+
+def shutdown():
+    _pool.shutdown(wait=False, cancel_futures=True)
@@ -1,41 +1,148 @@
-import requests
-from dotenv import load_dotenv
+import asyncio
 import os
+import sys
+
+import aiohttp
+from dotenv import load_dotenv
+
+import clients
+from tools.search_cache import search_cache
+from tools.search_extract import extract
 
 # Load environment variables from a .env file
 load_dotenv()
 
+# Researches a topic over SerpAPI: the topic is expanded into a few
+# sub-queries, all of them are fetched at once under one deadline, organic
+# results are merged and deduped by URL, and the digest is cut to a token
+# budget with the same extraction as the Bing search.
 
-
-# Replace 'your_api_key' with your actual SERP API key
 API_KEY = os.getenv('SERP_API_KEY')
 SEARCH_ENGINE = 'google'
-QUERY = 'Python programming'
 
 # Endpoint for the SERP API
-url = f'https://serpapi.com/search.json'
-
-# Parameters for the API request
-params = {
-    'engine': SEARCH_ENGINE,
-    'q': QUERY,
-    'api_key': API_KEY,
-}
-
-# Make the request to the SERP API
-response = requests.get(url, params=params)
-
-# Check if the request was successful
-if response.status_code == 200:
-    results = response.json()
-    # Print the results
-    print(results)
-    # Optionally, you can process the results further here
-    for result in results.get('organic_results', []):
-        print(f"Title: {result.get('title')}")
-        print(f"Link: {result.get('link')}")
-        print(f"Snippet: {result.get('snippet')}\n")
-else:
-    print(f"Error: {response.status_code}")
-    print(response.json())
+url = 'https://serpapi.com/search.json'
+
+# Total seconds for every sub-query; whatever hasn't answered by then is dropped
+RESEARCH_DEADLINE = float(os.getenv("RESEARCH_DEADLINE", "6"))
+# Rough tokens for the digest, more than a single search since it covers several angles
+RESEARCH_TOKEN_BUDGET = int(os.getenv("RESEARCH_TOKEN_BUDGET", "500"))
+# Organic results kept from each sub-query
+RESULTS_PER_QUERY = 5
+
+# How a topic is broken down, "{}" is the topic
+ANGLES = [
+    "{}",
+    "what is {}",
+    "{} latest news",
+    "{} pros and cons",
+    "{} explained",
+]
+
+
+def expand_queries(topic, limit=len(ANGLES)):
+    topic = " ".join(topic.split())
+    queries = []
+    for angle in ANGLES[:limit]:
+        query = angle.format(topic)
+        if query.lower() not in (q.lower() for q in queries):
+            queries.append(query)
+    return queries
+
+
+def _normalize_url(link):
+    return (link or '').split('#')[0].rstrip('/').replace('://www.', '://').lower()
+
+
+def merge_results(results):
+    # Interleaves the sub-queries' results by rank so every angle is
+    # represented near the top, keeping the first copy of each URL
+    merged, seen = [], set()
+    for rank in range(max((len(items) for items in results), default=0)):
+        for items in results:
+            if rank >= len(items):
+                continue
+            key = _normalize_url(items[rank]['url'])
+            if key in seen:
+                continue
+            seen.add(key)
+            merged.append(items[rank])
+    return merged
+
+
+async def quick_research(topic, deadline=RESEARCH_DEADLINE, with_sources=False):
+    # with_sources returns (text, sources) so SMS replies can cite them
+    queries = expand_queries(topic)
+    # The requests' own timeout is a little longer so the deadline below
+    # always wins and cancels them cleanly
+    tasks = [asyncio.create_task(_search(query, deadline + 1)) for query in queries]
+    try:
+        done, pending = await asyncio.wait(tasks, timeout=deadline)
+    finally:
+        # Also when the caller hangs up or interrupts while we wait
+        for task in tasks:
+            task.cancel()
+    if pending:
+        print(f"Dropped {len(pending)} of {len(tasks)} research queries, deadline passed")
+
+    results = []
+    for task in tasks:
+        if task not in done:
+            continue
+        if task.exception():
+            print(f"Research query failed: {task.exception()}")
+            continue
+        results.append(task.result())
+
+    items = merge_results(results)
+    if not items:
+        return ("Research failed", []) if with_sources else "Research failed"
+    text, sources = extract(topic, items, budget=RESEARCH_TOKEN_BUDGET)
+    return (text, sources) if with_sources else text
+
+
+async def _search(query, timeout):
+    # Shares the search cache, so repeated research is answered locally
+    key = search_cache.key(query, SEARCH_ENGINE, "serpapi")
+    return await search_cache.get_or_fetch(key, lambda: _fetch_search(query, timeout))
+
+
+async def _fetch_search(query, timeout):
+    # Parameters for the API request
+    params = {
+        'engine': SEARCH_ENGINE,
+        'q': query,
+        'api_key': API_KEY or '',
+        'num': RESULTS_PER_QUERY,
+    }
+    async with clients.http_session().get(url, params=params,
+                                          timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+        response.raise_for_status()
+        return handle_organic_results(await response.json())
+
+
+def handle_organic_results(response):
+    results = []
+    for result in response.get('organic_results', [])[:RESULTS_PER_QUERY]:
+        if not result.get('link') or not result.get('snippet'):
+            continue
+        results.append({
+            'type': 'web',
+            'url': result['link'],
+            'title': result.get('title'),
+            'author': result.get('source') or result.get('displayed_link'),
+            'desc': result['snippet'],
+            'published': result.get('date'),
+        })
+    return results
+
+
+async def main():
+    topic = " ".join(sys.argv[1:]) or "Python programming"
+
+    print(await quick_research(topic))
+    await clients.shutdown()
+
 
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,112 @@
+import asyncio
+import os
+import re
+import time
+from collections import OrderedDict
+
+from datatypes import BingResponseType
+
+# How long a result stays fresh, per Bing vertical (seconds)
+DEFAULT_TTLS = {
+    BingResponseType.NEWS: 5 * 60,
+    BingResponseType.SEARCH_RESPONSE: 15 * 60,
+    BingResponseType.IMAGE: 60 * 60,
+    BingResponseType.VIDEO: 60 * 60,
+}
+
+MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_SIZE", "512"))
+
+
+def normalize_query(query):
+    # "  Weather   Today? " and "weather today" should share an entry
+    query = re.sub(r"[^\w\s]", " ", query.lower())
+    return " ".join(query.split())
+
+
+class SearchCache:
+    def __init__(self, max_entries=MAX_ENTRIES, ttls=None):
+        self.max_entries = max_entries
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._in_flight = {}  # key -> [Task, number of waiters]
+        self.counters = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "expired": 0}
+
+    def key(self, query, market, vertical):
+        return (vertical, market, normalize_query(query))
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.counters["expired"] += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        ttl = self.ttls.get(key[0], DEFAULT_TTLS[BingResponseType.SEARCH_RESPONSE])
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    async def get_or_fetch(self, key, fetch):
+        # fetch is a coroutine function; it should raise on failure so that
+        # errors are never cached
+        value = self.get(key)
+        if value is not None:
+            self.counters["hits"] += 1
+            return value
+
+        flight = self._in_flight.get(key)
+        if flight is None:
+            self.counters["misses"] += 1
+            flight = self._in_flight[key] = [asyncio.ensure_future(self._fetch(key, fetch)), 0]
+        else:
+            # Someone is already asking upstream, wait for their answer
+            self.counters["coalesced"] += 1
+
+        task = flight[0]
+        flight[1] += 1
+        try:
+            # shield() keeps one impatient caller from cancelling everybody
+            return await asyncio.shield(task)
+        finally:
+            flight[1] -= 1
+            if flight[1] == 0 and not task.done():
+                # Every caller gave up, stop paying for the request
+                task.cancel()
+                if self._in_flight.get(key) is flight:
+                    del self._in_flight[key]
+
+    async def _fetch(self, key, fetch):
+        try:
+            value = await fetch()
+            self.put(key, value)
+            return value
+        finally:
+            # A cancelled flight may already have been replaced by a new one
+            # for the same key; only this flight's own entry is removed
+            flight = self._in_flight.get(key)
+            if flight is not None and flight[0] is asyncio.current_task():
+                del self._in_flight[key]
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        lookups = self.counters["hits"] + self.counters["misses"] + self.counters["coalesced"]
+        return {
+            **self.counters,
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "in_flight": len(self._in_flight),
+            "hit_rate": (self.counters["hits"] + self.counters["coalesced"]) / lookups if lookups else 0.0,
+        }
+
+
+search_cache = SearchCache()
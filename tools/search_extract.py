@@ -0,0 +1,100 @@
+import math
+import os
+import re
+
+# Turns merged Bing hits into the compact text the LLM sees: overlapping
+# snippets are dropped, the rest ranked by how well they match the query and
+# cut to a token budget. The sources used are kept for SMS replies.
+
+# Rough tokens for the whole tool result (4 characters a token)
+SEARCH_TOKEN_BUDGET = int(os.getenv("SEARCH_TOKEN_BUDGET", "300"))
+# Snippets sharing this much of their wording count as the same
+DUPLICATE_OVERLAP = 0.6
+
+LABELS = {"web": "WebPage Snippet", "news": "Article", "image": "Image", "video": "Video"}
+
+STOPWORDS = set("""a an and are as at be by for from has have how i in is it its of on or that the this to was what
+when where which who why will with you your me my do does did can""".split())
+
+
+def approx_tokens(text):
+    return len(text) // 4 + 1
+
+
+def terms(text):
+    return [word for word in re.findall(r"[a-z0-9]+", text.lower()) if word not in STOPWORDS]
+
+
+def _shingles(text, n=3):
+    words = terms(text)
+    return {tuple(words[i:i + n]) for i in range(max(1, len(words) - n + 1))}
+
+
+def dedupe(items):
+    # Keeps the first (best ranked) of any snippets that mostly say the same thing
+    kept, seen = [], []
+    for item in items:
+        shingles = _shingles(item.get('desc') or '')
+        if any(len(shingles & other) / max(1, min(len(shingles), len(other))) >= DUPLICATE_OVERLAP for other in seen):
+            continue
+        seen.append(shingles)
+        kept.append(item)
+    return kept
+
+
+def rank(query, items):
+    # Query term overlap weighted by how rare each term is across the hits,
+    # plus a prior from the order the search merge put them in
+    query_terms = set(terms(query))
+    documents = [set(terms(f"{item.get('title') or ''} {item.get('desc') or ''}")) for item in items]
+    idf = {term: math.log(1 + len(items) / (1 + sum(term in doc for doc in documents))) for term in query_terms}
+    top = sum(idf.values()) or 1.0
+
+    scored = []
+    for position, (item, doc) in enumerate(zip(items, documents)):
+        overlap = sum(idf[term] for term in query_terms if term in doc) / top
+        scored.append((0.7 * overlap + 0.3 / (1 + position), position, item))
+    scored.sort(key=lambda entry: (-entry[0], entry[1]))
+    return [item for _, _, item in scored]
+
+
+def _best_sentences(query, text, budget):
+    # The snippet's sentences that match the query best, in their original
+    # order, within `budget` tokens
+    sentences = list(dict.fromkeys(s.strip() for s in re.split(r"(?<=[.!?])\s+", text) if s.strip()))
+    if approx_tokens(text) <= budget or len(sentences) <= 1:
+        return text[:budget * 4]
+    query_terms = set(terms(query))
+    order = sorted(range(len(sentences)), key=lambda i: -len(query_terms & set(terms(sentences[i]))))
+    chosen, used = set(), 0
+    for i in order:
+        cost = approx_tokens(sentences[i])
+        if used + cost > budget:
+            continue
+        chosen.add(i)
+        used += cost
+    return " ".join(sentences[i] for i in sorted(chosen)) or sentences[order[0]][:budget * 4]
+
+
+def extract(query, items, budget=SEARCH_TOKEN_BUDGET):
+    # (text for the LLM, [source metadata]) within the token budget
+    lines, sources, used = [], [], 0
+    for item in rank(query, dedupe(items)):
+        label = LABELS.get(item.get('type'), "Result")
+        if item.get('type') == 'news' and item.get('author'):
+            label += f" ({item['author']})"
+        remaining = budget - used - approx_tokens(label) - 1
+        if remaining < 12:
+            break
+        desc = _best_sentences(query, item.get('desc') or '', remaining)
+        line = f"{label}: {desc}"
+        lines.append(line)
+        used += approx_tokens(line)
+        sources.append({key: item.get(key) for key in ('type', 'title', 'url', 'author', 'published')})
+    return "\n".join(lines), sources
+
+
+def format_sources(sources, limit=2):
+    # Short "Sources:" footer for SMS replies
+    urls = [source['url'] for source in sources if source.get('url')][:limit]
+    return "Sources: " + " ".join(urls) if urls else ""
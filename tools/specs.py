@@ -0,0 +1,70 @@
+from sound_library import sound_library
+
+# OpenAI-style tool definitions shared by the voice and SMS paths, kept as
+# plain dicts so the SMS path doesn't need to import openai or pipecat
+
+
+def get_tools():
+    return [
+        {
+            "type": "function",
+            "function": {
+                "name": "search_bing",
+                "description": "Search the web. Use this to search up real-time information, current events or weather updates (basically anything that requires latest information).",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "query": {
+                            "type": "string",
+                            "description": "The search query",
+                        },
+                    },
+                    "required": [
+                        "query"],
+                },
+            }
+        },
+        {
+            "type": "function",
+            "function": {
+                "name": "quick_research",
+                "description": "Research a topic in depth. Use this when the user asks you to research, look into or give an overview of a topic, rather than for a single quick fact.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "topic": {
+                            "type": "string",
+                            "description": "The topic to research",
+                        },
+                    },
+                    "required": [
+                        "topic"],
+                },
+            }
+        },
+        {
+            "type": "function",
+            "function": {
+                "name": "toggle_wifi",
+                "description": "Toggle the WiFi",
+            }
+        },
+        {
+            "type": "function",
+            "function": {
+                "name": "play_sound_effect",
+                "description": "Play a sound effect to the caller. Available sound effects: " + ", ".join(sound_library.names()),
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "name": {
+                            "type": "string",
+                            "description": "The name of the sound effect",
+                        },
+                    },
+                    "required": [
+                        "name"],
+                },
+            }
+        }
+    ]
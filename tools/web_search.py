@@ -1,11 +1,19 @@
+import asyncio
 import json
 import os
 import re
+from datetime import datetime, timezone
 from pprint import pprint
-import requests
+
+import aiohttp
 from dotenv import load_dotenv
 from enum import Enum
 
+import clients
+from datatypes import BingResponseType
+from tools.search_cache import search_cache
+from tools.search_extract import extract
+
 # Load environment variables
 load_dotenv()
 
@@ -13,91 +21,235 @@ load_dotenv()
 subscription_key = os.getenv("AZURE_BING_API_KEY")
 endpoint = "https://api.bing.microsoft.com/v7.0/search"
 
+ENDPOINTS = {
+    BingResponseType.SEARCH_RESPONSE: endpoint,
+    BingResponseType.NEWS: "https://api.bing.microsoft.com/v7.0/news/search",
+    BingResponseType.IMAGE: "https://api.bing.microsoft.com/v7.0/images/search",
+    BingResponseType.VIDEO: "https://api.bing.microsoft.com/v7.0/videos/search",
+}
+
+# Deadline for a single Bing round trip, in seconds
+SEARCH_TIMEOUT = float(os.getenv("BING_SEARCH_TIMEOUT", "5"))
+
+# Per-vertical deadlines when several are queried at once. A vertical that
+# misses its deadline is left out of the answer rather than waited on.
+VERTICAL_DEADLINES = {
+    BingResponseType.SEARCH_RESPONSE: 3.0,
+    BingResponseType.NEWS: 2.0,
+    BingResponseType.IMAGE: 1.5,
+    BingResponseType.VIDEO: 1.5,
+}
+
+# Ranking weight of each vertical's top hit
+VERTICAL_WEIGHTS = {
+    BingResponseType.SEARCH_RESPONSE: 1.0,
+    BingResponseType.NEWS: 0.9,
+    BingResponseType.VIDEO: 0.5,
+    BingResponseType.IMAGE: 0.4,
+}
+
+# Candidates handed to the extraction step, see tools/search_extract.py
+MAX_RESULTS = 10
+
+NEWS_WORDS = re.compile(r"\b(news|latest|today|tonight|yesterday|breaking|headlines?|update|announced?|election|"
+                        r"score|won|results?|happening|this week)\b", re.IGNORECASE)
+IMAGE_WORDS = re.compile(r"\b(pictures?|photos?|images?|look like|looks like)\b", re.IGNORECASE)
+VIDEO_WORDS = re.compile(r"\b(videos?|watch|trailer|clip|highlights)\b", re.IGNORECASE)
+
+
+def choose_verticals(query):
+    # Web always; the other verticals only when the query asks for them
+    verticals = [BingResponseType.SEARCH_RESPONSE]
+    if NEWS_WORDS.search(query):
+        verticals.append(BingResponseType.NEWS)
+    if IMAGE_WORDS.search(query):
+        verticals.append(BingResponseType.IMAGE)
+    if VIDEO_WORDS.search(query):
+        verticals.append(BingResponseType.VIDEO)
+    return verticals
+
+
+async def search_bing(query, timeout=SEARCH_TIMEOUT, verticals=None, with_sources=False):
+    # with_sources returns (text, sources) so SMS replies can cite them
+    mkt = 'en-US'
+    verticals = verticals or choose_verticals(query)
+
+    try:
+        if len(verticals) == 1:
+            results = {verticals[0]: await _search_vertical(query, mkt, verticals[0], timeout)}
+        else:
+            results = await _fan_out(query, mkt, verticals, timeout)
+        if not any(results.values()):
+            return _failed(with_sources)
+        text, sources = extract(query, rank_results(results))
+        return (text, sources) if with_sources else text
+
+    except asyncio.TimeoutError:
+        print(f"Error: search timed out after {timeout}s")
+        return _failed(with_sources)
+    except Exception as ex:
+        print(f"Error: {ex}")
+        return _failed(with_sources)
+
+
+def _failed(with_sources):
+    return ("Search failed", []) if with_sources else "Search failed"
+
+
+async def _fan_out(query, mkt, verticals, timeout):
+    # All verticals at once, each under its own deadline
+    async def bounded(vertical):
+        try:
+            return await asyncio.wait_for(
+                _search_vertical(query, mkt, vertical, timeout),
+                min(timeout, VERTICAL_DEADLINES[vertical]))
+        except asyncio.TimeoutError:
+            print(f"Dropped {vertical.name} results, deadline passed")
+        except Exception as ex:
+            print(f"Dropped {vertical.name} results: {ex}")
+        return []
+
+    results = await asyncio.gather(*[bounded(vertical) for vertical in verticals])
+    return dict(zip(verticals, results))
+
+
+async def _search_vertical(query, mkt, vertical, timeout):
+    # Repeated and concurrent identical queries are answered from the cache
+    key = search_cache.key(query, mkt, vertical)
+    return await search_cache.get_or_fetch(key, lambda: _fetch_search(query, mkt, timeout, vertical))
 
-def search_bing(query):
+
+async def _fetch_search(query, mkt, timeout, vertical=BingResponseType.SEARCH_RESPONSE):
     # Construct a request
-    mkt = 'en-US'
     params = {'q': query, 'mkt': mkt}
     headers = {'Ocp-Apim-Subscription-Key': subscription_key}
 
-    # Call the API
-    try:
-        response = requests.get(endpoint, headers=headers, params=params)
+    # Call the API. Cancelling the awaiting task aborts the request and
+    # releases the connection back to the pool.
+    async with clients.http_session().get(ENDPOINTS[vertical], headers=headers, params=params,
+                                 timeout=aiohttp.ClientTimeout(total=timeout)) as response:
         response.raise_for_status()
+        return HANDLERS[vertical](await response.json())
 
-        return handle_search_response(response.json())
 
-    except Exception as ex:
-        print(f"Error: {ex}")
-        return "Search failed"
+def _age_hours(published):
+    try:
+        published = datetime.fromisoformat(published.replace("Z", "+00:00").split(".")[0])
+    except (AttributeError, ValueError):
+        return None
+    if published.tzinfo is None:
+        published = published.replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - published).total_seconds() / 3600
+
+
+def rank_results(results):
+    # Merges the verticals into one list: each hit scores its vertical's
+    # weight discounted by its rank, news gets a bonus for being recent, and
+    # pages that show up in several verticals are kept once
+    scored = []
+    for vertical, items in results.items():
+        for rank, item in enumerate(items):
+            score = VERTICAL_WEIGHTS[vertical] / (1 + 0.5 * rank)
+            age = _age_hours(item.get('published'))
+            if age is not None and age < 24:
+                score += 0.3 * (1 - age / 24)
+            scored.append((score, item))
+    scored.sort(key=lambda pair: pair[0], reverse=True)
+
+    seen = set()
+    ranked = []
+    for _, item in scored:
+        url = (item.get('url') or '').rstrip('/')
+        if url in seen:
+            continue
+        seen.add(url)
+        ranked.append(item)
+    return ranked[:MAX_RESULTS]
 
 
 def handle_search_response(response):
     web_descs = []
     for value in response.get('webPages', {}).get('value', []):
         news = {
+            'type': 'web',
             'url': value['url'],
             'title': value['name'],
             'author': value['displayUrl'],
             'image': value.get('thumbnailUrl'),
-            'desc': value['snippet']
+            'desc': value['snippet'],
+            'published': value.get('datePublished'),
         }
-        web_descs.append(value['snippet'])
-        #print(news)  # Simulate sending a message
+        web_descs.append(news)
 
-    web_desc_str = "WebPage Snippet:" + "\nWebPage Snippet: ".join(web_descs[:5])
-    return web_desc_str
+    return web_descs[:8]
 
 
 def handle_image_response(response):
     img_descs = []
     for value in response.get('value', []):
         news = {
-            'url': value['hostPageDisplayUrl'],
+            'type': 'image',
+            'url': value.get('hostPageUrl', value['hostPageDisplayUrl']),
             'image': value['thumbnailUrl'],
             'desc': value['name'],
             'full_image': value['contentUrl']
         }
-        img_descs.append(value['name'])
-        print(news)  # Simulate sending a message
-
-    img_desc_str = "Image" + "\nImage: ".join(img_descs[:3])
+        img_descs.append(news)
 
-    return img_desc_str
+    return img_descs[:3]
 
 
 def handle_video_response(response):
     regex = r'src="([^"]+)"'
-    match = re.search(regex, response.get('value', [])[0].get('embedHtml', ''))
-    src_value = match.group(1) if match else ''
-    value = src_value.split('?')[0] if src_value else ''
-    news = {
-        'value': value,
-        'alt': response.get('value', [])[0].get('name')
-    }
-
-    return news
+    videos = []
+    for video in response.get('value', [])[:3]:
+        match = re.search(regex, video.get('embedHtml', ''))
+        src_value = match.group(1) if match else ''
+        videos.append({
+            'type': 'video',
+            'url': video.get('hostPageUrl') or video.get('contentUrl'),
+            'value': src_value.split('?')[0] if src_value else '',
+            'alt': video.get('name'),
+            'desc': video.get('description') or video.get('name'),
+            'author': video['publisher'][0]['name'] if video.get('publisher') else None,
+            'published': video.get('datePublished'),
+        })
+
+    return videos
 
 
 def handle_news_response(response):
     descs = []
     for value in response.get('value', []):
         news = {
+            'type': 'news',
             'url': value['url'],
             'title': value['name'],
             'author': value['provider'][0]['name'] if value.get('provider') else 'Unknown',
             'image': value.get('image', {}).get('thumbnail', {}).get('contentUrl'),
-            'desc': value['description']
+            'desc': value['description'],
+            'published': value.get('datePublished'),
         }
-        descs.append(value['description'])
-        #print(news)  # Simulate sending a message
+        descs.append(news)
 
-    desc_str = "Article" + "\nArticle: ".join(descs[:3])
-    return desc_str
+    return descs[:5]
 
 
-if __name__ == "__main__":
+HANDLERS = {
+    BingResponseType.SEARCH_RESPONSE: handle_search_response,
+    BingResponseType.NEWS: handle_news_response,
+    BingResponseType.IMAGE: handle_image_response,
+    BingResponseType.VIDEO: handle_video_response,
+}
+
+
+async def main():
     query = "Microsoft Cognitive Services"
 
-    response = search_bing(query)
+    response = await search_bing(query)
     print(response)
+    await clients.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,44 +1,172 @@
+import atexit
+import os
+import threading
+import time
+
 from selenium import webdriver
+from selenium.common.exceptions import TimeoutException, WebDriverException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.chrome.service import Service
 from webdriver_manager.chrome import ChromeDriverManager
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-import time
+from loguru import logger
 
-def toggle_wifi():
-    #s = Service('/usr/bin/chromedriver')
-    s = Service(ChromeDriverManager().install())
-    driver = webdriver.Chrome(service=s)
+ROUTER_URL = os.getenv("ROUTER_URL", "http://192.168.2.1")
+ROUTER_PASSWORD = os.getenv("ROUTER_PASSWORD", "NQS142336000280")
+HEADLESS = os.getenv("WIFI_HEADLESS", "1") != "0"
 
-    try:
-        # Navigate to Wifi Router
-        driver.get("http://192.168.2.1")
+# Close the browser after this many idle seconds to give the memory back
+SESSION_IDLE_TIMEOUT = float(os.getenv("WIFI_SESSION_IDLE_TIMEOUT", "600"))
+# How long to wait for the router to acknowledge a save
+SAVE_TIMEOUT = 5
 
-        # Wait for the page to load and click on manageWifi
-        wait = WebDriverWait(driver, 20)
+_driver_path = None
+
+
+def driver_path():
+    # ChromeDriverManager hits the network, only resolve the driver once
+    global _driver_path
+    if _driver_path is None:
+        _driver_path = ChromeDriverManager().install()
+        #_driver_path = '/usr/bin/chromedriver'
+    return _driver_path
+
+
+class RouterSession:
+    # Keeps one headless Chrome logged into the router between toggles and
+    # serializes concurrent requests on it
+
+    def __init__(self, url=ROUTER_URL, password=ROUTER_PASSWORD, headless=HEADLESS):
+        self.url = url
+        self.password = password
+        self.headless = headless
+        self._driver = None
+        self._lock = threading.Lock()
+        self._idle_timer = None
+        self.counters = {"toggles": 0, "launches": 0, "logins": 0}
+
+    def _ensure_driver(self):
+        if self._driver is not None:
+            try:
+                self._driver.current_url
+                return self._driver
+            except WebDriverException:
+                logger.warning("Router browser session died, starting a new one")
+                self._quit()
+
+        options = webdriver.ChromeOptions()
+        if self.headless:
+            options.add_argument("--headless=new")
+        options.add_argument("--disable-gpu")
+        options.add_argument("--no-sandbox")
+        self._driver = webdriver.Chrome(service=Service(driver_path()), options=options)
+        self.counters["launches"] += 1
+        return self._driver
+
+    def _open_wifi_settings(self, driver, wait):
+        # Navigate to Wifi Router and click on manageWifi
+        driver.get(self.url)
         manage_wifi = wait.until(EC.element_to_be_clickable((By.ID, "manageWifi")))
         manage_wifi.click()
 
-        # Wait for the password field to be present and enter the pass
-        password = wait.until(EC.presence_of_element_located((By.ID, "password")))
-        password.send_keys("NQS142336000280")
-        password.send_keys(Keys.RETURN)
+        # The router only asks for the password when the session has expired
+        element = wait.until(EC.any_of(
+            EC.visibility_of_element_located((By.ID, "password")),
+            EC.element_to_be_clickable((By.ID, "masterToggle"))))
+        if element.get_attribute("id") == "password":
+            element.send_keys(self.password)
+            element.send_keys(Keys.RETURN)
+            self.counters["logins"] += 1
+            element = wait.until(EC.element_to_be_clickable((By.ID, "masterToggle")))
+        return element
 
-        # Wait for the masterToggle to be clickable and toggle it
-        master_toggle = wait.until(EC.element_to_be_clickable((By.ID, "masterToggle")))
+    def _toggle(self, driver, initial):
+        # `initial` holds the switch state the first attempt found. A retry
+        # that finds it flipped knows the failed attempt's save went through
+        # and must not flip it back.
+        wait = WebDriverWait(driver, 20)
+        master_toggle = self._open_wifi_settings(driver, wait)
+        state = master_toggle.is_selected()
+        if initial and state != initial[0]:
+            logger.info("Wifi was toggled by the failed attempt, not toggling again")
+            return
+        if not initial:
+            initial.append(state)
         master_toggle.click()
 
-        # Wait for formSave to be clickable and click it
         form_save = wait.until(EC.element_to_be_clickable((By.ID, "formSave")))
         form_save.click()
 
-        # Optionally wait for some time to ensure changes are applied
-        time.sleep(5)  # Let the user actually see something!
+        # Wait for the router to take the save (page reload or the button
+        # disabling) instead of sleeping a fixed time
+        try:
+            WebDriverWait(driver, SAVE_TIMEOUT).until(EC.any_of(
+                EC.staleness_of(form_save),
+                lambda d: not form_save.is_enabled()))
+        except TimeoutException:
+            logger.warning("Router did not acknowledge the save, assuming it was applied")
+
+    def wifi_enabled(self):
+        # Reads the switch without changing it
+        with self._lock:
+            self._cancel_idle_timer()
+            try:
+                driver = self._ensure_driver()
+                return self._open_wifi_settings(driver, WebDriverWait(driver, 20)).is_selected()
+            finally:
+                self._schedule_idle_timer()
+
+    def toggle(self):
+        with self._lock:
+            self._cancel_idle_timer()
+            try:
+                # One retry with a fresh browser if the old one went bad
+                initial = []
+                for attempt in range(2):
+                    try:
+                        self._toggle(self._ensure_driver(), initial)
+                        self.counters["toggles"] += 1
+                        return "The wifi has been toggled."
+                    except WebDriverException:
+                        self._quit()
+                        if attempt:
+                            raise
+            finally:
+                self._schedule_idle_timer()
+
+    def _schedule_idle_timer(self):
+        if self._driver is not None and SESSION_IDLE_TIMEOUT > 0:
+            self._idle_timer = threading.Timer(SESSION_IDLE_TIMEOUT, self.close)
+            self._idle_timer.daemon = True
+            self._idle_timer.start()
+
+    def _cancel_idle_timer(self):
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+            self._idle_timer = None
 
-    finally:
-        # Ensure browser closes even if there is an error
-        driver.quit()
+    def _quit(self):
+        if self._driver is not None:
+            try:
+                self._driver.quit()
+            except WebDriverException:
+                pass
+        self._driver = None
 
-    return "The wifi has been toggled."
+    def close(self):
+        with self._lock:
+            self._cancel_idle_timer()
+            self._quit()
+
+
+router_session = RouterSession()
+atexit.register(router_session.close)
+
+
+def toggle_wifi():
+    started = time.perf_counter()
+    result = router_session.toggle()
+    logger.debug(f"Toggled wifi in {time.perf_counter() - started:.2f}s")
+    return result
@@ -0,0 +1,107 @@
+import time
+
+from pipecat.frames.frames import AudioRawFrame, TextFrame, TranscriptionFrame, UserStoppedSpeakingFrame
+from pipecat.processors.frame_processor import FrameDirection, FrameProcessor
+from pipecat.serializers.twilio import TwilioFrameSerializer
+
+import journal
+import metrics
+
+
+class TurnTracker:
+    # Timestamps the hot-path events of one voice turn and feeds the per-stage
+    # latencies into the process-wide histograms when the first audio goes out.
+    #
+    # vad_end -> stt_final -> llm_first_token -> tts_first_byte -> audio_out
+    # (tool_start / tool_end in between when the LLM calls a function)
+
+    def __init__(self, call_id=None):
+        self.call_id = call_id
+        self.marks = {}
+        self.turns = 0
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        if stage == "vad_end":
+            self.marks = {"vad_end": now}
+            return
+        if "vad_end" not in self.marks:
+            # Greeting or a turn that already finished
+            return
+        if stage == "stt_final":
+            # Deepgram can send several finals per utterance, the last one counts
+            self.marks[stage] = now
+            return
+        self.marks.setdefault(stage, now)
+        if stage == "audio_out":
+            self._finish()
+
+    def _observe(self, stage, start, end, stages):
+        if start in self.marks and end in self.marks:
+            stages[stage] = max(0.0, self.marks[end] - self.marks[start])
+            metrics.turn_stage_seconds.observe(stages[stage], stage=stage)
+
+    def _finish(self):
+        marks = self.marks
+        # The LLM request goes out once both the speech and the transcript ended
+        if "stt_final" in marks:
+            marks["llm_request"] = max(marks["vad_end"], marks["stt_final"])
+        stages = {}
+        self._observe("stt", "vad_end", "stt_final", stages)
+        self._observe("llm_first_token", "llm_request", "llm_first_token", stages)
+        self._observe("tool", "tool_start", "tool_end", stages)
+        self._observe("tts_first_byte", "llm_first_token", "tts_first_byte", stages)
+        self._observe("output", "tts_first_byte", "audio_out", stages)
+        mouth_to_ear = marks["audio_out"] - marks["vad_end"]
+        metrics.turn_mouth_to_ear_seconds.observe(mouth_to_ear)
+        self.turns += 1
+        journal.record("turn", call=self.call_id, turn=self.turns, mouth_to_ear=round(mouth_to_ear, 3),
+                       stages={stage: round(seconds, 3) for stage, seconds in stages.items()})
+        self.marks = {}
+
+
+class TurnProbe(FrameProcessor):
+    # Pass-through processor that marks a stage when a frame type goes by
+
+    def __init__(self, tracker, marks):
+        super().__init__()
+        self._tracker = tracker
+        self._marks = marks  # [(frame class, stage)]
+
+    async def process_frame(self, frame, direction):
+        await super().process_frame(frame, direction)
+        if direction == FrameDirection.DOWNSTREAM:
+            for frame_type, stage in self._marks:
+                if isinstance(frame, frame_type):
+                    self._tracker.mark(stage)
+        await self.push_frame(frame, direction)
+
+
+def vad_probe(tracker):
+    return TurnProbe(tracker, [(UserStoppedSpeakingFrame, "vad_end")])
+
+
+def stt_probe(tracker):
+    return TurnProbe(tracker, [(TranscriptionFrame, "stt_final")])
+
+
+def llm_probe(tracker):
+    return TurnProbe(tracker, [(TextFrame, "llm_first_token")])
+
+
+def tts_probe(tracker):
+    return TurnProbe(tracker, [(AudioRawFrame, "tts_first_byte")])
+
+
+class TimedTwilioFrameSerializer(TwilioFrameSerializer):
+    # Serialization happens right before the websocket send, so this is the
+    # closest we get to the first byte leaving for the caller
+
+    def __init__(self, stream_sid, tracker):
+        super().__init__(stream_sid)
+        self._tracker = tracker
+
+    def serialize(self, frame):
+        if isinstance(frame, AudioRawFrame):
+            self._tracker.mark("audio_out")
+        return super().serialize(frame)